@@ -0,0 +1,135 @@
+"""
+Benchmark del parsing dei feed Atom di arXiv: parser originale (ET.fromstring sul body intero)
+contro il parser incrementale di ArxivApiClient (XMLPullParser a blocchi + clear delle entry).
+
+Misura il picco di memoria (tracemalloc) e le entry al secondo.
+
+Uso (dalla root del repo):
+    python -m benchmarks.bench_arxiv_feed_parsing                       # feed sintetico
+    python -m benchmarks.bench_arxiv_feed_parsing --record "all:LLM"    # registra un feed reale
+    python -m benchmarks.bench_arxiv_feed_parsing --fixture data/fixtures/arxiv_feed.xml
+"""
+import argparse
+import os
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+import requests
+
+from states.ArxivState import ArticleMetadata
+from nodes.crawlers.ArxivApiClient import ArxivApiClient, namespaces
+
+
+DEFAULT_FIXTURE = "data/fixtures/arxiv_feed.xml"
+CHUNK_SIZE = 64 * 1024
+
+
+def record_feed(search_query: str, path: str, max_results: int = 2000) -> None:
+    """
+    Scarica un feed reale dall'API arXiv e lo salva come fixture.
+    """
+    params = {'search_query': search_query, 'start': 0, 'max_results': max_results}
+    response = requests.get("http://export.arxiv.org/api/query?", params=params)
+    response.raise_for_status()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(response.content)
+    print(f"✅ Feed registrato in '{path}' ({len(response.content) / 1e6:.1f} MB)")
+
+
+def synthetic_feed(n_entries: int = 5000) -> bytes:
+    """
+    Genera un feed con la stessa struttura di quello restituito dall'API arXiv.
+    """
+    abstract = " ".join(["We study large language models and their generalization."] * 20)
+    entries = []
+    for i in range(n_entries):
+        authors = "".join(f"<author><name>Author {i}-{a}</name></author>" for a in range(6))
+        entries.append(
+            f"<entry><id>http://arxiv.org/abs/2508.{i:05d}v1</id>"
+            f"<updated>2025-08-07T17:59:04Z</updated><published>2025-08-07T17:59:04Z</published>"
+            f"<title>Paper {i}:\n  a synthetic title</title><summary>{abstract}\n</summary>{authors}"
+            f"<link href=\"http://arxiv.org/abs/2508.{i:05d}v1\" rel=\"alternate\" type=\"text/html\"/>"
+            f"<arxiv:primary_category term=\"cs.CL\"/></entry>"
+        )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<feed xmlns="{namespaces["atom"]}" xmlns:opensearch="{namespaces["opensearch"]}" xmlns:arxiv="{namespaces["arxiv"]}">'
+        f'<opensearch:totalResults>{n_entries}</opensearch:totalResults>'
+        + "".join(entries) + "</feed>"
+    ).encode("utf-8")
+
+
+def legacy_parse(content: bytes) -> int:
+    """
+    Implementazione originale: albero completo in memoria e tre find('atom:id') per entry.
+    """
+    root = ET.fromstring(content)
+    articles = []
+    for entry in root.findall('atom:entry', namespaces):
+        articles.append(ArticleMetadata(
+            id=entry.find('atom:id', namespaces).text,
+            pdf_id=entry.find('atom:id', namespaces).text.replace('abs','pdf'),
+            html_id=entry.find('atom:id', namespaces).text.replace('abs','html'),
+            title=entry.find('atom:title', namespaces).text.strip().replace('\n', ' '),
+            published=entry.find('atom:published', namespaces).text,
+            updated=entry.find('atom:updated', namespaces).text,
+            abstract=entry.find('atom:summary', namespaces).text.strip().replace('\n', ' '),
+            authors=[author.find('atom:name', namespaces).text for author in entry.findall('atom:author', namespaces)]
+        ))
+    return len(articles)
+
+
+def run(label: str, func) -> None:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<12} entries={count:<6} peak={peak / 1e6:8.1f} MB  {count / elapsed:10.0f} entries/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE)
+    parser.add_argument("--record", metavar="SEARCH_QUERY", default=None)
+    parser.add_argument("--entries", type=int, default=5000, help="entry del feed sintetico")
+    args = parser.parse_args()
+
+    if args.record:
+        record_feed(args.record, args.fixture)
+
+    client = ArxivApiClient()
+
+    if os.path.isfile(args.fixture):
+        print(f"Fixture: {args.fixture}")
+
+        def legacy():
+            # Il client originale riceveva l'intero body in memoria prima del parsing
+            with open(args.fixture, "rb") as f:
+                return legacy_parse(f.read())
+
+        def streaming():
+            with open(args.fixture, "rb") as f:
+                articles, _ = client._parse_feed(iter(lambda: f.read(CHUNK_SIZE), b""))
+                return len(articles)
+    else:
+        print(f"Fixture non trovata, uso un feed sintetico di {args.entries} entry")
+        content = synthetic_feed(args.entries)
+
+        def legacy():
+            return legacy_parse(bytes(content))
+
+        def streaming():
+            blocks = (content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE))
+            articles, _ = client._parse_feed(blocks)
+            return len(articles)
+
+    run("legacy", legacy)
+    run("streaming", streaming)
+
+
+if __name__ == "__main__":
+    main()
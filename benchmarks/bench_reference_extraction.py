@@ -0,0 +1,125 @@
+"""
+Benchmark dell'estrazione delle references arXiv: parser a regex di ArxivReferencesExtractor
+(utils.arxiv_ids.find_arxiv_ids) su sezioni References reali.
+
+Per ogni sezione misura il tempo di parsing e quanta parte del testo va ancora all'LLM
+(solo le voci che citano arXiv senza un ID riconoscibile), contro l'implementazione originale
+che inviava a Gemini l'intera sezione.
+
+Uso (dalla root del repo):
+    python -m benchmarks.bench_reference_extraction --record https://arxiv.org/html/2508.15260 ...
+    python -m benchmarks.bench_reference_extraction                    # usa le fixture registrate
+Senza fixture usa un corpus sintetico costruito con gli ID reali di data/arxiv_crawled_data.md
+negli stili di citazione più comuni.
+"""
+import argparse
+import ast
+import asyncio
+import glob
+import os
+import random
+import time
+from typing import List
+
+from nodes.chunker.SectionChunker import SectionChunker
+from nodes.preprocessors.ArxivReferencesExtractor import ArxivReferencesExtractor
+
+
+DEFAULT_FIXTURE_DIR = "data/fixtures/references"
+ARTICLES_FIXTURE = "data/arxiv_crawled_data.md"
+
+# Stili di citazione: {id} è l'ID arXiv, {authors}/{title} dai metadati della fixture
+CITATION_STYLES = [
+    "{authors}. {title}. arXiv preprint arXiv:{id}, 2025.",
+    "{authors}. {title}. CoRR, abs/{id}, 2025.",
+    "{authors}. {title}. https://arxiv.org/abs/{id}",
+    "{authors}. {title}. doi:10.48550/arXiv.{id}",
+    "{authors}. {title}. In Proceedings of ACL, pages 1234–1245, 2024.",
+    "{authors}. {title}. arXiv preprint, 2025.",
+]
+
+
+async def record_sections(urls: List[str], fixture_dir: str) -> None:
+    """
+    Scarica le pagine HTML arXiv e salva la sezione References di ognuna come fixture.
+    """
+    from utils.StaticHtmlClient import StaticHtmlClient
+
+    client = StaticHtmlClient()
+    chunker = SectionChunker()
+    os.makedirs(fixture_dir, exist_ok=True)
+    try:
+        for url in urls:
+            markdown = await client.fetch_markdown(url)
+            sections = chunker.chunk_by_section(markdown or "")
+            key = next((k for k in sections if "references" in k or "bibliography" in k), None)
+            if key is None:
+                print(f"⚠️ Nessuna sezione References in '{url}'")
+                continue
+            path = os.path.join(fixture_dir, f"{url.rstrip('/').rsplit('/', 1)[-1]}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(sections[key])
+            print(f"✅ Sezione References salvata in '{path}'")
+    finally:
+        await client.close()
+
+
+def synthetic_sections(n_sections: int = 50, entries_per_section: int = 60) -> List[str]:
+    with open(ARTICLES_FIXTURE, "r", encoding="utf-8") as f:
+        articles = ast.literal_eval(f.read().strip())
+    rng = random.Random(0)
+    sections = []
+    for _ in range(n_sections):
+        entries = []
+        for i in range(1, entries_per_section + 1):
+            article = rng.choice(articles)
+            arxiv_id = article['id'].rsplit('/', 1)[-1]
+            style = rng.choice(CITATION_STYLES)
+            entries.append(f"\\[{i}\\] " + style.format(authors=", ".join(article['authors'][:3]), title=article['title'], id=arxiv_id))
+        sections.append("\n".join(entries))
+    return sections
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixture-dir", default=DEFAULT_FIXTURE_DIR)
+    parser.add_argument("--record", nargs="+", metavar="URL", default=None)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record_sections(args.record, args.fixture_dir))
+
+    paths = sorted(glob.glob(os.path.join(args.fixture_dir, "*.md")))
+    if paths:
+        sections = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                sections.append(f.read())
+        print(f"Fixture: {len(sections)} sezioni References da '{args.fixture_dir}'")
+    else:
+        sections = synthetic_sections()
+        print(f"Fixture non trovate, uso {len(sections)} sezioni sintetiche da '{ARTICLES_FIXTURE}'")
+
+    extractor = ArxivReferencesExtractor(llm=None, reference_prompt="")
+
+    best = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        results = [extractor.parse_references(section) for section in sections]
+        best = min(best, time.perf_counter() - t0)
+
+    n_ids = sum(len(ids) for ids, _ in results)
+    n_unresolved = sum(len(unresolved) for _, unresolved in results)
+    chars_total = sum(map(len, sections))
+    chars_llm = sum(len("\n".join(unresolved)) for _, unresolved in results)
+    sections_llm = sum(1 for _, unresolved in results if unresolved)
+
+    print(f"parsing: {best / len(sections) * 1e6:8.1f} µs/sezione  ({chars_total / best / 1e6:.1f} MB/s)")
+    print(f"ID arXiv trovati: {n_ids}, voci non risolte (LLM): {n_unresolved}")
+    print(f"sezioni che richiedono l'LLM: {sections_llm}/{len(sections)}")
+    print(f"caratteri inviati all'LLM: {chars_llm} su {chars_total} ({chars_llm / max(chars_total, 1):.1%} dell'originale)")
+
+
+if __name__ == "__main__":
+    main()
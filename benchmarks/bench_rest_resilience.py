@@ -0,0 +1,136 @@
+"""
+Benchmark di ResilientRestClient contro il vecchio RestErrorHandler (retry ricorsivo con
+time.sleep(1) fisso) su un backend LLM REST simulato (benchmarks/fake_rest_llm_server.py).
+
+Scenari:
+- tail:   latenza 20 ms con il 2% delle richieste a 500 ms -> p50/p95/p99 con e senza hedging;
+- flaky:  20% di risposte success: false -> esito e tempo per chiamata;
+- outage: backend degradato (success: false) per i primi 3 s, chiamanti concorrenti -> richieste inviate al backend
+          (il carico che un backend degradato deve assorbire) e latenza dei chiamanti.
+
+Uso (dalla root del repo):
+    python -m benchmarks.bench_rest_resilience
+    python -m benchmarks.bench_rest_resilience --scenario tail --calls 500
+"""
+import argparse
+import statistics
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import requests
+
+from benchmarks.fake_rest_llm_server import FakeLLMServer
+from utils.GeminiErrorHandler import RetryPolicy
+from utils.ResilientRestClient import CircuitOpenError, ResilientRestClient, RestLLMEndpoint
+
+
+def legacy_rest_invoke_with_retry(llm, prompt, max_retries=5, retry_count=0):
+    """
+    Implementazione originale di RestErrorHandler/RestLLMInvokeErrorHandler (senza le stampe).
+    """
+    try:
+        result = llm.invoke(prompt)
+        if isinstance(result, dict) and result.get("success") is True:
+            return result["response"]
+        elif isinstance(result, dict) and result.get("success") is False:
+            if retry_count < max_retries:
+                time.sleep(1)
+                return legacy_rest_invoke_with_retry(llm, prompt, max_retries, retry_count + 1)
+            raise RuntimeError("Max retries exceeded (REST).")
+        else:
+            raise RuntimeError(f"Formato risposta non riconosciuto: {result}")
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(f"Errore HTTP REST: {e}")
+
+
+def run_calls(label: str, server: FakeLLMServer, call: Callable[[str], str], n_calls: int, concurrency: int = 1) -> None:
+    """
+    Esegue n_calls chiamate (con concurrency thread) e stampa esiti, percentili e carico sul server.
+    """
+    latencies: List[float] = []
+    failures = 0
+    requests_before = server.requests
+
+    def one(i: int) -> None:
+        nonlocal failures
+        t0 = time.perf_counter()
+        try:
+            call(f"prompt {i}")
+        except Exception:
+            failures += 1
+        latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n_calls)))
+    wall = time.perf_counter() - t0
+
+    q = statistics.quantiles(latencies, n=100)
+    print(
+        f"  {label:<24} ok={n_calls - failures:4d}/{n_calls}  p50={q[49] * 1000:7.1f} ms  p95={q[94] * 1000:7.1f} ms  "
+        f"p99={q[98] * 1000:7.1f} ms  richieste al backend={server.requests - requests_before:5d}  wall={wall:5.1f}s"
+    )
+
+
+def scenario_tail(n_calls: int) -> None:
+    print("tail: 20 ms, 2% delle richieste a 500 ms")
+    with FakeLLMServer(latency=0.02, tail_rate=0.02, tail_latency=0.5, seed=1) as server:
+        endpoint = RestLLMEndpoint(server.url)
+        run_calls("legacy", server, lambda p: legacy_rest_invoke_with_retry(endpoint, p), n_calls)
+        client = ResilientRestClient(deadline=5.0)
+        run_calls("resilient", server, lambda p: client.invoke(endpoint, p), n_calls)
+        hedging = ResilientRestClient(deadline=5.0, hedge=True)
+        run_calls("resilient + hedging", server, lambda p: hedging.invoke(endpoint, p), n_calls)
+        print(f"  richieste duplicate (hedging): {hedging.stats()['hedged']}")
+
+
+def scenario_flaky(n_calls: int) -> None:
+    print("flaky: 20% di risposte success: false")
+    with FakeLLMServer(latency=0.01, failure_rate=0.2, seed=2) as server:
+        endpoint = RestLLMEndpoint(server.url)
+        run_calls("legacy", server, lambda p: legacy_rest_invoke_with_retry(endpoint, p), n_calls // 4)
+        client = ResilientRestClient(policy=RetryPolicy(base_delay=0.05, max_delay=1.0), deadline=5.0, failure_threshold=10)
+        run_calls("resilient", server, lambda p: client.invoke(endpoint, p), n_calls // 4)
+
+
+def scenario_outage(n_calls: int) -> None:
+    print("outage: success: false per i primi 3 s, 16 chiamanti concorrenti")
+    for label in ("legacy", "resilient"):
+        with FakeLLMServer(latency=0.01, outage=(0.0, 3.0), outage_status=200, seed=3) as server:
+            endpoint = RestLLMEndpoint(server.url)
+            if label == "legacy":
+                call = lambda p, endpoint=endpoint: legacy_rest_invoke_with_retry(endpoint, p)
+            else:
+                client = ResilientRestClient(policy=RetryPolicy(base_delay=0.2, max_delay=2.0), deadline=10.0, failure_threshold=5, recovery_timeout=0.5)
+
+                def call(p, client=client, endpoint=endpoint):
+                    # Circuito aperto: il chiamante non carica il backend e riprova più tardi
+                    for _ in range(100):
+                        try:
+                            return client.invoke(endpoint, p)
+                        except CircuitOpenError:
+                            time.sleep(0.1)
+                    raise RuntimeError("backend non disponibile")
+            run_calls(label, server, call, n_calls // 4, concurrency=16)
+
+
+SCENARIOS = {"tail": scenario_tail, "flaky": scenario_flaky, "outage": scenario_outage}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=300)
+    args = parser.parse_args()
+
+    for name in args.scenario:
+        try:
+            SCENARIOS[name](args.calls)
+        except Exception:
+            traceback.print_exc()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark di SectionChunker: implementazione originale (re.findall con corpo lazy [\\s\\S]*? e
+lookahead, re.sub non precompilati per ogni titolo) contro lo scanner a singola passata per righe.
+
+data/arxiv_crawled_data.md contiene i metadati degli abstract (repr Python) e non ha titoli
+markdown: il benchmark lo misura così com'è e ne ricava due documenti markdown:
+- "markdown": una sezione '##' per articolo con sottosezioni '###' e '####' (molti titoli brevi);
+- "paper": pochi titoli e sezioni lunghe, come un paper reale, dove il corpo lazy della
+  regex originale pesa di più.
+
+Misura anche il picco di memoria (tracemalloc) per paper: lettura completa del file + dizionario
+delle sezioni, contro le modalità streaming (mmap del file e flusso gzip come nella cache delle
+pagine) che consumano una sezione alla volta.
+
+Uso (dalla root del repo):
+    python -m benchmarks.bench_section_chunker
+    python -m benchmarks.bench_section_chunker --fixture data/arxiv_crawled_data.md --repeat 5
+"""
+import argparse
+import ast
+import gzip
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+from nodes.chunker.SectionChunker import SectionChunker
+
+
+DEFAULT_FIXTURE = "data/arxiv_crawled_data.md"
+
+
+def legacy_chunk_by_section(chunker: SectionChunker, document_text: str) -> Dict[str, str]:
+    """
+    Implementazione originale di SectionChunker.chunk_by_section.
+    """
+    sections = {}
+    document_text = "\n" + document_text.strip()
+    pattern = r"(\n(##\s.+|###\s.+))([\s\S]*?)(?=\n(##\s|###\s|$))"
+    for match in re.findall(pattern, document_text):
+        full_title_line = match[1].strip()
+        content = match[2].strip()
+        title = re.sub(r'^(##\s|###\s|####\s|#####\s)', '', full_title_line).strip()
+        key = chunker.normalize_title_as_key(title)
+        sections[key] = content
+    return sections
+
+
+def load_articles(raw: str) -> List[Dict]:
+    try:
+        return ast.literal_eval(raw.strip())
+    except (ValueError, SyntaxError):
+        return []
+
+
+def fixture_to_markdown(articles: List[Dict]) -> str:
+    """
+    Converte la lista di articoli della fixture in un documento markdown a sezioni.
+    """
+    parts = []
+    for i, article in enumerate(articles, start=1):
+        parts.append(f"## {i}. {article.get('title', '')}\n\n{article.get('abstract', '')}\n")
+        parts.append(f"### {i}.1 Authors\n\n" + "\n".join(f"- {a}" for a in article.get('authors', [])) + "\n")
+        parts.append(f"#### {i}.1.1 Dates\n\npublished: {article.get('published')}\nupdated: {article.get('updated')}\n")
+    return "\n".join(parts)
+
+
+def fixture_to_paper(articles: List[Dict], n_sections: int = 20) -> str:
+    """
+    Documento con n_sections sezioni lunghe, ognuna con tutti gli abstract della fixture.
+    """
+    body = "\n\n".join(article.get('abstract', '') for article in articles)
+    return "\n".join(f"## {i} Section\n\n{body}\n" for i in range(1, n_sections + 1))
+
+
+def run(label: str, func, repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        sections = func()
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:<22} sections={len(sections):<6} best={best * 1000:9.2f} ms")
+
+
+def peak_memory(label: str, func) -> None:
+    tracemalloc.start()
+    count = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} sections={count:<6} peak={peak / 1e6:8.2f} MB")
+
+
+def bench_memory(chunker: SectionChunker, name: str, text: str) -> None:
+    """
+    Picco di memoria per leggere e sezionare un documento salvato su disco (in chiaro e gzip).
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "paper.md")
+        gz_path = f"{path}.gz"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        with gzip.open(gz_path, "wt", encoding="utf-8") as f:
+            f.write(text)
+
+        def load_all():
+            with open(path, "r", encoding="utf-8") as f:
+                return len(chunker.chunk_by_section(f.read()))
+
+        def consume(sections):
+            # Il consumatore elabora una sezione e la rilascia prima della successiva
+            return sum(1 for _ in sections)
+
+        def from_gzip():
+            with gzip.open(gz_path, "rb") as f:
+                return consume(chunker.iter_stream_sections(f))
+
+        print(f"{name} (memoria):")
+        peak_memory("  read + dict", load_all)
+        peak_memory("  mmap stream", lambda: consume(chunker.iter_file_sections(path)))
+        peak_memory("  gzip stream", from_gzip)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.fixture, "r", encoding="utf-8") as f:
+        raw = f.read()
+    articles = load_articles(raw)
+    documents = [("fixture", raw)]
+    if articles:
+        documents += [("markdown", fixture_to_markdown(articles)), ("paper", fixture_to_paper(articles))]
+
+    chunker = SectionChunker()
+    for name, text in documents:
+        print(f"{name}: {len(text) / 1e3:.0f} KB, {text.count(chr(10)) + 1} righe")
+        run("  legacy", lambda: legacy_chunk_by_section(chunker, text), args.repeat)
+        run("  scanner", lambda: chunker.chunk_by_section(text), args.repeat)
+        run("  scanner (solo span)", lambda: chunker.scan_sections(text), args.repeat)
+
+    for name, text in documents[1:]:
+        bench_memory(chunker, name, text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Micro-benchmark della normalizzazione del testo: _clean_text originale (NFD + encode ASCII + lower
++ re.sub non precompilato, una stringa alla volta) contro utils.text_normalization
+(fast path ASCII, split/join, API batch con pool di processi oltre la soglia).
+
+I testi sono gli abstract e i titoli di data/arxiv_crawled_data.md, replicati --scale volte
+per simulare un batch grande (es. tutte le sezioni di molti paper).
+
+Uso (dalla root del repo):
+    python -m benchmarks.bench_text_normalization
+    python -m benchmarks.bench_text_normalization --scale 200 --repeat 3
+"""
+import argparse
+import ast
+import os
+import re
+import time
+import unicodedata
+from typing import List
+
+from utils.text_normalization import normalize_text, normalize_texts
+
+
+DEFAULT_FIXTURE = "data/arxiv_crawled_data.md"
+
+
+def legacy_clean_text(text: str) -> str:
+    """
+    Implementazione originale di _clean_text dei tre pre-processori.
+    """
+    text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('utf-8')
+    text = text.lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+
+def load_texts(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        articles = ast.literal_eval(f.read().strip())
+    return [article.get('abstract', '') for article in articles] + [article.get('title', '') for article in articles]
+
+
+def run(label: str, func, n_chars: int, repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    print(f"{label:<28} best={best * 1000:9.1f} ms  {n_chars / best / 1e6:7.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE)
+    parser.add_argument("--scale", type=int, default=50, help="repliche dei testi della fixture nel batch grande")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"CPU disponibili: {os.cpu_count()} (con una sola CPU normalize_texts non usa il pool)")
+    texts = load_texts(args.fixture)
+    # Una parte dei testi con caratteri accentati, per misurare anche il percorso non-ASCII
+    texts += [text.replace("e", "é", 3) for text in texts[::4]]
+    assert [legacy_clean_text(t) for t in texts] == normalize_texts(texts)
+
+    for name, batch in (("fixture", texts), (f"fixture x{args.scale}", texts * args.scale)):
+        n_chars = sum(map(len, batch))
+        print(f"{name}: {len(batch)} testi, {n_chars / 1e6:.1f} M caratteri")
+        run("  legacy _clean_text", lambda: [legacy_clean_text(t) for t in batch], n_chars, args.repeat)
+        run("  normalize_text", lambda: [normalize_text(t) for t in batch], n_chars, args.repeat)
+        run("  normalize_texts (serial)", lambda: normalize_texts(batch, threshold_chars=float("inf")), n_chars, args.repeat)
+        run("  normalize_texts (pool)", lambda: normalize_texts(batch, threshold_chars=0), n_chars, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
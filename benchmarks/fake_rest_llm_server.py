@@ -0,0 +1,124 @@
+"""
+Server HTTP locale che simula un backend LLM REST ({ 'response': ..., 'success': true/false })
+con guasti e latenza iniettati, per provare ResilientRestClient senza un backend reale.
+
+- latency: latenza base in secondi, con una coda (tail_rate delle richieste impiega tail_latency);
+- failure_rate: frazione di richieste che risponde success: false;
+- error_rate: frazione di richieste che risponde HTTP 503;
+- outage: intervallo (inizio, fine) in secondi dall'avvio in cui ogni richiesta fallisce
+  (HTTP outage_status, o success: false se outage_status è 200).
+
+Uso (dalla root del repo):
+    python -m benchmarks.fake_rest_llm_server --port 8080 --failure-rate 0.1 --tail-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+
+class FakeLLMServer:
+    def __init__(self, latency: float = 0.02, tail_rate: float = 0.0, tail_latency: float = 1.0, failure_rate: float = 0.0, error_rate: float = 0.0, outage: Optional[Tuple[float, float]] = None, outage_status: int = 503, port: int = 0, seed: int = 0):
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.outage = outage
+        self.outage_status = outage_status
+        self.port = port
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.started = time.monotonic()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/invoke"
+
+    def _plan(self) -> Tuple[float, int, bool]:
+        """
+        (latenza, status HTTP, success) della prossima richiesta.
+        """
+        with self._lock:
+            self.requests += 1
+            draw_tail, draw_error, draw_failure = (self._random.random() for _ in range(3))
+        elapsed = time.monotonic() - self.started
+        if self.outage and self.outage[0] <= elapsed < self.outage[1]:
+            return self.latency, self.outage_status, False
+        delay = self.tail_latency if draw_tail < self.tail_rate else self.latency
+        if draw_error < self.error_rate:
+            return delay, 503, False
+        return delay, 200, draw_failure >= self.failure_rate
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                prompt = json.loads(self.rfile.read(length) or b"{}").get("prompt", "")
+                delay, status, success = server._plan()
+                time.sleep(delay)
+                body = json.dumps({"response": f"echo: {prompt[:50]}", "success": success}).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # il client ha già rinunciato (deadline o hedging)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.started = time.monotonic()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=1.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.latency, args.tail_rate, args.tail_latency, args.failure_rate, args.error_rate, port=args.port).start()
+    print(f"Fake LLM server su {server.url} (Ctrl+C per terminare)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
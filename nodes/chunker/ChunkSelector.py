@@ -2,21 +2,25 @@ import json
 from json_repair import repair_json
 from typing import List
 from states.ArxivPdfContentState import State
+from utils.GeminiErrorHandler import GeminiErrorHandler
+from utils.LLMResponseCache import invalidate_cached_response
 
 class ChunkSelector:
     """
     Filtra le sezioni di un articolo basandosi su un prompt LLM.
     Mantiene solo le sezioni di contenuto descrittivo rilevante.
     """
-    def __init__(self, llm, prompt: str):
+    def __init__(self, llm, prompt: str, error_handler: GeminiErrorHandler = None):
         """
         Inizializza la classe con il modello LLM e il prompt di sistema.
         
         :param llm: Il modello LLM da utilizzare per l'interrogazione.
         :param prompt: Il prompt per la selezione delle sezioni.
+        :param error_handler: gestore dei retry (None = politica di default condivisa).
         """
         self.llm = llm
         self.prompt = prompt
+        self.error_handler = error_handler or GeminiErrorHandler()
         self.end_prompt = '\n\nSection keys:\n'
 
 
@@ -27,11 +31,14 @@ class ChunkSelector:
         :param section_keys: Lista delle chiavi di sezione originali.
         :return: Lista di chiavi di sezione filtrate.
         """
+        prompt = f"{self.prompt}\n{section_keys}{self.end_prompt}"
         try:
-            response = self.llm.invoke( f"{self.prompt}\n{section_keys}{self.end_prompt}" ).content
+            response = self.error_handler.gemini_invoke_with_retry(self.llm, prompt).content
             filtered_keys = self.extract_json(response)
             
             if not isinstance(filtered_keys, list):
+                # Risposta non interpretabile: non deve essere riletta dalla cache al prossimo run
+                invalidate_cached_response(self.llm, prompt)
                 raise ValueError("LLM did not return a list of keys.")
             
             return filtered_keys
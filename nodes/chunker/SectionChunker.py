@@ -1,32 +1,146 @@
 import re
+import mmap
+import itertools
 from states.ArxivPdfContentState import State
-from typing import Dict
+from utils.PageCache import PageCache
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+# Pattern precompilati. Una sola regex riconosce, in un'unica passata sul testo, le righe che
+# aprono/chiudono un blocco di codice e le righe di titolo da '##' a '######' (il livello è poi
+# filtrato da SectionChunker.levels). Nessun corpo lazy né lookahead: la scansione è lineare.
+# Il '\n' letterale iniziale permette al motore regex di saltare direttamente da una riga
+# all'altra; la prima riga del documento è controllata a parte con _FIRST_LINE_RE.
+_LINE_BODY = r"(?:(?P<fence>```|~~~).*|(?P<hashes>#{2,6})[ \t]+(?P<title>\S.*?)[ \t]*)$"
+_LINE_RE = re.compile(r"\n" + _LINE_BODY, re.MULTILINE)
+_FIRST_LINE_RE = re.compile(_LINE_BODY, re.MULTILINE)
+# Stessi pattern sui byte, per file mappati in memoria (mmap) e flussi di byte
+_LINE_RE_BYTES = re.compile(_LINE_RE.pattern.encode(), re.MULTILINE)
+_FIRST_LINE_RE_BYTES = re.compile(_FIRST_LINE_RE.pattern.encode(), re.MULTILINE)
+_FENCE_PREFIXES_BYTES = (b"```", b"~~~")
+_NUMBER_DOT_RE = re.compile(r"(\d+)\.")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+class SectionSpan(NamedTuple):
+    """
+    Posizione di una sezione nel testo originale: il contenuto è text[start:end],
+    già privo degli spazi iniziali e finali. Nessuna copia finché non serve.
+    Per i buffer di byte (mmap) gli offset sono in byte.
+    """
+    key: str
+    level: int
+    start: int
+    end: int
+
 
 class SectionChunker:
-    def __init__(self):
-        pass
-    
+    def __init__(self, levels: Tuple[int, ...] = (2, 3, 4), page_cache: Optional[PageCache] = None, state_sections: Tuple[str, ...] = ("abstract", "introduction", "references")):
+        """
+        :param levels: livelli di titolo markdown che aprono una nuova sezione
+                       (2 = '## ', 3 = '### ', 4 = '#### '). I titoli di altri livelli
+                       restano nel contenuto della sezione corrente.
+        :param page_cache: cache delle pagine da cui leggere in streaming il markdown
+                           quando lo stato non lo contiene (vedi ArxivFetcher keep_markdown).
+        :param state_sections: in streaming, solo le sezioni la cui chiave contiene uno di questi
+                               termini restano nello stato (le leggono gli estrattori di keywords
+                               e references); le altre sono rilette una alla volta dal preprocessing.
+        """
+        self.levels = frozenset(levels)
+        self.page_cache = page_cache
+        self.state_sections = tuple(term.lower() for term in state_sections)
+
     def normalize_title_as_key(self, title: str) -> str:
         """
         Normalizza un titolo di sezione per creare una chiave robusta per un dizionario.
-        
+
         Esempio: "2.1 Strategy" -> "2_1_strategy"
         Esempio: "Schema definition" -> "schema_definition"
         """
         # Sostituisce i punti nei numeri con underscore (es. "2.1" -> "2_1")
-        key = re.sub(r'(\d+)\.', r'\1_', title)
-        
+        key = _NUMBER_DOT_RE.sub(r'\1_', title)
+
         # Sostituisce tutti i caratteri non alfanumerici (tranne gli underscore)
         # e gli spazi con un singolo underscore.
-        key = re.sub(r'[\W_]+', '_', key.strip()).strip('_')
-        
+        key = _NON_WORD_RE.sub('_', key.strip()).strip('_')
+
         # Converte il tutto in minuscolo per coerenza.
         return key.lower()
-    
+
+    def _strip_span(self, text: Union[str, bytes, mmap.mmap], start: int, end: int) -> Tuple[int, int]:
+        """
+        Restringe [start, end) escludendo gli spazi iniziali e finali, senza copiare il testo.
+        Lo slicing di un carattere funziona sia su str sia su byte.
+        """
+        while start < end and text[start:start + 1].isspace():
+            start += 1
+        while end > start and text[end - 1:end].isspace():
+            end -= 1
+        return start, end
+
+    def _unique_key(self, title: str, seen_keys: Dict[str, int]) -> str:
+        """
+        Chiave normalizzata del titolo, con suffisso numerico se già usata nel documento.
+        """
+        key = self.normalize_title_as_key(title)
+        count = seen_keys.get(key, 0) + 1
+        seen_keys[key] = count
+        return f"{key}_{count}" if count > 1 else key
+
+    def iter_sections(self, document_text: Union[str, bytes, mmap.mmap]) -> Iterator[SectionSpan]:
+        """
+        Scansione lineare in un solo passaggio: solo le righe di titolo e di delimitazione
+        dei blocchi di codice vengono visitate, i titoli dentro i blocchi ``` sono ignorati.
+        Il testo prima del primo titolo non appartiene a nessuna sezione.
+        Le chiavi duplicate ricevono un suffisso numerico (es. 'results_2').
+
+        Accetta anche un buffer di byte (es. un mmap del file): la regex lavora direttamente
+        sul buffer e solo i titoli vengono decodificati.
+
+        Yields:
+            SectionSpan: chiave, livello e offset del contenuto di ogni sezione.
+        """
+        text = document_text
+        is_bytes = not isinstance(text, str)
+        seen_keys: Dict[str, int] = {}
+        current = None  # (key, level, content_start) della sezione aperta
+        in_fence = False
+
+        first_line = (_FIRST_LINE_RE_BYTES if is_bytes else _FIRST_LINE_RE).match(text)
+        matches = (_LINE_RE_BYTES if is_bytes else _LINE_RE).finditer(text)
+        if first_line is not None:
+            matches = itertools.chain((first_line,), matches)
+
+        for match in matches:
+            if match.group("fence"):
+                in_fence = not in_fence
+                continue
+            level = len(match.group("hashes"))
+            if in_fence or level not in self.levels:
+                continue
+
+            if current is not None:
+                start, end = self._strip_span(text, current[2], match.start())
+                yield SectionSpan(current[0], current[1], start, end)
+
+            title = match.group("title")
+            if is_bytes:
+                title = title.decode("utf-8", errors="replace")
+            current = (self._unique_key(title, seen_keys), level, match.end())
+
+        if current is not None:
+            start, end = self._strip_span(text, current[2], len(text))
+            yield SectionSpan(current[0], current[1], start, end)
+
+    def scan_sections(self, document_text: str) -> List[SectionSpan]:
+        """
+        Come iter_sections, restituendo la lista completa degli span.
+        """
+        return list(self.iter_sections(document_text))
+
     def chunk_by_section(self, document_text: str) -> Dict[str, str]:
         """
         Divide un documento Markdown in un dizionario, basandosi sui marcatori
-        '## ' e '### '.
+        '## ', '### ' e '#### ' (vedi self.levels).
 
         Args:
             document_text (str): Il testo del documento Markdown.
@@ -36,32 +150,123 @@ class SectionChunker:
                         sezione e il valore è il contenuto. La chiave viene
                         normalizzata per renderla robusta.
         """
-        sections = {}
-        
-        # Prepara il testo per una corretta suddivisione
-        document_text = "\n" + document_text.strip()
-        
-        # Pattern per trovare titoli e contenuti.
-        pattern = r"(\n(##\s.+|###\s.+))([\s\S]*?)(?=\n(##\s|###\s|$))"
-        
-        matches = re.findall(pattern, document_text)
-        
-        for match in matches:
-            full_title_line = match[1].strip()
-            content = match[2].strip()
-            
-            # 1. Estrae il titolo, rimuovendo '##' o '###'
-            title = re.sub(r'^(##\s|###\s|####\s|#####\s)', '', full_title_line).strip()
-            
-            # 2. Normalizza il titolo per creare una chiave robusta
-            key = self.normalize_title_as_key(title)
-            
-            # Aggiunge la coppia chiave-contenuto al dizionario
-            sections[key] = content
-            
-        return sections
+        return {span.key: document_text[span.start:span.end] for span in self.iter_sections(document_text)}
+
+    def iter_file_sections(self, path: str, encoding: str = "utf-8") -> Iterator[Tuple[SectionSpan, str]]:
+        """
+        Modalità streaming da file: il file è mappato in memoria (mmap) e scansionato senza
+        caricarlo; ogni sezione viene decodificata solo quando il consumatore la richiede,
+        quindi la memoria occupata è quella di una sezione alla volta.
+
+        Yields:
+            (span con offset in byte nel file, contenuto della sezione)
+        """
+        with open(path, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # File vuoto: mmap non è definito su lunghezza zero
+                return
+            with buffer:
+                for span in self.iter_sections(buffer):
+                    yield span, buffer[span.start:span.end].decode(encoding, errors="replace")
+
+    def iter_stream_sections(self, stream: Union[BinaryIO, Iterable[bytes]], encoding: str = "utf-8") -> Iterator[Tuple[SectionSpan, str]]:
+        """
+        Modalità streaming da un flusso di byte (file aperto in 'rb', gzip della cache delle
+        pagine, blocchi di una risposta HTTP): legge riga per riga e restituisce ogni sezione
+        appena incontra il titolo successivo, tenendo in memoria solo la sezione corrente.
+
+        Yields:
+            (span con offset in byte nel flusso, contenuto della sezione)
+        """
+        seen_keys: Dict[str, int] = {}
+        current = None  # (key, level, content_start) della sezione aperta
+        lines: List[bytes] = []
+        in_fence = False
+        position = 0
+
+        def close_section() -> Tuple[SectionSpan, str]:
+            raw = b"".join(lines)
+            content = raw.strip()
+            start = current[2] + len(raw) - len(raw.lstrip())
+            return SectionSpan(current[0], current[1], start, start + len(content)), content.decode(encoding, errors="replace")
+
+        for line in _iter_lines(stream):
+            position += len(line)
+            if line.startswith(_FENCE_PREFIXES_BYTES):
+                in_fence = not in_fence
+            elif not in_fence and line.startswith(b"##"):
+                match = _FIRST_LINE_RE_BYTES.match(line.rstrip(b"\r\n"))
+                if match and match.group("hashes") and len(match.group("hashes")) in self.levels:
+                    if current is not None:
+                        yield close_section()
+                    title = match.group("title").decode(encoding, errors="replace")
+                    current = (self._unique_key(title, seen_keys), len(match.group("hashes")), position)
+                    lines = []
+                    continue
+            if current is not None:
+                lines.append(line)
+
+        if current is not None:
+            yield close_section()
+
+    def iter_cached_sections(self, url: str) -> Optional[Iterator[Tuple[SectionSpan, str]]]:
+        """
+        Sezioni del markdown in cache per l'URL, lette in streaming dal gzip una alla volta
+        (il flusso viene chiuso a fine iterazione); None se il markdown non è in cache.
+        """
+        stream = self.page_cache.open_markdown(url) if self.page_cache is not None else None
+        if stream is None:
+            return None
+
+        def sections() -> Iterator[Tuple[SectionSpan, str]]:
+            with stream:
+                yield from self.iter_stream_sections(stream)
+
+        return sections()
+
+    def _keep_in_state(self, key: str) -> bool:
+        return any(term in key.lower() for term in self.state_sections)
 
     def __call__(self, state: State) -> State:
-        state.chunks = self.chunk_by_section(state.markdown)
+        if state.markdown is None and self.page_cache is not None and state.url:
+            # Il markdown non è nello stato: una passata in streaming sul gzip della cache registra
+            # chiavi e livelli, e nello stato restano solo le sezioni lette dagli estrattori.
+            # Le altre sono rilette una alla volta da ArxivPreprocessor (vedi streamed_sections).
+            sections = self.iter_cached_sections(state.url)
+            if sections is None:
+                state.error_status.append('[SectionChunker] markdown non trovato nella cache')
+                return state
+            state.chunks, state.section_levels = {}, {}
+            for span, text in sections:
+                state.section_levels[span.key] = span.level
+                if self._keep_in_state(span.key):
+                    state.chunks[span.key] = text
+            state.init_keys = list(state.section_levels.keys())
+            state.streamed_sections = True
+            return state
+
+        sections = [(span, state.markdown[span.start:span.end]) for span in self.iter_sections(state.markdown)]
+        state.chunks = {span.key: text for span, text in sections}
+        state.section_levels = {span.key: span.level for span, _ in sections}
         state.init_keys = list(state.chunks.keys())
-        return state
\ No newline at end of file
+        return state
+
+
+def _iter_lines(stream: Union[BinaryIO, Iterable[bytes]]) -> Iterator[bytes]:
+    """
+    Righe complete (con il ritorno a capo finale) da un flusso di blocchi di byte di dimensione qualsiasi.
+    """
+    pending = b""
+    for block in stream:
+        if not block:
+            continue
+        pending += block
+        if b"\n" not in block:
+            continue
+        *complete, pending = pending.split(b"\n")
+        for line in complete:
+            yield line + b"\n"
+    if pending:
+        yield pending
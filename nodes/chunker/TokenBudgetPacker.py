@@ -0,0 +1,184 @@
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+from huggingface_hub import hf_hub_download
+from transformers import AutoTokenizer
+from states.ArxivPdfContentState import State
+
+# Modello di embedding usato da ChunkChromaDB (config/storage_config/chunks_chromadb.yml)
+DEFAULT_EMBEDDING_MODEL = "paraphrase-multilingual-mpnet-base-v2"
+
+# Confini di split in ordine di preferenza: paragrafo, poi frase
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_SPLITTERS = ((_PARAGRAPH_RE, "\n\n"), (_SENTENCE_RE, " "))
+
+# Piece = (testo, numero di token)
+Piece = Tuple[str, int]
+
+
+def load_embedding_tokenizer(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    """
+    Carica il tokenizer del modello SentenceTransformer e la sua max_seq_length
+    (da sentence_bert_config.json, la stessa usata per troncare in fase di embedding).
+    """
+    repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    tokenizer = AutoTokenizer.from_pretrained(repo_id)
+    max_seq_length = tokenizer.model_max_length
+    try:
+        with open(hf_hub_download(repo_id, "sentence_bert_config.json"), "r", encoding="utf-8") as f:
+            max_seq_length = json.load(f).get("max_seq_length", max_seq_length)
+    except Exception as e:
+        print(f"⚠️ [TokenBudgetPacker] sentence_bert_config.json non disponibile per '{repo_id}': {e}")
+    return tokenizer, max_seq_length
+
+
+class TokenBudgetPacker:
+    """
+    Impacchetta le sezioni del paper in chunk di lunghezza vicina al limite del modello di embedding.
+    Le sezioni formano un albero (sezione -> sottosezione -> paragrafo -> frase):
+    - le sezioni troppo lunghe sono divise ai confini di paragrafo, poi di frase, e solo come
+      ultima risorsa a finestre di token, così nessun testo viene troncato dal max_seq_length;
+    - le sezioni piccole e consecutive sono unite finché stanno nel budget, così non si spreca
+      un embedding per poche parole.
+    Ogni porzione di testo finisce in esattamente un chunk.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, max_tokens: Optional[int] = None, min_fill: float = 0.5, tokenizer=None):
+        """
+        :param model_name: modello SentenceTransformer di cui usare tokenizer e max_seq_length.
+        :param max_tokens: limite di token per chunk (None = max_seq_length del modello).
+        :param min_fill: frazione del budget sotto la quale un chunk può proseguire oltre
+                         la fine di una sezione di primo livello ('## ').
+        :param tokenizer: tokenizer già caricato (in quel caso max_tokens è obbligatorio).
+        """
+        if tokenizer is None:
+            tokenizer, max_seq_length = load_embedding_tokenizer(model_name)
+            max_tokens = max_tokens or max_seq_length
+        elif max_tokens is None:
+            raise ValueError("max_tokens è obbligatorio se il tokenizer è passato esplicitamente")
+
+        self.tokenizer = tokenizer
+        # I token speciali ([CLS], [SEP], ...) occupano parte della sequenza
+        self.budget = max_tokens - tokenizer.num_special_tokens_to_add()
+        self.min_fill = min_fill
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """
+        Numero di token (senza token speciali) di ogni testo, in un'unica chiamata al tokenizer.
+        """
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def _merge(self, pieces: List[Piece], separator: str) -> List[Piece]:
+        """
+        Unisce i pezzi consecutivi finché il totale resta nel budget.
+        Il separatore è conteggiato come un token per non sforare per arrotondamento.
+        """
+        merged: List[Piece] = []
+        buffer: List[str] = []
+        buffer_tokens = 0
+        for text, tokens in pieces:
+            if buffer and buffer_tokens + 1 + tokens > self.budget:
+                merged.append((separator.join(buffer), buffer_tokens))
+                buffer, buffer_tokens = [], 0
+            buffer_tokens += tokens + (1 if buffer else 0)
+            buffer.append(text)
+        if buffer:
+            merged.append((separator.join(buffer), buffer_tokens))
+        return merged
+
+    def _split_windows(self, text: str) -> List[Piece]:
+        """
+        Ultima risorsa per un testo senza confini utili: finestre di budget token,
+        tagliate sugli offset dei caratteri per non perdere nulla.
+        """
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        offsets = encoding["offset_mapping"]
+        pieces: List[Piece] = []
+        for i in range(0, len(offsets), self.budget):
+            window = offsets[i:i + self.budget]
+            start = window[0][0] if i else 0
+            end = offsets[i + self.budget][0] if i + self.budget < len(offsets) else len(text)
+            piece = text[start:end].strip()
+            if piece:
+                pieces.append((piece, len(window)))
+        return pieces
+
+    def _split(self, text: str, tokens: int, depth: int = 0) -> List[Piece]:
+        """
+        Divide ricorsivamente un testo oltre budget: paragrafi, poi frasi, poi finestre di token.
+        I pezzi dello stesso livello vengono poi riuniti in sequenze vicine al budget.
+        """
+        if tokens <= self.budget:
+            return [(text, tokens)]
+        if depth == len(_SPLITTERS):
+            return self._split_windows(text)
+
+        splitter, separator = _SPLITTERS[depth]
+        parts = [part.strip() for part in splitter.split(text) if part.strip()]
+        if len(parts) <= 1:
+            return self._split(text, tokens, depth + 1)
+
+        pieces: List[Piece] = []
+        for part, part_tokens in zip(parts, self.count_tokens(parts)):
+            pieces.extend(self._split(part, part_tokens, depth + 1))
+        return self._merge(pieces, separator)
+
+    def pack(self, chunks: Dict[str, str], section_levels: Optional[Dict[str, int]] = None) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+        """
+        Args:
+            chunks: sezioni del paper in ordine di documento (chiave -> contenuto).
+            section_levels: livello del titolo di ogni sezione (2 = '## '), da SectionChunker.
+
+        Returns:
+            (chunk impacchettati, sezioni contenute in ogni chunk). Le chiavi dei chunk sono
+            la chiave della sezione, '<sezione>_p<n>' per le parti di una sezione divisa e
+            '<primo>__<ultimo>' per i chunk che uniscono più unità.
+        """
+        section_levels = section_levels or {}
+        top_level = min(section_levels.values(), default=2)
+        keys = [key for key, text in chunks.items() if text and text.strip()]
+        texts = [chunks[key].strip() for key in keys]
+
+        # Foglie dell'albero: sezioni intere o loro parti, ognuna entro il budget
+        units: List[Tuple[str, str, str, int, bool]] = []  # (label, sezione, testo, token, inizio sezione)
+        for key, text, tokens in zip(keys, texts, self.count_tokens(texts)):
+            parts = self._split(text, tokens)
+            for i, (part, part_tokens) in enumerate(parts, start=1):
+                label = key if len(parts) == 1 else f"{key}_p{i}"
+                units.append((label, key, part, part_tokens, i == 1))
+
+        packed: Dict[str, str] = {}
+        chunk_sections: Dict[str, List[str]] = {}
+        buffer: List[Tuple[str, str, str, int, bool]] = []
+        buffer_tokens = 0
+
+        def flush():
+            label = buffer[0][0] if len(buffer) == 1 else f"{buffer[0][0]}__{buffer[-1][0]}"
+            packed[label] = "\n\n".join(unit[2] for unit in buffer)
+            chunk_sections[label] = list(dict.fromkeys(unit[1] for unit in buffer))
+
+        for unit in units:
+            _, section, _, tokens, section_start = unit
+            starts_top_section = section_start and section_levels.get(section, top_level) <= top_level
+            full = buffer_tokens + 1 + tokens > self.budget
+            # Una nuova sezione di primo livello apre un nuovo chunk, a meno che quello corrente sia quasi vuoto
+            if buffer and (full or (starts_top_section and buffer_tokens >= self.min_fill * self.budget)):
+                flush()
+                buffer, buffer_tokens = [], 0
+            buffer_tokens += tokens + (1 if buffer else 0)
+            buffer.append(unit)
+        if buffer:
+            flush()
+
+        return packed, chunk_sections
+
+    def __call__(self, state: State) -> dict:
+        if not state.chunks:
+            return {"error_status": ['[TokenBudgetPacker] No chunks to pack']}
+
+        chunks, chunk_sections = self.pack(state.chunks, state.section_levels)
+        print(f"📦 [TokenBudgetPacker] {len(state.chunks)} sezioni -> {len(chunks)} chunk (budget {self.budget} token)")
+        return {"chunks": chunks, "chunk_sections": chunk_sections}
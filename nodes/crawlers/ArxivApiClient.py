@@ -1,28 +1,313 @@
+import asyncio
 import requests
 import xml.etree.ElementTree as ET
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from states.ArxivState import State, ArticleMetadata
+from utils.PolitenessScheduler import PolitenessScheduler, ARXIV_SCHEDULER
+from utils.arxiv_ids import unique_arxiv_ids
+from utils.WatermarkStore import WatermarkStore
 
 
 # Definizione dei namespaces per il parsing XML
 # L'API di arXiv usa diversi namespace che sono essenziali per trovare i tag corretti
 namespaces = {
     'atom': 'http://www.w3.org/2005/Atom',
-    'arxiv': 'http://arxiv.org/schemas/atom'
+    'arxiv': 'http://arxiv.org/schemas/atom',
+    'opensearch': 'http://a9.com/-/spec/opensearch/1.1/'
 }
+
+# Tag qualificati usati dal parser incrementale (evita di risolvere i namespace per ogni elemento)
+_ENTRY_TAG = f"{{{namespaces['atom']}}}entry"
+_AUTHOR_TAG = f"{{{namespaces['atom']}}}author"
+_NAME_TAG = f"{{{namespaces['atom']}}}name"
+_TOTAL_RESULTS_TAG = f"{{{namespaces['opensearch']}}}totalResults"
+# Numero massimo di risultati che l'API arXiv restituisce in una singola risposta
+MAX_RESULTS_PER_REQUEST = 2000
+
+_ENTRY_FIELDS = {
+    f"{{{namespaces['atom']}}}id": 'id',
+    f"{{{namespaces['atom']}}}title": 'title',
+    f"{{{namespaces['atom']}}}published": 'published',
+    f"{{{namespaces['atom']}}}updated": 'updated',
+    f"{{{namespaces['atom']}}}summary": 'abstract',
+}
+
 class ArxivApiClient:
     '''
     Classe che si occupa di interfacciarsi con API arxiv, restituendo ad ogni query una lista di ricerche correrlate
     '''
-    def __init__(self, base_url: str = "http://export.arxiv.org/api/query?", max_results: int = 10, sort_by: str = 'submittedDate', sort_order: str = 'descending'):
+    def __init__(self, base_url: str = "http://export.arxiv.org/api/query?", max_results: int = 10, sort_by: str = 'submittedDate', sort_order: str = 'descending', page_size: int = 100, scheduler: PolitenessScheduler = ARXIV_SCHEDULER, chunk_size: int = 64 * 1024, watermark_store: Optional[WatermarkStore] = None):
+        """
+        :param max_results: numero massimo di risultati restituiti dal nodo (__call__).
+        :param page_size: numero di risultati richiesti per pagina in modalità harvest.
+        :param scheduler: scheduler condiviso che rispetta il ritardo di cortesia dell'API arXiv.
+        :param chunk_size: dimensione in byte dei blocchi della risposta passati al parser XML.
+        :param watermark_store: se presente, le query già eseguite vengono aggiornate in modo
+                                incrementale a partire dal watermark salvato.
+        """
         self.base_url = base_url
         self.max_results = max_results
         self.sort_by = sort_by
         self.sort_order = sort_order
+        self.page_size = page_size
+        self.scheduler = scheduler
+        self.chunk_size = chunk_size
+        self.watermark_store = watermark_store
+
+        # Offset della prossima pagina da scaricare: permette di riprendere un harvest interrotto
+        self.next_start = 0
+
+    def _build_search_query(self, query_string: str) -> str:
+        """
+        Costruisce il parametro search_query dell'API a partire dalla stringa di ricerca.
+        """
+        return f"all:{query_string}"  # Ricerca in tutti i campi
+
+    def _build_since_query(self, query_string: str, since: str) -> str:
+        """
+        Limita la ricerca agli articoli sottomessi dal timestamp 'since' (ISO 8601) in poi.
+        L'API accetta date nel formato YYYYMMDDHHMM.
+        """
+        lower = since[:16].replace('-', '').replace('T', '').replace(':', '')
+        return f"({self._build_search_query(query_string)}) AND submittedDate:[{lower} TO 999912312359]"
+
+    def _parse_entry(self, entry: ET.Element) -> ArticleMetadata:
+        """
+        Converte un singolo elemento 'entry' in ArticleMetadata, leggendo ogni campo una sola volta.
+        """
+        fields = {'authors': []}
+        for child in entry:
+            tag = child.tag
+            if tag == _AUTHOR_TAG:
+                name = child.find(_NAME_TAG)
+                if name is not None:
+                    fields['authors'].append(name.text)
+            elif tag in _ENTRY_FIELDS:
+                fields[_ENTRY_FIELDS[tag]] = child.text
+
+        abs_url = fields.get('id')
+        return ArticleMetadata(
+            id=abs_url,
+            pdf_id=abs_url.replace('abs','pdf') if abs_url else None,
+            html_id=abs_url.replace('abs','html') if abs_url else None,
+            title=(fields.get('title') or '').strip().replace('\n', ' '),
+            published=fields.get('published') or '',
+            updated=fields.get('updated') or '',
+            abstract=(fields.get('abstract') or '').strip().replace('\n', ' '),
+            authors=fields['authors']
+        )
+
+    def _parse_feed(self, chunks: Union[bytes, Iterable[bytes]]) -> Tuple[List[ArticleMetadata], Optional[int]]:
+        """
+        Interpreta un feed Atom di arXiv in modo incrementale: i byte vengono passati al parser
+        man mano che arrivano e ogni 'entry' viene rimossa dall'albero appena convertita,
+        così né il body completo né l'albero XML completo restano in memoria.
+
+        Args:
+            chunks: il feed come bytes oppure come iterabile di blocchi di bytes.
+
+        Returns:
+            (articoli, totalResults dichiarato dal feed o None)
+        """
+        if isinstance(chunks, (bytes, bytearray)):
+            chunks = [chunks]
+
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root = None
+        articles = []
+        total_results = None
+
+        def consume_events():
+            nonlocal root, total_results
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    continue
+                # I risultati di ricerca sono contenuti nei tag 'entry'
+                if elem.tag == _ENTRY_TAG:
+                    articles.append(self._parse_entry(elem))
+                    elem.clear()
+                    root.remove(elem)
+                elif elem.tag == _TOTAL_RESULTS_TAG and elem.text:
+                    total_results = int(elem.text)
+
+        for chunk in chunks:
+            parser.feed(chunk)
+            consume_events()
+        parser.close()
+        consume_events()
+
+        return articles, total_results
+
+    def _fetch_page(self, search_query: Optional[str], start: int, max_results: int, id_list: Optional[List[str]] = None, sort_by: Optional[str] = None, sort_order: Optional[str] = None) -> Tuple[List[ArticleMetadata], Optional[int]]:
+        """
+        Scarica e interpreta una singola pagina di risultati, attendendo lo slot dello scheduler.
+        Con id_list la richiesta è inviata in POST, così anche migliaia di ID stanno in una sola chiamata.
+
+        :raises requests.exceptions.RequestException: in caso di errore HTTP.
+        """
+        # I parametri di ricerca dell'API
+        params = {
+            'start': start,
+            'max_results': max_results,
+            'sortBy': sort_by or self.sort_by,
+            'sortOrder': sort_order or self.sort_order
+        }
+        if search_query:
+            params['search_query'] = search_query
+
+        self.scheduler.wait()
+        if id_list:
+            params['id_list'] = ','.join(id_list)
+            response = requests.post(self.base_url, data=params, stream=True)
+        else:
+            response = requests.get(self.base_url, params=params, stream=True)
+
+        with response:
+            response.raise_for_status()  # Solleva un'eccezione in caso di errore HTTP
+            # Parsing del feed XML a blocchi, mentre il body viene ancora ricevuto
+            return self._parse_feed(response.iter_content(chunk_size=self.chunk_size))
+
+    def _next_page_size(self, start: int, max_total: Optional[int]) -> int:
+        if max_total is None:
+            return self.page_size
+        return min(self.page_size, max_total - (self.next_start - start))
+
+    def harvest(self, query_string: str, start: Optional[int] = None, max_total: Optional[int] = None) -> Iterator[List[ArticleMetadata]]:
+        """
+        Percorre i risultati della query una pagina alla volta (parametro 'start' dell'API)
+        e restituisce ogni pagina appena arriva, così i nodi a valle possono iniziare subito.
+
+        Args:
+            query_string (str): La stringa di ricerca.
+            start (int): offset da cui partire; usare self.next_start per riprendere
+                         un harvest interrotto dall'ultima pagina ricevuta.
+            max_total (int): numero massimo di risultati da scaricare (None = tutti).
+
+        Yields:
+            List[ArticleMetadata]: gli articoli di una pagina.
+        """
+        search_query = self._build_search_query(query_string)
+        start = self.next_start = start or 0
+
+        while True:
+            page_size = self._next_page_size(start, max_total)
+            if page_size <= 0:
+                return
+
+            articles, total_results = self._fetch_page(search_query, self.next_start, page_size)
+            if not articles:
+                return
+
+            self.next_start += len(articles)
+            yield articles
+
+            if total_results is not None and self.next_start >= total_results:
+                return
+
+    async def aharvest(self, query_string: str, start: Optional[int] = None, max_total: Optional[int] = None) -> AsyncIterator[List[ArticleMetadata]]:
+        """
+        Variante asincrona di harvest: le richieste HTTP girano in un thread,
+        senza bloccare l'event loop, rispettando lo stesso scheduler condiviso.
+        """
+        search_query = self._build_search_query(query_string)
+        start = self.next_start = start or 0
+
+        while True:
+            page_size = self._next_page_size(start, max_total)
+            if page_size <= 0:
+                return
+
+            articles, total_results = await asyncio.to_thread(self._fetch_page, search_query, self.next_start, page_size)
+            if not articles:
+                return
+
+            self.next_start += len(articles)
+            yield articles
+
+            if total_results is not None and self.next_start >= total_results:
+                return
+
+    def harvest_since(self, query_string: str, since: str) -> Iterator[List[ArticleMetadata]]:
+        """
+        Harvest incrementale: scarica solo gli articoli sottomessi dopo il watermark 'since',
+        ordinati per submittedDate decrescente, e smette di paginare appena incontra
+        articoli già ingeriti (published <= since).
+
+        Args:
+            query_string (str): La stringa di ricerca.
+            since (str): timestamp 'published' dell'ultimo articolo già ingerito.
+
+        Yields:
+            List[ArticleMetadata]: gli articoli nuovi di una pagina.
+        """
+        search_query = self._build_since_query(query_string, since)
+        self.next_start = 0
+
+        while True:
+            articles, total_results = self._fetch_page(search_query, self.next_start, self.page_size, sort_by='submittedDate', sort_order='descending')
+            if not articles:
+                return
+            self.next_start += len(articles)
+
+            # Gli articoli sono in ordine di sottomissione decrescente: il primo già visto chiude il delta
+            fresh = [article for article in articles if article.published > since]
+            if fresh:
+                yield fresh
+            if len(fresh) < len(articles):
+                return
+            if total_results is not None and self.next_start >= total_results:
+                return
+
+    def lookup_ids(self, raw_ids: Iterable[str], batch_size: int = MAX_RESULTS_PER_REQUEST) -> List[ArticleMetadata]:
+        """
+        Recupera i metadati di una lista di articoli a partire dai loro ID arXiv (o URL abs/pdf/html),
+        usando il parametro id_list dell'API invece di una ricerca testuale per ogni paper.
+        Gli ID sono canonicalizzati e deduplicati, poi raggruppati nelle richieste più grandi consentite.
+
+        Args:
+            raw_ids: ID arXiv, anche con prefisso 'arXiv:' o in forma di URL.
+            batch_size: numero di ID per richiesta (massimo MAX_RESULTS_PER_REQUEST).
+
+        Returns:
+            List[ArticleMetadata]: i metadati degli articoli trovati.
+        """
+        ids = unique_arxiv_ids(raw_ids)
+        batch_size = max(1, min(batch_size, MAX_RESULTS_PER_REQUEST))
+
+        articles = []
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            found, _ = self._fetch_page(None, 0, len(batch), id_list=batch)
+            for article in found:
+                # L'API segnala gli ID non validi con entry di errore (id '.../api/errors#...')
+                if not article.id or '/api/errors' in article.id:
+                    print(f"⚠️ ID arXiv non risolto: {article.abstract}")
+                    continue
+                articles.append(article)
+
+        return articles
+
+    def _compute_watermark(self, articles: List[ArticleMetadata]) -> Dict[str, str]:
+        """
+        Timestamp più recenti di pubblicazione e aggiornamento tra gli articoli ricevuti.
+        Il delta si interroga con submittedDate, che nell'API corrisponde a 'published':
+        è quindi 'published' a delimitare harvest_since, perché un confine su 'updated'
+        (che cresce a ogni revisione) farebbe saltare gli articoli sottomessi prima di una
+        revisione recente. 'updated' resta salvato come ultimo aggiornamento visto.
+        """
+        return {
+            'published': max((a.published for a in articles if a.published), default=''),
+            'updated': max((a.updated for a in articles if a.updated), default='')
+        }
 
     def __call__(self, state: State) -> State:
         """
         Esegue una ricerca sull'API di arXiv e restituisce una lista di articoli.
+        Se lo stato contiene 'id_list', recupera direttamente i metadati di quegli ID.
+        Se è configurato un watermark_store e la query è già stata eseguita, scarica solo il delta.
 
         Args:
             query (str): La stringa di ricerca.
@@ -30,39 +315,24 @@ class ArxivApiClient:
         Returns:
             list: Una lista di dizionari, ognuno rappresentante un articolo.
         """
-        
-        # I parametri di ricerca dell'API
-        params = {
-            'search_query': f"all:{state.query_string}",  # Ricerca in tutti i campi
-            'max_results': self.max_results,
-            'sortBy': self.sort_by,
-            'sortOrder': self.sort_order
-        }
-        
         try:
-            response = requests.get(self.base_url, params=params)
-            response.raise_for_status()  # Solleva un'eccezione in caso di errore HTTP
+            if state.id_list:
+                state.articles.extend(self.lookup_ids(state.id_list))
+            else:
+                watermark = self.watermark_store.get(state.query_string) if self.watermark_store else None
+                if watermark and watermark.get('published'):
+                    print(f"Aggiornamento incrementale di '{state.query_string}' dal {watermark['published']}")
+                    pages = self.harvest_since(state.query_string, watermark['published'])
+                else:
+                    pages = self.harvest(state.query_string, max_total=self.max_results)
+                for articles in pages:
+                    state.articles.extend(articles)
+
+                # Il watermark viene reso persistente dalla pipeline solo dopo un'ingestione riuscita
+                if state.articles:
+                    state.watermark = self._compute_watermark(state.articles)
         except requests.exceptions.RequestException as e:
             print(f"Errore nella richiesta all'API di arXiv: {e}")
-            return []
-
-        # Parsing del feed XML
-        root = ET.fromstring(response.content)
-        
-        # I risultati di ricerca sono contenuti nei tag 'entry'
-        for entry in root.findall('atom:entry', namespaces):
-            # Estrazione dei dati
-            article = {
-                'id': entry.find('atom:id', namespaces).text,
-                'pdf_id': entry.find('atom:id', namespaces).text.replace('abs','pdf'),
-                'html_id': entry.find('atom:id', namespaces).text.replace('abs','html'),
-                'title': entry.find('atom:title', namespaces).text.strip().replace('\n', ' '),
-                'published': entry.find('atom:published', namespaces).text,
-                'updated': entry.find('atom:updated', namespaces).text,
-                'abstract': entry.find('atom:summary', namespaces).text.strip().replace('\n', ' '),
-                'authors': [author.find('atom:name', namespaces).text for author in entry.findall('atom:author', namespaces)]
-            }
-            article = ArticleMetadata(**article)
-            state.articles.append(article)
-            
+            state.error_status.append(f"[ArxivApiClient] errore API arXiv (start={self.next_start}): {e}")
+
         return state
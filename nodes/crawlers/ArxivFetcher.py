@@ -1,29 +1,150 @@
+import yaml
+import asyncio
+from urllib.parse import urlparse
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from nodes.schema_generators.GeminiSchemaGenerator import LLMSchemaExtractor
 from states.ArxivPdfContentState import State
+from utils.BrowserPool import BrowserPool
+from utils.StaticHtmlClient import StaticHtmlClient
+from utils.PageCache import PageCache
 
 from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
 from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode
+from crawl4ai import MemoryAdaptiveDispatcher, RateLimiter
 from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
 
+# Parametri di config/crawl_config/crawler.yml usati dalla modalità batch (arun_many)
+BATCH_SETTINGS_DEFAULTS = {
+    "memory_threshold_percent": 70.0,
+    "check_interval": 1.0,
+    "max_session_permit": 20,
+    "semaphore_count": 5,
+    "mean_delay": 0.1,
+    "max_range": 0.3,
+    "stream": True,
+}
+
 
 class ArxivFetcher:
-    def __init__(self, provider: str = "gemini/gemini-2.0-flash-001", schema_file: str = "data/schemas.jsonl", user_agents_file: str = "config/http_params/user_agent_params.json", additional_headers_path: str = "config/http_params/additional_headers.json" ):
+    def __init__(self, provider: str = "gemini/gemini-2.0-flash-001", schema_file: str = "data/schemas.jsonl", user_agents_file: str = "config/http_params/user_agent_params.json", additional_headers_path: str = "config/http_params/additional_headers.json", browser_pool: Optional[BrowserPool] = None, crawler_config_path: str = "config/crawl_config/crawler.yml", fast_path: bool = True, cache_config_path: str = "config/crawl_config/cache.yml", keep_markdown: bool = True ):
         """
         Inizializza l'estrattore di schema.
         :param schema_file: percorso file JSONL dove salvare/leggere schemi.
         :param user_agents_file: percorso del file JSON con i user agent rotanti.
         :param additional_headers_path: percorso del file JSON con gli header statici.
+        :param browser_pool: pool di browser condiviso; se None il fetcher ne crea e gestisce uno proprio.
+        :param crawler_config_path: file YAML con concorrenza e soglie di memoria della modalità batch.
+        :param fast_path: se True le pagine arXiv /html/ (statiche) sono scaricate via HTTP senza browser,
+                          che resta come fallback se il fetch statico fallisce o il contenuto è vuoto.
+        :param cache_config_path: file YAML della cache locale delle pagine (HTML + markdown).
+        :param keep_markdown: se False, per le pagine salvate in cache lo stato non contiene il markdown:
+                              SectionChunker (con la stessa page_cache) lo legge in streaming dal disco.
+                              La voce resta bloccata in cache fino a release(url), a fine grafo.
         """
         self.schema_extractor=LLMSchemaExtractor()
 
+        # Il browser resta aperto tra un URL e l'altro: viene avviato al primo fetch e chiuso con close()
+        self.owns_pool = browser_pool is None
+        self.browser_pool = browser_pool if browser_pool is not None else BrowserPool()
+
+        self.batch_settings = self.load_batch_settings(crawler_config_path)
+
+        self.fast_path = fast_path
+        self.static_client = StaticHtmlClient(headers_factory=self.schema_extractor.get_headers)
+
+        # Cache su disco: sui cache hit il fetch viene saltato del tutto
+        self.page_cache = PageCache.from_yaml(cache_config_path)
+        self.keep_markdown = keep_markdown or self.page_cache is None
+
+    @staticmethod
+    def load_batch_settings(path: str) -> Dict:
+        """
+        Legge da crawler.yml i parametri di concorrenza della modalità batch, con i default se assenti.
+        """
+        settings = dict(BATCH_SETTINGS_DEFAULTS)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+            settings.update({k: config[k] for k in BATCH_SETTINGS_DEFAULTS if config.get(k) is not None})
+        except (FileNotFoundError, yaml.YAMLError) as e:
+            print(f"Errore nella lettura della configurazione del crawler: {e}")
+        return settings
+
+    async def close(self):
+        """
+        Chiude il client HTTP e il pool di browser se è di proprietà del fetcher.
+        """
+        await self.static_client.close()
+        if self.owns_pool:
+            await self.browser_pool.close()
+
+    def release(self, url: str) -> None:
+        """
+        Sblocca la voce in cache del paper (vedi keep_markdown) quando il grafo ha finito di rileggerla.
+        """
+        if not self.keep_markdown:
+            self.page_cache.unpin(url)
+
+    def _cache_get(self, url: str) -> Optional[str]:
+        return self.page_cache.get_markdown(url) if self.page_cache else None
+
+    def _cache_put(self, url: str, markdown: Optional[str], html: Optional[str]) -> None:
+        if self.page_cache and markdown:
+            self.page_cache.put(url, markdown, html)
+
+    def _set_markdown(self, state: State, markdown: Optional[str]) -> None:
+        """
+        Salva il markdown nello stato, salvo che sia già in cache e keep_markdown sia False.
+        """
+        if not self.keep_markdown and self.page_cache.pin_markdown(state.url):
+            state.markdown = None
+        else:
+            state.markdown = markdown
+
+    def _handoff(self, url: str, markdown: str) -> Optional[str]:
+        """
+        Markdown da passare al grafo: None se è già in cache e keep_markdown è False, così i paper
+        in coda non tengono in memoria il documento intero.
+        """
+        if not self.keep_markdown and self.page_cache.pin_markdown(url):
+            return None
+        return markdown
+
+    def _is_static_page(self, url: str) -> bool:
+        """
+        Le pagine arxiv.org/html/<id> sono output LaTeXML statico: non serve renderle.
+        """
+        parsed = urlparse(url)
+        return self.fast_path and parsed.netloc.endswith("arxiv.org") and parsed.path.startswith("/html/")
+
         
     
     async def __call__(self, state: State) -> State:
 
         url = state.url
 
-        # --- PASSO 1: Genera lo schema (sincrono) ---
-        schema_definition = self.schema_extractor(url)
+        if not self.keep_markdown and self.page_cache.pin_markdown(url):
+            print(f"Markdown in cache per '{url}', letto in streaming dal chunker")
+            state.markdown = None
+            return state
+
+        cached = self._cache_get(url)
+        if cached is not None:
+            print(f"Markdown caricato dalla cache per '{url}'")
+            state.markdown = cached
+            return state
+
+        # --- PASSO 0: fast path HTTP per le pagine statiche, il browser resta come fallback ---
+        if self._is_static_page(url):
+            html, markdown = await self.static_client.fetch_page(url)
+            if markdown is not None:
+                self._cache_put(url, markdown, html)
+                self._set_markdown(state, markdown)
+                return state
+            print(f"Fetch statico non riuscito per '{url}', uso il browser")
+
+        # --- PASSO 1: Genera lo schema (sincrono, in un thread per non bloccare l'event loop) ---
+        schema_definition = await asyncio.to_thread(self.schema_extractor, url)
 
         print("Schema estratto/caricato da cache:")
         print(schema_definition) # Stampalo per ispezionarlo!
@@ -42,10 +163,102 @@ class ArxivFetcher:
         )
 
         ### PASSO 4: ESTRAZIONE DI INFO STRUTTURATE DALL' INPUT URL con crawler
-        async with AsyncWebCrawler() as crawler:
+        async with self.browser_pool.acquire() as crawler:
             result = await crawler.arun(url, config=config)
         
         # Return a reusult. markdown.raw_markdown correctly
-        state.markdown = result.markdown.raw_markdown
+        markdown = result.markdown.raw_markdown
+        if result.success:
+            self._cache_put(url, markdown, result.html)
+        self._set_markdown(state, markdown)
+
+        return state
+
+    def _build_dispatcher(self) -> MemoryAdaptiveDispatcher:
+        """
+        Dispatcher di crawl4ai che riduce le sessioni concorrenti quando l'uso di memoria
+        supera memory_threshold_percent, con un ritardo casuale tra richieste allo stesso dominio.
+        """
+        settings = self.batch_settings
+        rate_limiter = RateLimiter(base_delay=(settings["mean_delay"], settings["mean_delay"] + settings["max_range"]))
+        return MemoryAdaptiveDispatcher(
+            memory_threshold_percent=settings["memory_threshold_percent"],
+            check_interval=settings["check_interval"],
+            max_session_permit=settings["max_session_permit"],
+            rate_limiter=rate_limiter
+        )
+
+    async def fetch_many(self, urls: List[str]) -> AsyncIterator[Tuple[str, Optional[str], Optional[str]]]:
+        """
+        Crawling batch con arun_many: restituisce il markdown di ogni paper appena è pronto
+        (stream), così i nodi a valle possono iniziare prima che il batch sia completo.
+        Gli URL sono raggruppati per sottodominio, perché condividono lo stesso schema di estrazione.
+
+        Yields:
+            (url, markdown o None, messaggio di errore o None); il markdown è None anche senza errore
+            se keep_markdown è False e la pagina è in cache.
+        """
+        urls = list(dict.fromkeys(urls))
+
+        # Cache hit: nessun fetch (con keep_markdown False il chunker legge il markdown dalla cache)
+        pending = []
+        for url in urls:
+            if not self.keep_markdown and self.page_cache.pin_markdown(url):
+                yield url, None, None
+                continue
+            cached = self._cache_get(url)
+            if cached is not None:
+                yield url, cached, None
+            else:
+                pending.append(url)
+        urls = pending
+
+        # Fast path HTTP per le pagine statiche; solo quelle fallite passano al browser
+        static_urls = [url for url in urls if self._is_static_page(url)]
+        browser_urls = [url for url in urls if not self._is_static_page(url)]
+
+        async def fetch_static(url: str) -> Tuple[str, Optional[str], Optional[str]]:
+            return (url, *await self.static_client.fetch_page(url))
+
+        if static_urls:
+            for next_done in asyncio.as_completed([fetch_static(url) for url in static_urls]):
+                url, html, markdown = await next_done
+                if markdown is not None:
+                    self._cache_put(url, markdown, html)
+                    yield url, self._handoff(url, markdown), None
+                else:
+                    browser_urls.append(url)
+
+        groups: Dict[str, List[str]] = {}
+        for url in browser_urls:
+            key = self.schema_extractor._extract_deepest_subdomain(url) or url
+            groups.setdefault(key, []).append(url)
+
+        for group_urls in groups.values():
+            schema_definition = await asyncio.to_thread(self.schema_extractor, group_urls[0])
+            config = CrawlerRunConfig(
+                cache_mode=CacheMode.BYPASS,
+                extraction_strategy=JsonCssExtractionStrategy(schema=schema_definition),
+                stream=self.batch_settings["stream"]
+            )
+
+            # Al più max_pages_per_browser URL per lease, ognuno contato come pagina:
+            # il riciclo dei browser avviene anche in modalità batch
+            step = max(1, self.browser_pool.max_pages_per_browser)
+            for start in range(0, len(group_urls), step):
+                lease_urls = group_urls[start:start + step]
+                async with self.browser_pool.acquire(pages=len(lease_urls)) as crawler:
+                    results = await crawler.arun_many(lease_urls, config=config, dispatcher=self._build_dispatcher())
+                    if not self.batch_settings["stream"]:
+                        results = _as_async_iter(results)
+                    async for result in results:
+                        if result.success and result.markdown:
+                            self._cache_put(result.url, result.markdown.raw_markdown, result.html)
+                            yield result.url, self._handoff(result.url, result.markdown.raw_markdown), None
+                        else:
+                            yield result.url, None, result.error_message or "crawl fallito"
+
 
-        return state
\ No newline at end of file
+async def _as_async_iter(items):
+    for item in items:
+        yield item
\ No newline at end of file
@@ -1,7 +1,5 @@
-import re
-import unicodedata
-from typing import List, Dict
 from states.ArxivState import State
+from utils.text_normalization import normalize_texts
 
 class ArxivPreprocessor:
     """
@@ -11,32 +9,10 @@ class ArxivPreprocessor:
 
     def __init__(self):
         """
-        Inizializza il pre-processore. Non sono più necessari parametri di chunking.
+        Inizializza il pre-processore. La normalizzazione è in utils/text_normalization.
         """
         pass
 
-    def _clean_text(self, text: str) -> str:
-        """
-        Pulisce il testo rimuovendo caratteri non necessari, spazi extra,
-        e normalizzando il testo (es. 'à' -> 'a', tutto in minuscolo).
-
-        Args:
-            text (str): Il testo originale.
-
-        Returns:
-            str: Il testo pulito e normalizzato.
-        """
-        # Normalizza i caratteri con accenti con NFD (Forma di Normalizzazione di Decomposizione)
-        text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('utf-8')
-        
-        # Converte il testo in minuscolo
-        text = text.lower()
-    
-        # Rimuove spazi extra, tabulazioni e newline
-        text = re.sub(r'\s+', ' ', text).strip()
-
-        return text
-
     def __call__(self, state: State) -> State:
         """
         Esegue il pre-processing completo di un singolo articolo.
@@ -47,14 +23,18 @@ class ArxivPreprocessor:
         Returns:
             List: I documenti puliti.
         """
+        articles = []
         for article in state.articles:
             if not article.abstract:
                 print(f"⚠️ Articolo '{article.id}' saltato: manca il contenuto.")
                 state.error_status.append(f"⚠️ Articolo '{article.id}' saltato")
                 continue
+            articles.append(article)
 
-            article.abstract = self._clean_text(article.abstract)
-            article.title = self._clean_text(article.title)
-            
+        # Titoli e abstract di tutti gli articoli normalizzati in un'unica chiamata batch
+        cleaned = normalize_texts([a.abstract for a in articles] + [a.title for a in articles])
+        for article, abstract, title in zip(articles, cleaned[:len(articles)], cleaned[len(articles):]):
+            article.abstract = abstract
+            article.title = title
 
         return state
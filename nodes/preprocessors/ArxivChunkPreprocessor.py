@@ -1,7 +1,7 @@
-import re
-import unicodedata
-from typing import List, Dict
+from typing import Optional
 from states.ArxivPdfContentState import State
+from nodes.chunker.SectionChunker import SectionChunker
+from utils.text_normalization import normalize_text, normalize_texts
 
 class ArxivPreprocessor:
     """
@@ -9,35 +9,20 @@ class ArxivPreprocessor:
     Esegue la pulizia e la normalizzazione del testo per ottimizzarlo.
     """
 
-    def __init__(self):
+    def __init__(self, keep_paragraphs: bool = True, section_source: Optional[SectionChunker] = None):
         """
-        Inizializza il pre-processore. Non sono più necessari parametri di chunking.
-        """
-        pass
-
-    def _clean_text(self, text: str) -> str:
-        """
-        Pulisce il testo rimuovendo caratteri non necessari, spazi extra,
-        e normalizzando il testo (es. 'à' -> 'a', tutto in minuscolo).
+        Inizializza il pre-processore.
 
         Args:
-            text (str): Il testo originale.
-
-        Returns:
-            str: Il testo pulito e normalizzato.
+            keep_paragraphs (bool): mantiene i confini di paragrafo, usati da TokenBudgetPacker
+                per dividere le sezioni troppo lunghe.
+            section_source (SectionChunker): chunker con page_cache da cui rileggere le sezioni
+                quando lo stato ha streamed_sections (il markdown non è mai caricato per intero).
         """
-        # Normalizza i caratteri con accenti con NFD (Forma di Normalizzazione di Decomposizione)
-        text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('utf-8')
-        
-        # Converte il testo in minuscolo
-        text = text.lower()
-    
-        # Rimuove spazi extra, tabulazioni e newline
-        text = re.sub(r'\s+', ' ', text).strip()
-
-        return text
-
-    def __call__(self, state: State) -> State:
+        self.keep_paragraphs = keep_paragraphs
+        self.section_source = section_source
+
+    def __call__(self, state: State) -> dict:
         """
         Esegue il pre-processing completo di un singolo articolo.
 
@@ -45,10 +30,30 @@ class ArxivPreprocessor:
             state (State): I documenti da processare.
 
         Returns:
-            state: I documenti puliti per ogni chunk
+            dict: I documenti puliti per ogni chunk (solo i campi aggiornati: restituire lo stato
+                  completo riapplicherebbe i reducer di keywords e references)
         """
-        for key, value in state.chunks.items():
-            state.chunks[key]= self._clean_text(value)
-             
+        if state.streamed_sections and self.section_source is not None:
+            return self._preprocess_streamed(state)
+
+        if not state.chunks:
+            return {"error_status": ['[ArxivPreprocessor] No chunks to preprocess']}
+
+        # Un'unica chiamata batch per tutte le sezioni del paper
+        keys = list(state.chunks.keys())
+        cleaned = normalize_texts([state.chunks[key] for key in keys], keep_paragraphs=self.keep_paragraphs)
+        return {"chunks": dict(zip(keys, cleaned))}
 
-        return state
+    def _preprocess_streamed(self, state: State) -> dict:
+        """
+        Rilegge le sezioni dalla cache delle pagine e le normalizza una alla volta: in memoria
+        restano solo i testi già normalizzati e la sezione corrente.
+        """
+        sections = self.section_source.iter_cached_sections(state.url)
+        if sections is None:
+            return {"error_status": ['[ArxivPreprocessor] markdown non più presente nella cache']}
+
+        chunks = {span.key: normalize_text(text, keep_paragraphs=self.keep_paragraphs) for span, text in sections}
+        if not chunks:
+            return {"error_status": ['[ArxivPreprocessor] No chunks to preprocess']}
+        return {"chunks": chunks, "streamed_sections": False}
@@ -2,6 +2,8 @@ import json
 from json_repair import repair_json
 from typing import List
 from states.ArxivPdfContentState import State
+from utils.GeminiErrorHandler import GeminiErrorHandler
+from utils.LLMResponseCache import invalidate_cached_response
 import traceback
 import re
 
@@ -9,29 +11,35 @@ class ArxivKeywordsExtractor:
     """
     Estrae Keywords e References dai chunks di un paper Arxiv usando un LLM.
     """
-    def __init__(self, llm, keyword_prompt: str):
+    def __init__(self, llm, keyword_prompt: str, error_handler: GeminiErrorHandler = None):
         """
         Inizializza la classe con il modello LLM e il prompt di sistema.
         
         :param llm: Il modello LLM da utilizzare per l'interrogazione.
         :param keyword_prompt: Il prompt per la selezione delle sezioni.
+        :param error_handler: gestore dei retry (None = politica di default condivisa).
         """
         self.llm = llm
         self.keyword_prompt = keyword_prompt
+        # Retry non bloccante (asyncio.sleep) con la politica condivisa da tutti i nodi LLM
+        self.error_handler = error_handler or GeminiErrorHandler()
 
 
-    def _get_keywords(self, chunk: str) -> List[str]:
+    async def _get_keywords(self, chunk: str) -> List[str]:
         """
         Interroga l'LLM per ottenere una lista di keywords di un chunk.
         
         :param section_keys: Lista delle chiavi di sezione originali.
         :return: Lista di chiavi di sezione filtrate.
         """
+        prompt = f"{self.keyword_prompt}\n{chunk}"
         try:
-            response = self.llm.invoke( f"{self.keyword_prompt}\n{chunk}" ).content
+            response = (await self.error_handler.agemini_invoke_with_retry(self.llm, prompt)).content
             filtered_keys = self.extract_json(response)
 
             if not isinstance(filtered_keys, list):
+                # Risposta non interpretabile: non deve essere riletta dalla cache al prossimo run
+                invalidate_cached_response(self.llm, prompt)
                 raise ValueError("LLM did not return a list of keys.")
 
             return filtered_keys
@@ -67,37 +75,35 @@ class ArxivKeywordsExtractor:
                     return k
         return None
 
-    def __call__(self, state: State) -> State:
+    async def __call__(self, state: State) -> dict:
         """
         Opera sulla pipeline per filtrare le sezioni di ogni articolo.
+        Nodo asincrono eseguito in parallelo a ArxivReferencesExtractor: restituisce solo
+        i campi che aggiorna, così i due rami non scrivono gli stessi campi dello stato.
         
         :param state: L'oggetto di stato della pipeline.
-        :return: Lo stato aggiornato con le sezioni abstract and references filtrate.
+        :return: Gli aggiornamenti dello stato con keywords e sezione abstract.
         """
 
         # recognize abstract or introduction form chunks, to extract keywords
         desired_chunks_trace = ['abstract','introduction']
 
-        state.abstract_key = self._chunk_match(desired_chunks_trace, state.init_keys)
-        print("Abstract key matched: ", state.abstract_key)
+        abstract_key = self._chunk_match(desired_chunks_trace, state.init_keys)
+        print("Abstract key matched: ", abstract_key)
 
         try:
-            state.abstract_chunk = state.chunks[state.abstract_key]
+            abstract_chunk = state.chunks[abstract_key]
         except:
-            state.error_status.append('[ChunkSelector] no abstract chunk found')
             print(state.chunks.keys())
             traceback.print_exc()
-            return state
+            return {"error_status": ['[ChunkSelector] no abstract chunk found']}
         
 
         try:
-            keywords_set = set(self._get_keywords(state.abstract_chunk))
-            state.keywords = list(keywords_set)
+            keywords = list(set(await self._get_keywords(abstract_chunk)))
         except:
-            state.error_status.append('[ChunkSelector] problem in LLM call for keywords extraction')
             traceback.print_exc()
-            return state
+            return {"abstract_key": abstract_key, "abstract_chunk": abstract_chunk, "error_status": ['[ChunkSelector] problem in LLM call for keywords extraction']}
 
 
-        return {"keywords": state.keywords, "abstract_key": state.abstract_key, "abstract_chunk": state.abstract_chunk}
-
+        return {"keywords": keywords, "abstract_key": abstract_key, "abstract_chunk": abstract_chunk}
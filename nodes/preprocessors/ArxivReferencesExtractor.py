@@ -1,36 +1,88 @@
 import json
 from json_repair import repair_json
-from typing import List
+from typing import List, Tuple
 from states.ArxivPdfContentState import State
+from utils.GeminiErrorHandler import GeminiErrorHandler
+from utils.LLMResponseCache import invalidate_cached_response
+from utils.arxiv_ids import find_arxiv_ids, mentions_arxiv
 import traceback
 import re
 
+# Inizio di una voce di bibliografia: '[12]', '\[12\]' (markdown di crawl4ai), '12.', elenco puntato
+_ENTRY_START_RE = re.compile(r"^\s*(?:\\?\[\d+\\?\]|\d+\.\s|[-*•]\s)")
+
+
+def split_reference_entries(text: str) -> List[str]:
+    """
+    Divide una sezione References nelle singole voci. Se le righe iniziano con un marcatore
+    ('[n]', 'n.', '-', '*') le righe di continuazione vengono unite alla voce precedente,
+    altrimenti ogni riga non vuota è una voce.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if sum(1 for line in lines if _ENTRY_START_RE.match(line)) * 2 < len(lines):
+        return lines
+    entries: List[str] = []
+    for line in lines:
+        if entries and not _ENTRY_START_RE.match(line):
+            entries[-1] = f"{entries[-1]} {line}"
+        else:
+            entries.append(line)
+    return entries
+
+
 class ArxivReferencesExtractor:
     """
-    Estrae Keywords e References dai chunks di un paper Arxiv usando un LLM.
+    Estrae le references arXiv dalla sezione References di un paper.
+    Gli ID arXiv (nuovo e vecchio formato, prefisso 'arXiv:', URL abs/pdf/html, DOI arXiv)
+    sono riconosciuti con regex precompilate; l'LLM viene interrogato solo con le voci che
+    citano arXiv ma da cui il parser non ricava un ID.
     """
-    def __init__(self, llm, reference_prompt: str):
+    def __init__(self, llm, reference_prompt: str, use_llm_fallback: bool = True, error_handler: GeminiErrorHandler = None):
         """
         Inizializza la classe con il modello LLM e il prompt di sistema.
         
         :param llm: Il modello LLM da utilizzare per l'interrogazione.
         :param reference_prompt: Il prompt per la selezione delle sezioni.
+        :param use_llm_fallback: se False le voci non risolte dal parser vengono ignorate.
+        :param error_handler: gestore dei retry (None = politica di default condivisa).
         """
         self.llm = llm
         self.reference_prompt = reference_prompt
+        # Retry non bloccante (asyncio.sleep) con la politica condivisa da tutti i nodi LLM
+        self.error_handler = error_handler or GeminiErrorHandler()
+        self.use_llm_fallback = use_llm_fallback
+
+    def parse_references(self, chunk: str) -> Tuple[List[str], List[str]]:
+        """
+        Estrae gli ID arXiv canonici dalla sezione, senza LLM.
 
-    def _get_refs(self, chunk: str) -> List[str]:
+        :return: (ID arXiv trovati senza duplicati, voci che citano arXiv senza ID riconoscibile)
+        """
+        ids: List[str] = []
+        unresolved: List[str] = []
+        for entry in split_reference_entries(chunk):
+            found = find_arxiv_ids(entry)
+            if found:
+                ids.extend(found)
+            elif mentions_arxiv(entry):
+                unresolved.append(entry)
+        return list(dict.fromkeys(ids)), unresolved
+
+    async def _get_refs(self, chunk: str) -> List[str]:
         """
         Interroga l'LLM per ottenere una lista di references di un chunk.
         
         :param section_keys: Lista delle chiavi di sezione originali.
         :return: Lista di chiavi di sezione filtrate.
         """
+        prompt = f"{self.reference_prompt}\n{chunk}"
         try:
-            response = self.llm.invoke( f"{self.reference_prompt}\n{chunk}" ).content
+            response = (await self.error_handler.agemini_invoke_with_retry(self.llm, prompt)).content
             filtered_keys = self.extract_json(response)
             
             if not isinstance(filtered_keys, list):
+                # Risposta non interpretabile: non deve essere riletta dalla cache al prossimo run
+                invalidate_cached_response(self.llm, prompt)
                 raise ValueError("LLM did not return a set of keys.")
             
             return filtered_keys
@@ -67,29 +119,39 @@ class ArxivReferencesExtractor:
                     return k
         return None
 
-    def __call__(self, state: State) -> State:
+    async def __call__(self, state: State) -> dict:
         """
         Opera sulla pipeline per filtrare le sezioni di ogni articolo.
+        Nodo asincrono eseguito in parallelo a ArxivKeywordsExtractor: restituisce solo
+        i campi che aggiorna, così i due rami non scrivono gli stessi campi dello stato.
         
         :param state: L'oggetto di stato della pipeline.
-        :return: Lo stato aggiornato con le sezioni abstract and references filtrate.
+        :return: Gli aggiornamenti dello stato con references e sezione references.
         """
 
         # cerca la chiave delle references tra le chunk keys
         desired_chunks_trace = ['references']
-        state.references_key = self._chunk_match(desired_chunks_trace, state.init_keys)
+        references_key = self._chunk_match(desired_chunks_trace, state.init_keys)
         try:
-            state.references_chunk = state.chunks[state.references_key]
+            references_chunk = state.chunks[references_key]
         except:
-            state.error_status.append('[ChunkSelector] no references chunk found')
             print(state.chunks.keys())
             traceback.print_exc()
-            return state
-        try:
-            refs_set = set(self._get_refs(state.references_chunk))
-            state.references = list(refs_set)
-        except:
-            state.error_status.append('[ChunkSelector] problem in LLM call for references extraction')
-            traceback.print_exc()
-            return state
-        return {"references": state.references, "references_key": state.references_key, "references_chunk": state.references_chunk}
+            return {"error_status": ['[ChunkSelector] no references chunk found']}
+
+        references, unresolved = self.parse_references(references_chunk)
+        print(f"[ArxivReferencesExtractor] {len(references)} ID arXiv dal parser, {len(unresolved)} voci da risolvere con LLM")
+
+        if unresolved and self.use_llm_fallback:
+            try:
+                # Solo le voci non risolte: il prompt è una frazione della sezione completa
+                llm_refs = await self._get_refs("\n".join(unresolved))
+            except:
+                traceback.print_exc()
+                return {"references": references, "references_key": references_key, "references_chunk": references_chunk, "error_status": ['[ChunkSelector] problem in LLM call for references extraction']}
+            for ref in llm_refs:
+                # L'LLM può restituire l'ID o la voce intera: si tiene l'ID canonico se c'è
+                references.extend(find_arxiv_ids(str(ref)) or [str(ref)])
+            references = list(dict.fromkeys(references))
+
+        return {"references": references, "references_key": references_key, "references_chunk": references_chunk}
@@ -2,20 +2,23 @@ import json
 from json_repair import repair_json
 from typing import List
 from states.ArxivPdfContentState import State
+from utils.GeminiErrorHandler import GeminiErrorHandler
 
 class Summarizer:
     """
     Genera un riassunto per ogni sezione di un articolo.
     """
-    def __init__(self, llm, prompt: str):
+    def __init__(self, llm, prompt: str, error_handler: GeminiErrorHandler = None):
         """
         Inizializza la classe con il modello LLM e il prompt di sistema per il riassunto.
 
         :param llm: Il modello LLM da utilizzare per l'interrogazione.
         :param prompt: Il prompt per la generazione del riassunto.
+        :param error_handler: gestore dei retry (None = politica di default condivisa).
         """
         self.llm = llm
         self.prompt = prompt
+        self.error_handler = error_handler or GeminiErrorHandler()
         self.end_prompt = '\n\nSummarized text:\n'
 
     def _summarize_text(self, text: str) -> str:
@@ -26,7 +29,7 @@ class Summarizer:
         :return: La stringa del riassunto.
         """
         try:
-            llm_response = self.llm.invoke(f"{self.prompt}\n\{text}{self.end_prompt}").content
+            llm_response = self.error_handler.gemini_invoke_with_retry(self.llm, f"{self.prompt}\n\{text}{self.end_prompt}").content
             return llm_response
         except Exception as e:
             print(f"Errore nella chiamata a LLM per il riassunto: {e}")
@@ -1,22 +1,46 @@
 import json
+from typing import Dict, List, Optional
 from utils.GeminiErrorHandler import GeminiErrorHandler
-from states.ArxivState import State
+from utils.LLMResponseCache import invalidate_cached_response
+from states.ArxivState import ArticleMetadata, State
 from json_repair import repair_json
 
+# Stima grossolana dei token (Gemini non espone un tokenizer locale): ~4 caratteri per token
+CHARS_PER_TOKEN = 4
+# Token di output stimati per un elemento del batch: "a12": ["kw", ... 4-8 keywords]
+OUTPUT_TOKENS_PER_ITEM = 64
+# Margine sui limiti del modello, per gli errori della stima
+TOKEN_SAFETY_MARGIN = 0.8
+
 
 class GeminiKeywordExtractor():
 
-    def __init__(self, llm, prompt=None):
+    def __init__(self, llm, prompt=None, batch_prompt=None, n_ctx: int = 8192, max_output_tokens: int = 4096, max_batch_size: int = 50, error_handler: GeminiErrorHandler = None):
         """
         Definisci il modello e impostazioni specifiche.
 
         :param llm: Modello gemini 
         :param system_prompt: Prompt di sistema da utilizzare per l'annotazione.
+        :param batch_prompt: Prompt per più abstract in una sola richiesta (output JSON indicizzato per ID).
+                             Se None ogni abstract è annotato con una richiesta separata.
+        :param n_ctx: Finestra di contesto del modello in token (config del modello).
+        :param max_output_tokens: Token massimi di output del modello (config del modello).
+        :param max_batch_size: Numero massimo di abstract per richiesta.
+        :param error_handler: gestore dei retry (None = politica di default condivisa).
         """
         self.llm = llm
         self.system_prompt = prompt
+        self.batch_prompt = batch_prompt
         self.end_prompt = "\nOutput List:\n"
-        self.error_handler= GeminiErrorHandler()
+        self.batch_end_prompt = "\nOutput JSON object:\n"
+        self.error_handler = error_handler or GeminiErrorHandler()
+
+        self.n_ctx = n_ctx
+        self.max_output_tokens = max_output_tokens
+        # Ridotto a metà quando una risposta batch è illeggibile (es. troncata) e fatto
+        # risalire fino al valore configurato quando batch pieni tornano a riuscire
+        self.max_batch_size = max_batch_size
+        self.max_batch_size_limit = max_batch_size
 
 
     def annotate(self, text):
@@ -28,9 +52,13 @@ class GeminiKeywordExtractor():
         :return: Un dizionario Python con l'output JSON.
         """
         
+        prompt = str(self.system_prompt + text + self.end_prompt)
         try:
-            call=self.error_handler.gemini_invoke_with_retry(llm=self.llm, prompt=str(self.system_prompt + text + self.end_prompt))
+            call=self.error_handler.gemini_invoke_with_retry(llm=self.llm, prompt=prompt)
             keywords=self.extract_json(call.content)
+            if isinstance(keywords, Exception):
+                # Risposta non interpretabile: non deve essere riletta dalla cache al prossimo run
+                invalidate_cached_response(self.llm, prompt)
 
 
         except Exception as e:
@@ -55,6 +83,107 @@ class GeminiKeywordExtractor():
         except Exception as e:
             return e
      
+    def _estimate_tokens(self, text: str) -> int:
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    def make_batches(self, articles: List[ArticleMetadata]) -> List[List[ArticleMetadata]]:
+        """
+        Raggruppa gli articoli in batch che rispettano, con margine, sia la finestra di contesto
+        (prompt + abstract + output atteso) sia i token massimi di output del modello.
+        """
+        output_budget = int(self.max_output_tokens * TOKEN_SAFETY_MARGIN)
+        context_budget = int(self.n_ctx * TOKEN_SAFETY_MARGIN) - self._estimate_tokens(self.batch_prompt + self.batch_end_prompt)
+        max_items = max(1, min(self.max_batch_size, output_budget // OUTPUT_TOKENS_PER_ITEM))
+
+        batches: List[List[ArticleMetadata]] = []
+        batch: List[ArticleMetadata] = []
+        batch_tokens = 0
+        for article in articles:
+            # abstract + chiave JSON + output atteso dell'elemento
+            tokens = self._estimate_tokens(article.abstract) + 8 + OUTPUT_TOKENS_PER_ITEM
+            if batch and (len(batch) >= max_items or batch_tokens + tokens > context_budget):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(article)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def annotate_batch(self, articles: List[ArticleMetadata]) -> Dict[int, List[str]]:
+        """
+        Annota più abstract con una sola richiesta. Gli abstract sono inviati come oggetto JSON
+        con ID brevi ("a0", "a1", ...) e la risposta attesa è un oggetto con le stesse chiavi.
+
+        :return: indice dell'articolo nel batch -> keywords, solo per gli elementi validi
+                 (lista non vuota di stringhe); quelli mancanti o malformati sono esclusi.
+        """
+        payload = {f"a{i}": article.abstract for i, article in enumerate(articles)}
+        prompt = self.batch_prompt + json.dumps(payload, ensure_ascii=False) + self.batch_end_prompt
+        call = self.error_handler.gemini_invoke_with_retry(llm=self.llm, prompt=prompt)
+
+        try:
+            parsed = json.loads(repair_json(call.content))
+        except Exception:
+            parsed = None
+
+        results = {}
+        if isinstance(parsed, dict):
+            for i in range(len(articles)):
+                keywords = parsed.get(f"a{i}")
+                if isinstance(keywords, list) and keywords and all(isinstance(k, str) for k in keywords):
+                    results[i] = keywords
+        if len(results) < len(articles):
+            # Risposta incompleta o illeggibile: non deve essere riletta dalla cache al prossimo run
+            invalidate_cached_response(self.llm, prompt)
+        return results
+
+    def annotate_articles(self, articles: List[ArticleMetadata]) -> List[str]:
+        """
+        Modalità batch: annota gli articoli a gruppi e riprova singolarmente (annotate)
+        gli elementi mancanti o malformati nella risposta.
+
+        :return: messaggi di errore per gli articoli non annotati.
+        """
+        errors = []
+        retry: List[ArticleMetadata] = []
+        pending = list(articles)
+        while pending:
+            # Il batch successivo è ricalcolato sul max_batch_size corrente, così una riduzione
+            # (o una crescita) si applica subito agli articoli non ancora inviati
+            batch = self.make_batches(pending)[0]
+            pending = pending[len(batch):]
+            try:
+                results = self.annotate_batch(batch)
+            except Exception as e:
+                print(f"[KeywordExtractor] batch di {len(batch)} abstract fallito: {e}")
+                results = {}
+
+            if len(results) < len(batch) and len(batch) > 1:
+                # Risposta incompleta (es. output troncato a metà JSON): batch più piccoli d'ora in poi
+                self.max_batch_size = max(1, len(batch) // 2)
+                print(f"[KeywordExtractor] risposta batch incompleta ({len(results)}/{len(batch)}), max_batch_size ridotto a {self.max_batch_size}")
+            elif (len(results) == len(batch) and len(batch) >= self.max_batch_size
+                  and self.max_batch_size < self.max_batch_size_limit):
+                # Batch pieno annotato per intero: il limite risale gradualmente
+                self.max_batch_size = min(self.max_batch_size_limit, self.max_batch_size + max(1, self.max_batch_size // 2))
+
+            for i, article in enumerate(batch):
+                if i in results:
+                    article.keywords = results[i]
+                else:
+                    retry.append(article)
+
+        if retry:
+            print(f"[KeywordExtractor] {len(retry)} abstract mancanti o malformati, riprovo singolarmente")
+        for article in retry:
+            keywords = self.annotate(article.abstract)
+            if isinstance(keywords, Exception):
+                errors.append(f"[KeywordExtractor] keywords non estratte per '{article.id}': {keywords}")
+                keywords = []
+            article.keywords = keywords
+        return errors
+
     def __call__(self, state: State) -> State:
         """
         Estrazione con LLM gemini di Keywords from abstract
@@ -63,8 +192,16 @@ class GeminiKeywordExtractor():
         :return: Un dizionario Python con l'output JSON.
         """
         try:
-            for article in state.articles:
-                article.keywords = self.annotate(article.abstract)
+            if self.batch_prompt:
+                articles = [article for article in state.articles if article.abstract]
+                state.error_status.extend(self.annotate_articles(articles))
+            else:
+                for article in state.articles:
+                    keywords = self.annotate(article.abstract)
+                    if isinstance(keywords, Exception):
+                        state.error_status.append(f"[KeywordExtractor] keywords non estratte per '{article.id}': {keywords}")
+                        keywords = []
+                    article.keywords = keywords
         except:
             state.error_status.append("[KeywordExtractor] error in annotate keywords")
 
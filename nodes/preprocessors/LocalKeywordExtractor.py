@@ -0,0 +1,309 @@
+import os
+import re
+import math
+import asyncio
+import threading
+import yaml
+import numpy as np
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from states.ArxivState import State
+from nodes.preprocessors.ArxivKeywordsExtractor import ArxivKeywordsExtractor
+
+DEFAULT_CONFIG_PATH = "config/keyword_extraction.yml"
+
+# Le n-gram candidate non attraversano la punteggiatura
+_PHRASE_SPLIT_RE = re.compile(r"[.,;:!?()\[\]{}\"“”]+|\s[-–—]\s")
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9]*(?:[-'][a-z0-9]+)*")
+
+# Parole che non possono aprire o chiudere una keyword (stopword inglesi + riempitivi tipici degli abstract)
+STOPWORDS = frozenset("""
+a about above after again against all also although among an and any are as at be been before being
+below between both but by can could did do does doing down during each either few for from further had
+has have having here how however if in into is it its itself just may might more most much must no nor
+not now of off on once only or other our ours out over own per same several should since so some such
+than that the their theirs them then there these they this those through thus to too under until up upon
+us very via was we were what when where whether which while who whom whose why will with within without
+would yet you your
+paper propose proposed proposes present presents presented show shows shown study studies work works
+approach approaches method methods result results based using use used new novel existing various
+different significant significantly well first second one two three furthermore moreover respectively
+demonstrate demonstrates achieve achieves achieved make makes provide provides introduce introduces
+""".split())
+# Stopword ammesse all'interno di una keyword
+_INNER_WORDS = frozenset({"of"})
+
+
+def load_keyword_config(path: str = DEFAULT_CONFIG_PATH) -> Dict[str, Any]:
+    """
+    Configurazione del backend di estrazione keywords; {} (backend gemini ovunque) se assente.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def keyword_backend(config: Dict[str, Any], pipeline: str) -> str:
+    """
+    Backend ('gemini' o 'local') scelto per la pipeline ('abstracts' o 'papers').
+    """
+    return (config.get("backends") or {}).get(pipeline, "gemini")
+
+
+def extract_candidates(text: str, max_ngram: int = 3) -> Counter:
+    """
+    Conta le n-gram candidate (1..max_ngram parole) del testo, in minuscolo.
+    Una candidata non inizia né finisce con una stopword, al suo interno ammette solo 'of'
+    ("mixture of experts") e non attraversa la punteggiatura.
+    """
+    counts: Counter = Counter()
+    for phrase in _PHRASE_SPLIT_RE.split((text or "").lower()):
+        tokens = _TOKEN_RE.findall(phrase)
+        for i, first in enumerate(tokens):
+            if first in STOPWORDS or len(first) < 2:
+                continue
+            for n in range(1, min(max_ngram, len(tokens) - i) + 1):
+                last = tokens[i + n - 1]
+                if n > 2 and tokens[i + n - 2] in STOPWORDS and tokens[i + n - 2] not in _INNER_WORDS:
+                    break
+                if last in STOPWORDS:
+                    if last in _INNER_WORDS:
+                        continue
+                    break
+                if len(last) < 2:
+                    continue
+                counts[" ".join(tokens[i:i + n])] += 1
+    return counts
+
+
+def _stems(ngram: str) -> frozenset:
+    # Plurale ridotto al singolare solo per il confronto tra keywords ("learner" ~ "learners")
+    return frozenset(word[:-1] if word.endswith("s") and not word.endswith("ss") else word for word in ngram.split())
+
+
+class TfidfPrior:
+    '''
+    Document frequency delle n-gram candidate sul corpus degli abstract già salvati,
+    usata come prior IDF: le n-gram comuni a tutto il corpus ("language models") pesano
+    meno di quelle specifiche del paper.
+    '''
+    def __init__(self, max_ngram: int = 3):
+        self.max_ngram = max_ngram
+        self.df: Counter = Counter()
+        self.n_docs = 0
+        # Righe della collezione già lette (anche quelle senza documento), per gli aggiornamenti incrementali
+        self.rows_read = 0
+
+    def add_documents(self, texts: Iterable[str]) -> None:
+        for text in texts:
+            self.df.update(extract_candidates(text, self.max_ngram).keys())
+            self.n_docs += 1
+
+    def add_collection(self, collection, page_size: int = 1000) -> int:
+        """
+        Aggiunge al prior i documenti della collezione ChromaDB non ancora letti, a pagine.
+
+        :return: numero di righe lette.
+        """
+        start = self.rows_read
+        while True:
+            page = collection.get(include=["documents"], limit=page_size, offset=self.rows_read)
+            documents = page.get("documents") or []
+            self.add_documents(doc for doc in documents if doc)
+            self.rows_read += len(documents)
+            if len(documents) < page_size:
+                break
+        return self.rows_read - start
+
+    @classmethod
+    def from_collection(cls, collection, max_ngram: int = 3, page_size: int = 1000) -> "TfidfPrior":
+        """
+        Costruisce il prior dai documenti di una collezione ChromaDB, letti a pagine.
+        """
+        prior = cls(max_ngram)
+        prior.add_collection(collection, page_size)
+        print(f"✅ [LocalKeywordExtractor] prior TF-IDF da {prior.n_docs} abstract, {len(prior.df)} n-gram")
+        return prior
+
+    @classmethod
+    def shared(cls, db_path: str, collection_name: str, collection, max_ngram: int = 3) -> "TfidfPrior":
+        """
+        Prior memoizzato per processo per (db_path, collezione, max_ngram): costruito alla prima
+        richiesta, alle successive legge solo gli abstract aggiunti nel frattempo invece di
+        rileggere tutto il corpus a ogni creazione della pipeline.
+        """
+        key = (os.path.abspath(db_path), collection_name, max_ngram)
+        with _SHARED_PRIORS_LOCK:
+            prior = _SHARED_PRIORS.get(key)
+            if prior is None:
+                prior = _SHARED_PRIORS[key] = cls.from_collection(collection, max_ngram)
+            elif prior.add_collection(collection):
+                print(f"✅ [LocalKeywordExtractor] prior TF-IDF aggiornato a {prior.n_docs} abstract")
+        return prior
+
+    @classmethod
+    def from_chroma(cls, db_path: str, collection_name: str, max_ngram: int = 3) -> "TfidfPrior":
+        """
+        Prior (memoizzato) dalla collezione degli abstract su disco; vuoto se la collezione non esiste ancora.
+        """
+        import chromadb
+
+        client = chromadb.PersistentClient(path=db_path)
+        try:
+            collection = client.get_collection(name=collection_name)
+        except Exception as e:
+            print(f"⚠️ [LocalKeywordExtractor] collezione '{collection_name}' non disponibile, prior vuoto: {e}")
+            return cls(max_ngram)
+        return cls.shared(db_path, collection_name, collection, max_ngram)
+
+    def idf(self, ngram: str, extra_df: int = 0, extra_docs: int = 0) -> float:
+        # IDF smussato: le n-gram mai viste hanno il peso massimo
+        return math.log((1 + self.n_docs + extra_docs) / (1 + self.df.get(ngram, 0) + extra_df)) + 1.0
+
+
+# Prior condivisi dalle pipeline dello stesso processo, per (db_path, collezione, max_ngram)
+_SHARED_PRIORS: Dict[Tuple[str, str, int], TfidfPrior] = {}
+_SHARED_PRIORS_LOCK = threading.Lock()
+
+
+class LocalKeywordExtractor:
+    '''
+    Estrazione locale delle keywords, senza chiamate API.
+    Per ogni testo le n-gram candidate sono preselezionate con TF-IDF (prior sul corpus degli
+    abstract salvati + batch corrente), poi ordinate per similarità coseno con il testo usando il
+    modello SentenceTransformer delle collezioni Chroma; la selezione finale usa MMR per evitare
+    keywords quasi duplicate. Testi e candidate di tutto il batch sono embeddati in un'unica chiamata.
+    '''
+    def __init__(self, embedding_function, prior: Optional[TfidfPrior] = None, top_k: int = 6, max_ngram: int = 3, max_candidates: int = 30, prior_weight: float = 0.3, diversity: float = 0.5):
+        """
+        :param embedding_function: embedding function Chroma già caricata (es. writer.embedding_function).
+        :param prior: document frequency sul corpus degli abstract (None = solo il batch corrente).
+        :param top_k: keywords per testo.
+        :param max_ngram: lunghezza massima delle keywords in parole.
+        :param max_candidates: candidate per testo preselezionate con TF-IDF prima dell'embedding.
+        :param prior_weight: peso del punteggio TF-IDF rispetto alla similarità semantica (0-1).
+        :param diversity: peso della diversità nella selezione MMR (0 = solo rilevanza).
+        """
+        self.embedding_function = embedding_function
+        self.prior = prior or TfidfPrior(max_ngram)
+        self.top_k = top_k
+        self.max_ngram = max_ngram
+        self.max_candidates = max_candidates
+        self.prior_weight = prior_weight
+        self.diversity = diversity
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], embedding_function, prior_db=None) -> "LocalKeywordExtractor":
+        """
+        Crea l'estrattore dalla sezione 'local' di config/keyword_extraction.yml.
+        Il prior è letto dalla collezione di prior_db (es. il writer degli abstract) se passato,
+        altrimenti dalla collezione descritta in abstracts_db_config; in entrambi i casi è
+        memoizzato per processo (TfidfPrior.shared).
+        """
+        config = dict(config or {})
+        abstracts_db_config = config.pop("abstracts_db_config", None)
+        max_ngram = config.get("max_ngram", 3)
+        if prior_db is not None:
+            prior = TfidfPrior.shared(prior_db.db_path, prior_db.collection_name, prior_db.collection, max_ngram)
+        elif abstracts_db_config:
+            with open(abstracts_db_config, "r", encoding="utf-8") as f:
+                db_config = yaml.safe_load(f)
+            prior = TfidfPrior.from_chroma(db_config["db_path"], db_config["db_collection"], max_ngram)
+        else:
+            prior = None
+        return cls(embedding_function, prior=prior, **config)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.asarray(self.embedding_function(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _select(self, candidates: List[str], relevance: np.ndarray, vectors: np.ndarray) -> List[str]:
+        """
+        Maximal Marginal Relevance: ogni passo sceglie la candidata più rilevante e meno simile
+        a quelle già scelte; scarta le n-gram contenute in una keyword già scelta (o che la contengono).
+        """
+        selected: List[int] = []
+        available = list(range(len(candidates)))
+        while available and len(selected) < self.top_k:
+            if selected:
+                redundancy = (vectors[available] @ vectors[selected].T).max(axis=1)
+                scores = (1 - self.diversity) * relevance[available] - self.diversity * redundancy
+            else:
+                scores = relevance[available]
+            best = available.pop(int(np.argmax(scores)))
+            words = _stems(candidates[best])
+            if any(words <= _stems(candidates[i]) or words >= _stems(candidates[i]) for i in selected):
+                continue
+            selected.append(best)
+        return [candidates[i] for i in selected]
+
+    def extract_batch(self, texts: List[str]) -> List[List[str]]:
+        """
+        Keywords per ogni testo del batch, nello stesso ordine ([] per i testi vuoti).
+        """
+        counts = [extract_candidates(text, self.max_ngram) for text in texts]
+        # Il batch corrente entra nella document frequency insieme al prior
+        batch_df: Counter = Counter()
+        for doc_counts in counts:
+            batch_df.update(doc_counts.keys())
+
+        shortlists: List[List[str]] = []
+        tfidf_scores: List[np.ndarray] = []
+        for doc_counts in counts:
+            scored = sorted(
+                ((tf * self.prior.idf(ngram, batch_df[ngram], len(texts)), ngram) for ngram, tf in doc_counts.items()),
+                reverse=True
+            )[:self.max_candidates]
+            shortlists.append([ngram for _, ngram in scored])
+            tfidf_scores.append(np.array([score for score, _ in scored], dtype=np.float32))
+
+        vocabulary = list(dict.fromkeys(ngram for shortlist in shortlists for ngram in shortlist))
+        if not vocabulary:
+            return [[] for _ in texts]
+        index = {ngram: i for i, ngram in enumerate(vocabulary)}
+
+        # Un'unica chiamata al modello: testi + tutte le candidate del batch
+        vectors = self._embed([text or "" for text in texts] + vocabulary)
+        doc_vectors, candidate_vectors = vectors[:len(texts)], vectors[len(texts):]
+
+        keywords: List[List[str]] = []
+        for doc_vector, shortlist, tfidf in zip(doc_vectors, shortlists, tfidf_scores):
+            if not shortlist:
+                keywords.append([])
+                continue
+            cand = candidate_vectors[[index[ngram] for ngram in shortlist]]
+            relevance = (1 - self.prior_weight) * (cand @ doc_vector) + self.prior_weight * tfidf / tfidf.max()
+            keywords.append(self._select(shortlist, relevance, cand))
+        return keywords
+
+    def __call__(self, state: State) -> State:
+        """
+        Nodo per la pipeline degli abstract, alternativo a GeminiKeywordExtractor:
+        annota le keywords di tutti gli articoli dello stato in un solo batch.
+        """
+        try:
+            articles = [article for article in state.articles if article.abstract]
+            for article, keywords in zip(articles, self.extract_batch([article.abstract for article in articles])):
+                article.keywords = keywords
+        except Exception as e:
+            state.error_status.append(f"[LocalKeywordExtractor] error in annotate keywords: {e}")
+
+        return state
+
+
+class LocalPaperKeywordsExtractor(ArxivKeywordsExtractor):
+    '''
+    Variante locale di ArxivKeywordsExtractor per la pipeline dei paper: stessa scelta del chunk
+    (abstract o introduzione), keywords da LocalKeywordExtractor invece che dall'LLM.
+    '''
+    def __init__(self, extractor: LocalKeywordExtractor):
+        super().__init__(llm=None, keyword_prompt="")
+        self.extractor = extractor
+
+    async def _get_keywords(self, chunk: str) -> List[str]:
+        # Il forward pass è CPU-bound: fuori dall'event loop, che serve gli altri paper
+        return (await asyncio.to_thread(self.extractor.extract_batch, [chunk]))[0]
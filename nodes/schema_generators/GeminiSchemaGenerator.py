@@ -1,15 +1,42 @@
 import os
+import re
 import json
 import random
-from typing import Optional, Dict
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Tuple
 import requests
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
 from crawl4ai import LLMConfig
+from utils.LLMGovernor import LLMGovernor, LLM_GOVERNOR
 from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
 from crawl4ai.extraction_strategy import JsonCssExtractionStrategy
 
+try:
+    import fcntl  # lock tra processi (POSIX)
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def _file_lock(lock_path: str):
+    """
+    Lock esclusivo tra processi su un file di lock; su sistemi senza fcntl non blocca nulla.
+    """
+    directory = os.path.dirname(lock_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
 
 class LLMSchemaExtractor:
     '''
@@ -17,21 +44,32 @@ class LLMSchemaExtractor:
     La chiaamta viene effettuata alal pagina target per ottenere html,
     i parametri della request sono passati dalla lettura di un file di configurazione json
     '''
-    def __init__(self, provider: str = "gemini/gemini-2.0-flash-001", schema_file: str = "data/schemas.jsonl", user_agents_file: str = "config/http_params/user_agent_params.json", additional_headers_path: str = "config/http_params/additional_headers.json" ):
+    def __init__(self, provider: str = "gemini/gemini-2.0-flash-001", schema_file: str = "data/schemas.jsonl", user_agents_file: str = "config/http_params/user_agent_params.json", additional_headers_path: str = "config/http_params/additional_headers.json", governor: Optional[LLMGovernor] = None):
         """
         Inizializza l'estrattore di schema.
         :param schema_file: percorso file JSONL dove salvare/leggere schemi.
         :param user_agents_file: percorso del file JSON con i user agent rotanti.
         :param additional_headers_path: percorso del file JSON con gli header statici.
+        :param governor: governatore del traffico LLM (None = quello condiviso dal processo).
         """
         load_dotenv()
         self.api_token = os.getenv("GEMINI_API_KEY")
         self.schema_file = schema_file
         self.provider = provider
+        self.governor = governor or LLM_GOVERNOR
     
         self.user_agents_file = user_agents_file
         self.additional_headers_path = additional_headers_path
 
+        # Indice in memoria {sottodominio: schema}, ricaricato solo quando il file cambia
+        self._index: Dict[str, Dict] = {}
+        self._index_stamp: Optional[Tuple[int, int]] = None
+        self._index_lock = threading.Lock()
+        # Un lock per chiave: richieste concorrenti sullo stesso sottodominio generano lo schema una volta sola
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._key_locks_guard = threading.Lock()
+        self.lock_file = f"{self.schema_file}.lock"
+
         # Carica il pool di user agent
         try:
             with open(self.user_agents_file, "r", encoding="utf-8") as f:
@@ -97,40 +135,62 @@ class LLMSchemaExtractor:
             return None
         return None
 
+    def _refresh_index(self) -> None:
+        """
+        Ricarica l'indice dal file JSONL solo se il file è cambiato (mtime o dimensione)
+        dall'ultima lettura, anche per scritture di altri processi.
+        """
+        try:
+            stat = os.stat(self.schema_file)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with self._index_lock:
+            if stamp == self._index_stamp:
+                return
+            index = {}
+            with open(self.schema_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    saved_url = record.get("url")
+                    subdomain = self._extract_deepest_subdomain(saved_url) if saved_url else None
+                    # Come nella ricerca lineare, vince il primo record per sottodominio
+                    if subdomain and subdomain not in index:
+                        index[subdomain] = record.get("schema")
+            self._index = index
+            self._index_stamp = stamp
+
     def load_schema_from_file(self, url: str) -> Optional[Dict]:
         """
-        Cerca nel file JSONL se esiste uno schema salvato per un URL,
+        Cerca nell'indice dei file JSONL se esiste uno schema salvato per un URL,
         confrontando solo il sottodominio più profondo.
         Restituisce lo schema se trovato, altrimenti None.
         """
-        if not os.path.isfile(self.schema_file):
-            return None
-
         input_subdomain = self._extract_deepest_subdomain(url)
         if not input_subdomain:
             return None
 
-        with open(self.schema_file, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    saved_url = record.get("url")
-                    if saved_url:
-                        saved_subdomain = self._extract_deepest_subdomain(saved_url)
-                        # Confronta solo il sottodominio più profondo
-                        if saved_subdomain == input_subdomain:
-                            return record.get("schema")
-                except json.JSONDecodeError:
-                    continue
-        return None
+        self._refresh_index()
+        return self._index.get(input_subdomain)
 
     def save_schema_to_file(self, url: str, schema: dict) -> None:
         """
         Salva lo schema associato a un URL nel file JSONL, appending.
+        La scrittura avviene sotto lock di file, così processi concorrenti non intercalano le righe.
         """
         record = {"url": url, "schema": schema}
-        with open(self.schema_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        with _file_lock(self.lock_file):
+            with open(self.schema_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._refresh_index()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._key_locks_guard:
+            return self._key_locks.setdefault(key, threading.Lock())
     
     def generate_schema(self, html: str) -> dict:
         """
@@ -140,20 +200,39 @@ class LLMSchemaExtractor:
             provider=self.provider, 
             api_token=self.api_token
         )
-        schema = JsonCssExtractionStrategy.generate_schema(html, llm_config=llm_config)
+        # Stessa quota e concorrenza delle chiamate Gemini dei nodi LLM
+        with self.governor.slot(html):
+            schema = JsonCssExtractionStrategy.generate_schema(html, llm_config=llm_config)
         return schema
     
     def __call__(self, url: str) -> dict:
         """
         Se esiste schema in file per url, lo ritorna.
         Altrimenti scarica html, genera schema, salva e ritorna.
+        Le richieste concorrenti per lo stesso sottodominio (thread o processi) attendono
+        la prima, così la generazione con Gemini avviene al più una volta per chiave.
         """
         cached_schema = self.load_schema_from_file(url)
         if cached_schema is not None:
             return cached_schema
+
+        key = self._extract_deepest_subdomain(url) or url
+        with self._key_lock(key):
+            # Un altro thread potrebbe aver appena generato lo schema
+            cached_schema = self.load_schema_from_file(url)
+            if cached_schema is not None:
+                return cached_schema
+
+            safe_key = re.sub(r'[^\w.-]', '_', key)
+            key_lock_file = f"{self.schema_file}.{safe_key}.lock"
+            with _file_lock(key_lock_file):
+                # ...o un altro processo
+                cached_schema = self.load_schema_from_file(url)
+                if cached_schema is not None:
+                    return cached_schema
+
+                html = self.fetch_html(url)
+                schema = self.generate_schema(html)
+                self.save_schema_to_file(url, schema)
         
-        html = self.fetch_html(url)
-        schema = self.generate_schema(html)
-        self.save_schema_to_file(url, schema)
-        
-        return schema
\ No newline at end of file
+        return schema
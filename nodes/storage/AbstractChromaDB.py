@@ -1,8 +1,9 @@
 import chromadb
 from chromadb.utils import embedding_functions
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 import os
 import json
+import time
 
 from states.ArxivState import State
 
@@ -13,16 +14,18 @@ class AbstractChromaDB:
     con i metadati. Questa classe funge anche da nodo LangGraph.
     """
     
-    def __init__(self, db_path: str = "./chroma_db", collection_name: str = "arxiv_abstracts"):
+    def __init__(self, db_path: str = "./chroma_db", collection_name: str = "arxiv_abstracts", batch_size: int = 64):
         """
         Inizializza il client ChromaDB.
         
         Args:
             db_path (str): Il percorso della directory dove verranno salvati i dati del DB.
             collection_name (str): Il nome della collezione da usare.
+            batch_size (int): documenti per add: un solo forward pass del modello di embedding per batch.
         """
         self.db_path = db_path
         self.collection_name = collection_name
+        self.batch_size = batch_size
         
         # Inizializza il client ChromaDB in modalità persistente
         self.client = chromadb.PersistentClient(path=self.db_path)
@@ -56,6 +59,27 @@ class AbstractChromaDB:
             print(f"Errore durante il controllo del documento: {e}")
             return False
 
+    @staticmethod
+    def _build_metadata(doc, query: str) -> Dict[str, Any]:
+        """
+        Metadati del documento: tutti i campi tranne 'abstract' e 'id', più la query di ricerca.
+        Solo valori accettati da ChromaDB: un valore non valido (es. un'eccezione rimasta nelle
+        keywords) farebbe rifiutare l'intero batch.
+        """
+        doc_dict = doc.model_dump(warnings=False)
+        metadata = {k: v for k, v in doc_dict.items() if k != 'abstract' and k != 'id'}
+        metadata['query_string'] = query
+        
+        # Converte le liste in stringhe JSON per la compatibilità con i metadati di ChromaDB
+        for key, value in list(metadata.items()):
+            if isinstance(value, list):
+                metadata[key] = json.dumps([v for v in value if isinstance(v, (str, int, float, bool))])
+            elif value is None or isinstance(value, BaseException):
+                del metadata[key]
+            elif not isinstance(value, (str, int, float, bool)):
+                metadata[key] = str(value)
+        return metadata
+
     def save_document(self, doc: Dict[str, Any], query: str) -> Optional[str]:
         """
         Salva un documento nel database vettoriale se non esiste già.
@@ -80,15 +104,7 @@ class AbstractChromaDB:
             return None
 
         try:
-            # Prepara il documento per ChromaDB.
-            doc_dict = doc.model_dump()
-            metadata = {k: v for k, v in doc_dict.items() if k != 'abstract' and k != 'id'}
-            metadata['query_string'] = query
-            
-            # Converte le liste in stringhe JSON per la compatibilità con i metadati di ChromaDB
-            for key, value in metadata.items():
-                if isinstance(value, list):
-                    metadata[key] = json.dumps(value)
+            metadata = self._build_metadata(doc, query)
             
             self.collection.add(
                 documents=[abstract],
@@ -102,6 +118,72 @@ class AbstractChromaDB:
             print(f"❌ Errore durante il salvataggio del documento '{doc_id}': {e}")
             return None
 
+    def save_documents(self, docs: List[Any], query: str) -> Tuple[List[str], List[str]]:
+        """
+        Salva in blocco i documenti non ancora presenti nel DB vettoriale.
+        Un'unica get con tutti gli ID individua quelli nuovi, poi una add per ogni batch di
+        batch_size documenti: il modello di embedding lavora a batch pieno invece che uno alla volta.
+        Se la add di un batch fallisce, i suoi documenti sono riprovati uno alla volta,
+        così si perde solo quello che causa l'errore.
+        
+        Args:
+            docs (List): documenti con 'id' e 'abstract'.
+            query (str): la query di ricerca da salvare nei metadati.
+        
+        Returns:
+            Tuple[List[str], List[str]]: gli ID dei documenti salvati e quelli non salvati per errore.
+        """
+        valid = {}
+        for doc in docs:
+            if not doc.id or not doc.abstract:
+                print("⚠️ Documento non valido: mancano 'id' o 'abstract'.")
+                continue
+            # A parità di ID vale il primo documento, come nel salvataggio singolo
+            valid.setdefault(doc.id, doc)
+        if not valid:
+            return [], []
+
+        try:
+            existing = set(self.collection.get(ids=list(valid), include=[])['ids'])
+        except Exception as e:
+            print(f"Errore durante il controllo dei documenti: {e}")
+            existing = set()
+        if existing:
+            print(f"✅ {len(existing)} documenti esistono già. Salvataggio saltato.")
+        new_docs = [doc for doc_id, doc in valid.items() if doc_id not in existing]
+
+        saved: List[str] = []
+        skipped: List[str] = []
+        total_time = 0.0
+        for start in range(0, len(new_docs), self.batch_size):
+            batch = new_docs[start:start + self.batch_size]
+            ids = [doc.id for doc in batch]
+            t0 = time.perf_counter()
+            try:
+                self.collection.add(
+                    documents=[doc.abstract for doc in batch],
+                    metadatas=[self._build_metadata(doc, query) for doc in batch],
+                    ids=ids
+                )
+            except Exception as e:
+                print(f"❌ Errore durante il salvataggio del batch {start // self.batch_size + 1} ({len(batch)} documenti): {e}. Riprovo un documento alla volta.")
+                for doc in batch:
+                    if self.save_document(doc, query) is not None:
+                        saved.append(doc.id)
+                    else:
+                        skipped.append(doc.id)
+                continue
+            elapsed = time.perf_counter() - t0
+            total_time += elapsed
+            saved.extend(ids)
+            print(f"✅ Batch {start // self.batch_size + 1}: {len(batch)} documenti in {elapsed:.2f}s ({len(batch) / max(elapsed, 1e-9):.1f} doc/s)")
+
+        if saved:
+            print(f"✅ Salvati {len(saved)} documenti in {total_time:.2f}s ({len(saved) / max(total_time, 1e-9):.1f} doc/s).")
+        if skipped:
+            print(f"❌ {len(skipped)} documenti non salvati: {skipped}")
+        return saved, skipped
+
     def __call__(self, state: State) -> State:
         """
         Metodo che funge da nodo per LangGraph. 
@@ -115,7 +197,8 @@ class AbstractChromaDB:
             state.error_status.append("Nessun articolo da salvare nello stato.")
             return state
 
-        for doc_model in articles_to_process:
-            self.save_document(doc_model,query) 
+        _, skipped = self.save_documents(articles_to_process, query)
+        if skipped:
+            state.error_status.append(f"[AbstractChromaDB] documenti non salvati: {skipped}")
         
         return state
\ No newline at end of file
@@ -1,9 +1,16 @@
 import chromadb
 from chromadb.utils import embedding_functions
+import re
 import json
+import time
+import hashlib
+from typing import Dict, List, Tuple
 
 from states.ArxivPdfContentState import State
+from utils.arxiv_ids import canonicalize_arxiv_id
+from utils.PageCache import PageCache
 
+_WHITESPACE_RE = re.compile(r"\s+")
 
 
 class ChunkChromaDB:
@@ -11,25 +18,38 @@ class ChunkChromaDB:
     Client per il database vettoriale che gestisce la connessione,
     il controllo di esistenza del documento e il salvataggio degli embeddings
     con i metadati. Questa classe funge anche da nodo LangGraph.
+
+    Ogni chunk ha come ID '<paper_id>:<hash del contenuto normalizzato>' e nei metadati
+    paper_id, versione arXiv e hash: l'insieme dei chunk di un paper è il suo manifest.
+    A ogni nuovo crawl (anche di una nuova versione) vengono embeddati solo i chunk nuovi
+    o modificati, eliminati quelli rimossi e aggiornati solo i metadati degli altri.
     """
     
-    def __init__(self, db_path: str = "./chroma_db", collection_name: str = "arxiv_chunks"):
+    def __init__(self, db_path: str = "./chroma_db", collection_name: str = "arxiv_chunks", embedding_model_name: str = "paraphrase-multilingual-mpnet-base-v2", batch_size: int = 128):
         """
         Inizializza il client ChromaDB.
         
         Args:
             db_path (str): Il percorso della directory dove verranno salvati i dati del DB.
             collection_name (str): Il nome della collezione da usare.
+            embedding_model_name (str): Il modello SentenceTransformer degli embedding
+                (lo stesso usato da TokenBudgetPacker per il budget di token).
+            batch_size (int): chunk massimi per scrittura (limitati al max_batch_size del client).
+                Un paper di solito sta in un solo batch: una scrittura e un forward pass.
         """
         self.db_path = db_path
         self.collection_name = collection_name
         
         # Inizializza il client ChromaDB in modalità persistente
         self.client = chromadb.PersistentClient(path=self.db_path)
+        try:
+            self.batch_size = min(batch_size, self.client.get_max_batch_size())
+        except Exception:
+            self.batch_size = batch_size
         
         # Sceglie un embedding function multilingue
         self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="paraphrase-multilingual-mpnet-base-v2"
+            model_name=embedding_model_name
         )
         
         # Ottiene o crea la collezione
@@ -39,39 +59,53 @@ class ChunkChromaDB:
         )
         print(f"✅ Connesso a ChromaDB e alla collezione '{self.collection_name}'.")
 
-    def _check_document_exists(self, url: str, key: str) -> bool:
+    @staticmethod
+    def paper_identity(url: str) -> Tuple[str, str]:
         """
-        Controlla se un documento (chunk) con una data coppia (url, key) esiste già.
-        
-        Args:
-            url (str): L'URL del documento.
-            key (str): La chiave (titolo della sezione) del chunk.
-        
-        Returns:
-            bool: True se il chunk esiste, False altrimenti.
+        (paper_id, versione) di un URL: 'https://arxiv.org/html/2508.15260v2' -> ('2508.15260', 'v2').
+        Per gli URL non arXiv il paper_id è l'URL canonico e la versione è vuota.
         """
-        try:
-            # Esegue una query sul DB per cercare metadati corrispondenti
-            results = self.collection.get(
-                where={
-                    "$and": [
-                        {"url": {"$eq": url}},
-                        {"key": {"$eq": key}}
-                    ]
-                }
-            )
-            # Se vengono trovati dei risultati, il documento esiste
-            return len(results['ids']) > 0
-        except Exception as e:
-            print(f"❌ Errore durante il controllo di esistenza per (url='{url}', key='{key}'): {e}")
-            return False
+        versioned = canonicalize_arxiv_id(url, keep_version=True)
+        if versioned:
+            paper_id = canonicalize_arxiv_id(url)
+            return paper_id, versioned[len(paper_id):]
+        return PageCache.canonical_url(url), ""
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """
+        Hash del testo normalizzato (spazi compressi): cambia solo se cambia il contenuto.
+        """
+        normalized = _WHITESPACE_RE.sub(" ", text).strip()
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+
+    def get_manifest(self, paper_id: str, url: str) -> Dict[str, Dict]:
+        """
+        Manifest del paper ricavato dai metadati, con un'unica get: ID del chunk -> metadati.
+        Include i chunk salvati con il vecchio schema di ID ('<url>-<key>') per lo stesso URL.
+        """
+        results = self.collection.get(
+            where={
+                "$or": [
+                    {"paper_id": {"$eq": paper_id}},
+                    {"url": {"$eq": url}}
+                ]
+            },
+            include=["metadatas"]
+        )
+        return dict(zip(results['ids'], results['metadatas']))
+
+    def _batches(self, ids: List[str]) -> List[List[str]]:
+        return [ids[i:i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
 
     def save_document(self, state: State) -> State:
         """
-        Salva i chunk riassunti nel database vettoriale, se non esistono già.
+        Sincronizza i chunk del paper con il database vettoriale confrontandoli con il manifest:
+        aggiunge (embedding) i chunk nuovi o modificati, elimina quelli non più presenti e per
+        quelli invariati aggiorna solo i metadati se sono cambiati (es. nuova versione).
         
         Args:
-            state (State): Lo stato LangGraph contenente 'url' e 'summarized_chunks'.
+            state (State): Lo stato LangGraph contenente 'url' e 'chunks'.
             
         Returns:
             State: Lo stato aggiornato con eventuali messaggi di errore.
@@ -82,44 +116,82 @@ class ChunkChromaDB:
             state.error_status.append(error_msg)
             return state
 
+        paper_id, version = self.paper_identity(state.url)
+
+        # Metadati comuni a tutti i chunk del paper, serializzati una sola volta
+        shared_metadata = {
+            "url": state.url,
+            "paper_id": paper_id,
+            "version": version,
+            "abstract": state.abstract_chunk,
+            "keywords": json.dumps(state.keywords) if state.keywords is not None else "[]",
+            "references": json.dumps(state.references) if state.references is not None else "[]",
+        }
+        # ChromaDB non accetta valori None nei metadati
+        shared_metadata = {k: v for k, v in shared_metadata.items() if v is not None}
+
+        documents: Dict[str, str] = {}
+        metadatas: Dict[str, Dict] = {}
         for key, text in state.chunks.items():
-            try:
-                if self._check_document_exists(state.url, key):
-                    print(f"✅ Chunk (url='{state.url}', key='{key}') esiste già. Salvataggio saltato.")
-                    continue
-                
-                # Serializza keywords e references come stringa JSON
-                keywords_str = json.dumps(state.keywords) if state.keywords is not None else "[]"
-                references_str = json.dumps(state.references) if state.references is not None else "[]"
-                
-                # Prepara i dati per l'upsert
-                documents = [text]
-                metadatas = [{
-                    "url": state.url,
-                    "key": key,
-                    "abstract": state.abstract_chunk,
-                    "keywords": keywords_str,
-                    "references": references_str
-                }]
-                ids = [f"{state.url}-{key}"] # Crea un ID univoco
-                
-                # Aggiunge (o aggiorna) il chunk nel database
-                self.collection.add(
-                    documents=documents,
-                    metadatas=metadatas,
-                    ids=ids
+            content_hash = self.content_hash(text)
+            chunk_id = f"{paper_id}:{content_hash}"
+            if chunk_id in documents:
+                # Stesso contenuto già presente nel paper: viene embeddato una sola volta
+                continue
+            documents[chunk_id] = text
+            metadatas[chunk_id] = {
+                **shared_metadata,
+                "content_hash": content_hash,
+                "key": key,
+                "sections": json.dumps(state.chunk_sections.get(key, [key]))
+            }
+
+        try:
+            manifest = self.get_manifest(paper_id, state.url)
+        except Exception as e:
+            error_msg = f"❌ Errore durante la lettura del manifest di '{paper_id}': {e}"
+            print(error_msg)
+            state.error_status.append(error_msg)
+            return state
+
+        added = [chunk_id for chunk_id in documents if chunk_id not in manifest]
+        removed = [chunk_id for chunk_id in manifest if chunk_id not in documents]
+        # Contenuto invariato: niente embedding, solo i metadati se diversi (versione, keywords, ...)
+        refreshed = [chunk_id for chunk_id in documents if chunk_id in manifest and manifest[chunk_id] != metadatas[chunk_id]]
+
+        try:
+            # Chunk nuovi: una upsert per batch, cioè un forward pass del modello per batch
+            t0 = time.perf_counter()
+            for batch in self._batches(added):
+                self.collection.upsert(
+                    ids=batch,
+                    documents=[documents[chunk_id] for chunk_id in batch],
+                    metadatas=[metadatas[chunk_id] for chunk_id in batch]
+                )
+            embed_time = time.perf_counter() - t0
+            for batch in self._batches(refreshed):
+                self.collection.update(
+                    ids=batch,
+                    metadatas=[metadatas[chunk_id] for chunk_id in batch]
                 )
-                print(f"✔️ Salvato il chunk (url='{state.url}', key='{key}').")
-                
-            except Exception as e:
-                error_msg = f"❌ Errore durante il salvataggio del chunk (url='{state.url}', key='{key}'): {e}"
-                print(error_msg)
-                state.error_status.append(error_msg)
+            for batch in self._batches(removed):
+                self.collection.delete(ids=batch)
+            print(f"✔️ Paper '{paper_id}{version}': {len(added)} chunk aggiunti, {len(refreshed)} aggiornati, "
+                  f"{len(removed)} eliminati, {len(documents) - len(added) - len(refreshed)} invariati.")
+            if added:
+                print(f"⏱️ Embedding di {len(added)} chunk in {-(-len(added) // self.batch_size)} batch: "
+                      f"{embed_time:.2f}s ({len(added) / max(embed_time, 1e-9):.1f} chunk/s)")
+
+        except Exception as e:
+            error_msg = f"❌ Errore durante il salvataggio dei chunk (url='{state.url}'): {e}"
+            print(error_msg)
+            state.error_status.append(error_msg)
         
         return state
 
-    def __call__(self, state: State) -> State:
+    def __call__(self, state: State) -> dict:
         """
         Nodo LangGraph che esegue il salvataggio dei chunk.
+        Restituisce solo error_status, l'unico campo che il salvataggio può modificare.
         """
-        return self.save_document(state)
\ No newline at end of file
+        return {"error_status": self.save_document(state).error_status}
\ No newline at end of file
@@ -1,19 +1,27 @@
 import os
 import logging
 import traceback
+from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
 # Langchain and Langgraph Components
 from langchain_google_genai import ChatGoogleGenerativeAI
+from utils.LLMResponseCache import CachedChatModel
+from utils.LLMGovernor import GovernedChatModel, LLM_GOVERNOR
 from langgraph.graph import START, END, StateGraph
 
 # Nodes,states
 from states.ArxivState import State
 from nodes.crawlers.ArxivApiClient import ArxivApiClient
 from nodes.preprocessors.GeminiKeywordExtractor import GeminiKeywordExtractor
-from nodes.preprocessors.ArxivPreprocessor import ArxivPreprocessor
+from nodes.preprocessors.LocalKeywordExtractor import LocalKeywordExtractor, load_keyword_config, keyword_backend
+from nodes.preprocessors.ArxivAbstractPreprocessor import ArxivPreprocessor
 from nodes.storage.AbstractChromaDB import AbstractChromaDB as ChromaDB
+from utils.WatermarkStore import WatermarkStore
+from utils.PolitenessScheduler import ARXIV_SCHEDULER
+from utils.arxiv_ids import canonicalize_arxiv_id
 
 # Langfuse classes
 from langfuse import Langfuse
@@ -43,26 +51,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_pipeline(arxivClient: ArxivApiClient, preprocessor1: ArxivPreprocessor, preprocessor2: GeminiKeywordExtractor, writer: ChromaDB):
+def create_pipeline(arxivClient: Optional[ArxivApiClient], preprocessor1: ArxivPreprocessor, preprocessor2: GeminiKeywordExtractor, writer: ChromaDB):
     """
     Crea e compila la pipeline Langgraph.
+    Se arxivClient è None il grafo parte direttamente dal preprocessing degli articoli
+    già presenti nello stato (usato dalla modalità batch).
     """
     workflow = StateGraph(State)
-    workflow.add_node("arxiv_searcher", arxivClient)
+    if arxivClient is not None:
+        workflow.add_node("arxiv_searcher", arxivClient)
     workflow.add_node("writer_node", writer)
     workflow.add_node("preprocessing_node", preprocessor1)
     workflow.add_node("keyword_node", preprocessor2)
     
 
     # Definizione del flusso di lavoro (edges)
-    workflow.add_edge(START, "arxiv_searcher")
-    workflow.add_edge("arxiv_searcher", "preprocessing_node")
+    if arxivClient is not None:
+        workflow.add_edge(START, "arxiv_searcher")
+        workflow.add_edge("arxiv_searcher", "preprocessing_node")
+    else:
+        workflow.add_edge(START, "preprocessing_node")
     workflow.add_edge("preprocessing_node", "keyword_node")
     workflow.add_edge("keyword_node", "writer_node")
     workflow.add_edge("writer_node", END)
 
     pipeline = workflow.compile()
 
+    if arxivClient is None:
+        return pipeline
+
     try:
         graphImage = pipeline.get_graph().draw_mermaid_png()
         with open("images/gemini_api_llm_abstract_pipeline.png", "wb") as f:
@@ -74,16 +91,31 @@ def create_pipeline(arxivClient: ArxivApiClient, preprocessor1: ArxivPreprocesso
 
     return pipeline
 
-def run_pipeline(query, geminiConfig, dbConfig, prompts):
+def create_keyword_extractor(geminiLLM, geminiConfig, prompts, writer: ChromaDB):
     """
-    Esegue la pipeline Langgraph con la configurazione specificata.
+    Nodo di estrazione delle keywords secondo il backend 'abstracts' di config/keyword_extraction.yml:
+    Gemini, oppure il backend locale che riusa il modello di embedding del writer e costruisce
+    il prior TF-IDF dagli abstract già salvati nella sua collezione.
     """
+    keyword_config = load_keyword_config()
+    if keyword_backend(keyword_config, "abstracts") == "local":
+        return LocalKeywordExtractor.from_config(keyword_config.get("local"), writer.embedding_function, prior_db=writer)
 
-    db_path = dbConfig['db_path']
-    collection_name = dbConfig['db_collection']
-    keyword_prompt = prompts['keyword_prompt']
+    # Più abstract per richiesta se il prompt batch è configurato
+    return GeminiKeywordExtractor(
+        llm = geminiLLM,
+        prompt = prompts['keyword_prompt'],
+        batch_prompt = prompts.get('keyword_batch_prompt'),
+        n_ctx = geminiConfig.get("n_ctx", 8192),
+        max_output_tokens = geminiConfig["max_output_tokens"]
+    )
 
-    # Inizializza il modello LLM
+def _build_llm(geminiConfig):
+    """
+    Modello Gemini condiviso dai nodi: quota RPM/TPM e concorrenza del governatore di processo,
+    e cache delle risposte (config/llm_cache.yml), così i prompt già inviati non vengono ripagati
+    né consumano quota.
+    """
     geminiLLM = ChatGoogleGenerativeAI(
         model = geminiConfig["model_name"],
         google_api_key = geminiConfig["gemini_api_key"],
@@ -92,27 +124,72 @@ def run_pipeline(query, geminiConfig, dbConfig, prompts):
         top_p = geminiConfig["top_p"],
         top_k = geminiConfig.get("top_k", None),
     )
+    LLM_GOVERNOR.configure_from(geminiConfig)
+    return CachedChatModel.from_yaml(GovernedChatModel(geminiLLM))
+
+def _build_nodes(dbConfig, geminiConfig, prompts, geminiLLM) -> Dict[str, Any]:
+    """
+    Nodi del grafo a valle della ricerca, come argomenti di create_pipeline.
+    """
+    writer = ChromaDB(dbConfig['db_path'], dbConfig['db_collection'], dbConfig.get('batch_size', 64))
+    return {
+        "preprocessor1": create_keyword_extractor(geminiLLM, geminiConfig, prompts, writer),
+        "preprocessor2": ArxivPreprocessor(),
+        "writer": writer,
+    }
+
+# Errori che lasciano articoli del delta fuori dal DB: download incompleto o scrittura su Chroma fallita.
+# Gli errori di estrazione delle keywords non bloccano il watermark: l'articolo è comunque salvato
+# (con keywords vuote) e riscaricarlo a ogni run non lo correggerebbe.
+WATERMARK_BLOCKING_ERRORS = ("[ArxivApiClient]", "[AbstractChromaDB]")
+
+
+def advance_watermark(watermark_store: Optional[WatermarkStore], query: str, state) -> None:
+    """
+    Avanza il watermark della query solo se tutti gli articoli del delta sono stati scaricati e salvati:
+    con errori di download o di scrittura su Chroma il watermark resta dov'è, così il run successivo
+    riscarica il delta e gli articoli già salvati vengono saltati da ChromaDB.
+    """
+    if not watermark_store or not state.get('watermark'):
+        return
+    blocking = [error for error in state.get('error_status') or [] if error.startswith(WATERMARK_BLOCKING_ERRORS)]
+    if blocking:
+        logger.warning(f"Watermark non aggiornato per query = {query}: {blocking}")
+        return
+    watermark_store.update(query, state['watermark'])
+    logger.info(f"Watermark aggiornato per query = {query} : {state['watermark']}")
+
+
+def run_pipeline(query, geminiConfig, dbConfig, prompts):
+    """
+    Esegue la pipeline Langgraph con la configurazione specificata.
+    """
+
+    # Watermark per query: le esecuzioni successive scaricano solo i nuovi articoli
+    watermark_path = dbConfig.get('watermark_path')
+    watermark_store = WatermarkStore(watermark_path) if watermark_path else None
+
+    geminiLLM = _build_llm(geminiConfig)
 
     # Inizializzazione delle classi dei nodi
-    arxivClient = ArxivApiClient(max_results=1)
-    preprocessor1 = GeminiKeywordExtractor(llm = geminiLLM, prompt=keyword_prompt)
-    preprocessor2 = ArxivPreprocessor()
-    writer = ChromaDB(db_path,collection_name)
+    arxivClient = ArxivApiClient(max_results=1, watermark_store=watermark_store)
     
     # Crea la pipeline
-    graph = create_pipeline(arxivClient, preprocessor1, preprocessor2, writer)
+    graph = create_pipeline(arxivClient, **_build_nodes(dbConfig, geminiConfig, prompts, geminiLLM))
 
     ### Langfuse ### 
     # `config={"callbacks": [langfuse_handler]}`
 
     try:
         # Invocazione della pipeline con tracciamento Langfuse
-        state = graph.invoke({"query": query}, config={"callbacks": [langfuse_handler]})
+        state = graph.invoke({"query_string": query}, config={"callbacks": [langfuse_handler]})
 
         error_status = state.get('error_status',[])
-        if error_status == []:
+        if error_status:
             logger.warning(f"Errore nello stato per query = {query} : {state['error_status']}")
-            
+
+        advance_watermark(watermark_store, query, state)
+
         return state
                 
     except Exception as e:
@@ -121,3 +198,86 @@ def run_pipeline(query, geminiConfig, dbConfig, prompts):
         exit(1)
 
 
+def run_pipeline_batch(queries: List[str], geminiConfig, dbConfig, prompts, max_results: int = 1, max_concurrency: int = 4):
+    """
+    Esegue la pipeline per più query in parallelo condividendo un'unica istanza di ogni nodo
+    (client Gemini, SentenceTransformer di ChromaDB, grafo compilato) e lo scheduler arXiv.
+    Gli articoli restituiti da più query vengono deduplicati per ID arXiv prima di
+    estrazione keywords ed embedding: ogni articolo è processato una sola volta,
+    associato alla prima query che lo ha trovato.
+
+    Args:
+        queries (List[str]): stringhe di ricerca.
+        max_results (int): risultati massimi per query (al primo run, senza watermark).
+        max_concurrency (int): numero massimo di query processate contemporaneamente.
+
+    Returns:
+        List: lo stato finale per ogni query (o l'eccezione sollevata).
+    """
+
+    queries = list(dict.fromkeys(q for q in queries if q))
+    watermark_path = dbConfig.get('watermark_path')
+    watermark_store = WatermarkStore(watermark_path) if watermark_path else None
+
+    # Inizializza il modello LLM e i nodi una sola volta per tutto il batch
+    geminiLLM = _build_llm(geminiConfig)
+    graph = create_pipeline(None, **_build_nodes(dbConfig, geminiConfig, prompts, geminiLLM))
+
+    # 1. Ricerca: un client leggero per query (tengono l'offset di paginazione),
+    #    tutti vincolati allo stesso scheduler di cortesia dell'API arXiv
+    #    Un errore di una query (es. feed non valido) non deve far perdere i risultati delle altre:
+    #    la query resta senza articoli, non passa dal grafo e il suo watermark non avanza
+    def search(query: str) -> State:
+        client = ArxivApiClient(max_results=max_results, scheduler=ARXIV_SCHEDULER, watermark_store=watermark_store)
+        try:
+            return client(State(query_string=query))
+        except Exception as e:
+            logger.error(f"Errore nella ricerca per query = {query}: {e}")
+            logger.debug(traceback.format_exc())
+            return State(query_string=query, error_status=[f"[ArxivApiClient] ricerca fallita: {e}"])
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        search_states = list(pool.map(search, queries))
+
+    # 2. Deduplica per ID arXiv tra tutte le query
+    seen = set()
+    inputs = []
+    for search_state in search_states:
+        articles = []
+        for article in search_state.articles:
+            arxiv_id = canonicalize_arxiv_id(article.id) or article.id
+            if arxiv_id in seen:
+                continue
+            seen.add(arxiv_id)
+            articles.append(article)
+        total = len(search_state.articles)
+        logger.info(f"Query = {search_state.query_string}: {len(articles)} articoli nuovi su {total} ({total - len(articles)} duplicati)")
+        inputs.append({
+            "query_string": search_state.query_string,
+            "articles": articles,
+            "watermark": search_state.watermark,
+            "error_status": search_state.error_status,
+        })
+
+    # 3. Keywords, preprocessing e scrittura in parallelo sullo stesso grafo compilato.
+    #    Le query senza articoli nuovi (tutti già presi da query precedenti) non passano dal grafo:
+    #    il writer segnalerebbe la lista vuota come errore e il loro watermark non avanzerebbe mai
+    to_run = [i for i, state in enumerate(inputs) if state["articles"]]
+    states: List = list(inputs)
+    results = graph.batch(
+        [inputs[i] for i in to_run],
+        config={"callbacks": [langfuse_handler], "max_concurrency": max_concurrency},
+        return_exceptions=True
+    ) if to_run else []
+    for i, result in zip(to_run, results):
+        states[i] = result
+
+    for query, state in zip(queries, states):
+        if isinstance(state, Exception):
+            logger.error(f"Errore durante l'invocazione della pipeline per query = {query}: {state}")
+            continue
+        if state.get('error_status'):
+            logger.warning(f"Errore nello stato per query = {query} : {state['error_status']}")
+        advance_watermark(watermark_store, query, state)
+
+    return states
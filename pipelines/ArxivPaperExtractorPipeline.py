@@ -1,11 +1,15 @@
 import os
+import asyncio
 import logging
 import traceback
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 load_dotenv()
 
 # Langchain and Langgraph Components
 from langchain_google_genai import ChatGoogleGenerativeAI
+from utils.LLMResponseCache import CachedChatModel
+from utils.LLMGovernor import GovernedChatModel, LLM_GOVERNOR
 from langgraph.graph import START, END, StateGraph
 
 # Nodes,states
@@ -13,13 +17,16 @@ from states.ArxivPdfContentState import State
 
 # Retrive
 from nodes.crawlers.ArxivFetcher import ArxivFetcher
+from utils.BrowserPool import BrowserPool
 # Chunk by sections
 from nodes.chunker.SectionChunker import SectionChunker
+from nodes.chunker.TokenBudgetPacker import TokenBudgetPacker, DEFAULT_EMBEDDING_MODEL
 # parallel tasks, keyqwords and references extractions
 from nodes.preprocessors.ArxivReferencesExtractor import ArxivReferencesExtractor
 from nodes.preprocessors.ArxivKeywordsExtractor import ArxivKeywordsExtractor
+from nodes.preprocessors.LocalKeywordExtractor import LocalKeywordExtractor, LocalPaperKeywordsExtractor, load_keyword_config, keyword_backend
 # text preprocessing
-from nodes.preprocessors.ArxivPreprocessor import ArxivPreprocessor
+from nodes.preprocessors.ArxivChunkPreprocessor import ArxivPreprocessor
 # Vector storage
 from nodes.storage.ChunkChromaDB import ChunkChromaDB as ChromaDB
 
@@ -51,36 +58,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_pipeline(fetcher: ArxivFetcher, chunker: SectionChunker, keyword: ArxivKeywordsExtractor, references: ArxivReferencesExtractor, preprocessor: ArxivPreprocessor, writer: ChromaDB):
+def create_pipeline(fetcher: Optional[ArxivFetcher], chunker: SectionChunker, keyword: ArxivKeywordsExtractor, references: ArxivReferencesExtractor, preprocessor: ArxivPreprocessor, packer: TokenBudgetPacker, writer: ChromaDB):
     """
     Crea e compila la pipeline Langgraph.
+    Se fetcher è None il grafo parte dal chunking del markdown già presente nello stato
+    (usato dalla modalità batch, dove il crawling avviene con arun_many).
     """
     workflow = StateGraph(State)
-    workflow.add_node("arxiv_fetcher_node", fetcher)
+    if fetcher is not None:
+        workflow.add_node("arxiv_fetcher_node", fetcher)
     workflow.add_node("section_chunker_node", chunker)
     workflow.add_node("keyword_extraction_node", keyword)
     workflow.add_node("references_extraction_node", references)
     workflow.add_node("preprocessing_node", preprocessor)
+    workflow.add_node("packing_node", packer)
     workflow.add_node("writer_node", writer)
     
     
 
     # Definizione del flusso di lavoro (edges)
-    workflow.add_edge(START, "arxiv_fetcher_node")
-    workflow.add_edge("arxiv_fetcher_node", "section_chunker_node")
+    if fetcher is not None:
+        workflow.add_edge(START, "arxiv_fetcher_node")
+        workflow.add_edge("arxiv_fetcher_node", "section_chunker_node")
+    else:
+        workflow.add_edge(START, "section_chunker_node")
 
-    # try to parallelize keywords and references extraction
+    # Estrazione di keywords e references in parallelo (fan-out): sono due chiamate LLM
+    # indipendenti, la latenza per paper è quella della più lenta
     workflow.add_edge("section_chunker_node", "keyword_extraction_node")
-    workflow.add_edge("keyword_extraction_node", "references_extraction_node")
+    workflow.add_edge("section_chunker_node", "references_extraction_node")
 
+    # Join: il preprocessing parte solo quando entrambi i rami sono terminati
+    workflow.add_edge(["keyword_extraction_node", "references_extraction_node"], "preprocessing_node")
 
-    workflow.add_edge("references_extraction_node", "preprocessing_node")
-
-    workflow.add_edge("preprocessing_node", "writer_node")
+    # Il budget di token è calcolato sul testo già normalizzato, cioè quello che verrà embeddato
+    workflow.add_edge("preprocessing_node", "packing_node")
+    workflow.add_edge("packing_node", "writer_node")
     workflow.add_edge("writer_node", END)
 
     pipeline = workflow.compile()
 
+    if fetcher is None:
+        return pipeline
+
     try:
         graphImage = pipeline.get_graph().draw_mermaid_png()
         with open("images/gemini_api_llm_chunk_pipeline.png", "wb") as f:
@@ -92,17 +112,23 @@ def create_pipeline(fetcher: ArxivFetcher, chunker: SectionChunker, keyword: Arx
 
     return pipeline
 
-async def run_pipeline(url, geminiConfig, dbConfig, prompts):
+def create_keyword_extractor(geminiLLM, keyword_prompt: str, writer: ChromaDB) -> ArxivKeywordsExtractor:
     """
-    Esegue la pipeline Langgraph con la configurazione specificata.
+    Nodo di estrazione delle keywords secondo il backend 'papers' di config/keyword_extraction.yml:
+    Gemini, oppure il backend locale che riusa il modello di embedding del writer
+    (prior TF-IDF dalla collezione degli abstract).
     """
+    keyword_config = load_keyword_config()
+    if keyword_backend(keyword_config, "papers") == "local":
+        return LocalPaperKeywordsExtractor(LocalKeywordExtractor.from_config(keyword_config.get("local"), writer.embedding_function))
+    return ArxivKeywordsExtractor(llm=geminiLLM, keyword_prompt=keyword_prompt)
 
-    db_path = dbConfig['db_path']
-    collection_name = dbConfig['db_collection']
-    keyword_prompt = prompts['keyword_prompt']
-    reference_prompt = prompts['reference_prompt']
-
-    # Inizializza il modello LLM
+def _build_llm(geminiConfig):
+    """
+    Modello Gemini condiviso dai nodi: quota RPM/TPM e concorrenza del governatore di processo,
+    e cache delle risposte (config/llm_cache.yml), così i prompt già inviati non vengono ripagati
+    né consumano quota.
+    """
     geminiLLM = ChatGoogleGenerativeAI(
         model = geminiConfig["model_name"],
         google_api_key = geminiConfig["gemini_api_key"],
@@ -111,17 +137,46 @@ async def run_pipeline(url, geminiConfig, dbConfig, prompts):
         top_p = geminiConfig["top_p"],
         top_k = geminiConfig.get("top_k", None),
     )
+    LLM_GOVERNOR.configure_from(geminiConfig)
+    return CachedChatModel.from_yaml(GovernedChatModel(geminiLLM))
+
+def _build_nodes(dbConfig, prompts, geminiLLM, fetcher: ArxivFetcher) -> Dict[str, Any]:
+    """
+    Nodi del grafo a valle del fetcher, come argomenti di create_pipeline.
+    Chunker e preprocessing leggono le sezioni in streaming dalla cache delle pagine del fetcher
+    quando il markdown non è nello stato (ArxivFetcher keep_markdown=False).
+    """
+    embedding_model_name = dbConfig.get('embedding_model_name', DEFAULT_EMBEDDING_MODEL)
+    chunker = SectionChunker(page_cache=fetcher.page_cache)
+    writer = ChromaDB(dbConfig['db_path'], dbConfig['db_collection'], embedding_model_name, dbConfig.get('batch_size', 128))
+    return {
+        "chunker": chunker,
+        "keyword": create_keyword_extractor(geminiLLM, prompts['keyword_prompt'], writer),
+        "references": ArxivReferencesExtractor(llm=geminiLLM, reference_prompt=prompts['reference_prompt']),
+        "preprocessor": ArxivPreprocessor(section_source=chunker),
+        "packer": TokenBudgetPacker(model_name=embedding_model_name),
+        "writer": writer,
+    }
+
+def _log_llm_stats(geminiLLM) -> None:
+    if isinstance(geminiLLM, CachedChatModel):
+        logger.info(f"Cache LLM: {geminiLLM.stats()}")
+    logger.info(f"Traffico LLM: {LLM_GOVERNOR.stats()}")
+
+async def run_pipeline(url, geminiConfig, dbConfig, prompts):
+    """
+    Esegue la pipeline Langgraph con la configurazione specificata.
+    """
+
+    geminiLLM = _build_llm(geminiConfig)
 
     # Inizializzazione delle classi dei nodi
-    fetcher = ArxivFetcher()
-    chunker = SectionChunker()
-    keyword = ArxivKeywordsExtractor(llm=geminiLLM, keyword_prompt=keyword_prompt)
-    references = ArxivReferencesExtractor(llm=geminiLLM, reference_prompt=reference_prompt)
-    preprocessor = ArxivPreprocessor()
-    writer = ChromaDB(db_path,collection_name)
+    # Con la cache delle pagine il markdown non resta nello stato: il chunker e il preprocessing
+    # leggono le sezioni in streaming dalla cache, una alla volta
+    fetcher = ArxivFetcher(keep_markdown=False)
     
     # Crea la pipeline
-    graph = create_pipeline(fetcher, chunker, keyword, references, preprocessor, writer)
+    graph = create_pipeline(fetcher, **_build_nodes(dbConfig, prompts, geminiLLM, fetcher))
 
     ### Langfuse ### 
     # `config={"callbacks": [langfuse_handler]}`
@@ -141,3 +196,118 @@ async def run_pipeline(url, geminiConfig, dbConfig, prompts):
         logger.error(f"Errore durante l'invocazione della pipeline al checkpoint {url}: {e}")
         exit(1)
 
+    finally:
+        # Sblocca il markdown in cache e chiude i browser avviati dal fetcher
+        fetcher.release(url)
+        await fetcher.close()
+
+
+async def run_pipeline_urls(urls: List[str], geminiConfig, dbConfig, prompts, max_concurrency: int = 4, browser_pool_size: int = 1, max_pages_per_browser: int = 50):
+    """
+    Esegue la pipeline su una lista di URL con un unico set di nodi e un pool di browser
+    persistente: Chromium viene avviato una sola volta (al primo fetch), serve più pagine
+    in parallelo e viene chiuso al termine del batch.
+
+    Args:
+        urls (List[str]): URL dei paper da processare.
+        max_concurrency (int): numero massimo di paper processati contemporaneamente.
+        browser_pool_size (int): numero di browser nel pool.
+        max_pages_per_browser (int): pagine servite da un browser prima di essere riciclato.
+
+    Returns:
+        List: lo stato finale per ogni URL (o l'eccezione sollevata).
+    """
+
+    geminiLLM = _build_llm(geminiConfig)
+
+    browser_pool = BrowserPool.from_yaml(
+        size=browser_pool_size,
+        max_pages_per_browser=max_pages_per_browser,
+        max_concurrent_pages=max(1, max_concurrency // browser_pool_size)
+    )
+
+    # Inizializzazione delle classi dei nodi, condivise da tutti gli URL
+    fetcher = ArxivFetcher(browser_pool=browser_pool, keep_markdown=False)
+    graph = create_pipeline(fetcher, **_build_nodes(dbConfig, prompts, geminiLLM, fetcher))
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def process(url: str):
+        async with semaphore:
+            try:
+                state = await graph.ainvoke({"url": url}, config={"callbacks": [langfuse_handler]})
+            finally:
+                # Il markdown in cache non serve più al grafo: torna soggetto a TTL ed eviction
+                fetcher.release(url)
+            if state.get('error_status'):
+                logger.warning(f"Errore nello stato per url = {url} : {state['error_status']}")
+            return state
+
+    try:
+        results = await asyncio.gather(*(process(url) for url in urls), return_exceptions=True)
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Errore durante l'invocazione della pipeline per url = {url}: {result}")
+        return results
+
+    finally:
+        await fetcher.close()
+        await browser_pool.close()
+        _log_llm_stats(geminiLLM)
+
+
+async def run_pipeline_stream(urls: List[str], geminiConfig, dbConfig, prompts):
+    """
+    Modalità batch: scarica tutti gli URL con arun_many (concorrenza e soglia di memoria da
+    config/crawl_config/crawler.yml) e avvia chunking, estrazioni LLM e scrittura di ogni paper
+    appena il suo markdown arriva, senza attendere il resto del batch.
+
+    Returns:
+        Dict[str, Any]: per ogni URL lo stato finale, o il messaggio/eccezione di errore.
+    """
+
+    geminiLLM = _build_llm(geminiConfig)
+
+    browser_pool = BrowserPool.from_yaml()
+    fetcher = ArxivFetcher(browser_pool=browser_pool, keep_markdown=False)
+
+    # Grafo senza fetcher: parte dal markdown già scaricato
+    graph = create_pipeline(None, **_build_nodes(dbConfig, prompts, geminiLLM, fetcher))
+
+    # I paper in elaborazione a valle del crawler sono limitati da semaphore_count
+    semaphore = asyncio.Semaphore(fetcher.batch_settings["semaphore_count"])
+    results = {}
+
+    async def process(url: str, markdown: Optional[str]):
+        async with semaphore:
+            try:
+                state = await graph.ainvoke({"url": url, "markdown": markdown}, config={"callbacks": [langfuse_handler]})
+                if state.get('error_status'):
+                    logger.warning(f"Errore nello stato per url = {url} : {state['error_status']}")
+                results[url] = state
+            except Exception as e:
+                logger.error(f"Errore durante l'invocazione della pipeline per url = {url}: {e}")
+                logger.debug(traceback.format_exc())
+                results[url] = e
+            finally:
+                # Il markdown in cache non serve più al grafo: torna soggetto a TTL ed eviction
+                fetcher.release(url)
+
+    tasks = []
+    try:
+        async for url, markdown, error in fetcher.fetch_many(urls):
+            if error:
+                logger.warning(f"Crawling fallito per url = {url}: {error}")
+                results[url] = error
+                continue
+            # markdown None: è in cache e il chunker lo legge in streaming
+            logger.info(f"Markdown ricevuto per url = {url}, avvio chunking")
+            tasks.append(asyncio.create_task(process(url, markdown)))
+
+        await asyncio.gather(*tasks)
+        return results
+
+    finally:
+        await fetcher.close()
+        await browser_pool.close()
+        _log_llm_stats(geminiLLM)
@@ -2,12 +2,29 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Annotated, Set
 import  operator
 
+
+def merge_error_status(left: Optional[List[str]], right: Optional[List[str]]) -> List[str]:
+    """
+    Reducer di error_status: i nodi possono restituire solo i nuovi errori oppure l'intera lista
+    (quando restituiscono lo stato completo). Nel secondo caso la lista ricevuta estende già
+    quella corrente e la sostituisce; altrimenti i nuovi errori vengono accodati senza duplicati.
+    Permette a rami paralleli del grafo di segnalare errori nello stesso passo.
+    """
+    left, right = left or [], right or []
+    if right[:len(left)] == left:
+        return list(right)
+    return left + [error for error in right if error not in left]
+
+
 class State(BaseModel):
     url: Optional[str] = Field(default=None, description="Testo di input")
     markdown: Optional[str] = Field(default=None, description="Markdown dell' url")
 
     chunks: Optional[Dict[str,str]] = Field(default={}, description="Dizionario dove ogni k:v rappresenta una sezione del paper")
     init_keys: Optional[List[str]] = Field(default=[], description="Chunks per ogni articolo estratto da query_string api call")
+    section_levels: Optional[Dict[str,int]] = Field(default={}, description="Livello del titolo di ogni sezione (2 = '## ', 3 = '### ', 4 = '#### ')")
+    streamed_sections: bool = Field(default=False, description="Sezioni lette in streaming dalla cache delle pagine: 'chunks' contiene solo quelle usate dagli estrattori fino al preprocessing")
+    chunk_sections: Optional[Dict[str,List[str]]] = Field(default={}, description="Sezioni contenute in ogni chunk dopo l'impacchettamento a budget di token")
    
     references_key: Optional[str] = Field(default=None, description="Chiave della sezione 'References' se presente")
     abstract_key: Optional[str] = Field(default=None, description="Chiave della sezione 'Abstract' se presente")
@@ -18,5 +35,5 @@ class State(BaseModel):
     keywords: Annotated[List[str], operator.add] = Field(default=[], description="Keywords estratte dal paper")
     references: Annotated[List[str], operator.add] = Field(default=[], description="References estratte dal paper")
 
-    error_status: Optional[List[str]] = Field(default=[], description="Errori riscontrati (if any)")
+    error_status: Annotated[Optional[List[str]], merge_error_status] = Field(default=[], description="Errori riscontrati (if any)")
     
@@ -18,7 +18,9 @@ class ArticleMetadata(BaseModel):
 
 class State(BaseModel):
     query_string: Optional[str] = Field(default=None, description="Testo di input")
+    id_list: Optional[List[str]] = Field(default=[], description="ID o URL arXiv di cui recuperare direttamente i metadati")
     articles: Optional[List[ArticleMetadata]] = Field(default=[], description="Lista di articoli arxiv da query string api call")
+    watermark: Optional[Dict[str, str]] = Field(default=None, description="Timestamp 'published'/'updated' più recenti tra gli articoli scaricati")
     error_status: Optional[List[str]] = Field(default=[], description="Errori riscontrati (if any)")
 
     
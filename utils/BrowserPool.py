@@ -0,0 +1,133 @@
+import asyncio
+import yaml
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from crawl4ai import AsyncWebCrawler, BrowserConfig
+
+
+class _PooledBrowser:
+    """
+    Un'istanza AsyncWebCrawler avviata (un processo Chromium) con i contatori di utilizzo.
+    """
+    def __init__(self, crawler: AsyncWebCrawler):
+        self.crawler = crawler
+        self.pages_served = 0
+        self.in_flight = 0
+        self.retiring = False
+
+
+class BrowserPool:
+    '''
+    Pool di browser crawl4ai a lunga vita, avviati in modo lazy al primo utilizzo.
+    Evita di lanciare e chiudere Chromium per ogni URL: ogni browser serve più chiamate
+    arun concorrenti (ognuna apre la propria pagina nel contesto del browser) e viene
+    riciclato dopo max_pages_per_browser pagine per limitare la memoria accumulata.
+
+    Uso:
+        pool = BrowserPool(size=2)
+        async with pool.acquire() as crawler:
+            result = await crawler.arun(url, config=config)
+        await pool.close()
+    '''
+    def __init__(self, browser_config: Optional[BrowserConfig] = None, size: int = 1, max_pages_per_browser: int = 50, max_concurrent_pages: int = 4):
+        """
+        :param browser_config: configurazione crawl4ai dei browser (None = default).
+        :param size: numero massimo di browser attivi contemporaneamente.
+        :param max_pages_per_browser: pagine servite da un browser prima di essere riciclato.
+        :param max_concurrent_pages: chiamate arun concorrenti per browser.
+        """
+        self.browser_config = browser_config
+        self.size = size
+        self.max_pages_per_browser = max_pages_per_browser
+        self.max_concurrent_pages = max_concurrent_pages
+
+        self._browsers: List[_PooledBrowser] = []
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(size * max_concurrent_pages)
+        self._closed = False
+
+    @classmethod
+    def from_yaml(cls, path: str = "config/crawl_config/browser.yml", **kwargs) -> "BrowserPool":
+        """
+        Crea il pool leggendo la configurazione del browser dal file YAML (i valori null sono ignorati).
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            params = {k: v for k, v in (yaml.safe_load(f) or {}).items() if v is not None}
+        return cls(browser_config=BrowserConfig(**params), **kwargs)
+
+    async def _launch(self) -> _PooledBrowser:
+        crawler = AsyncWebCrawler(config=self.browser_config) if self.browser_config else AsyncWebCrawler()
+        await crawler.start()
+        browser = _PooledBrowser(crawler)
+        self._browsers.append(browser)
+        active = sum(1 for b in self._browsers if not b.retiring)
+        print(f"✅ [BrowserPool] avviato browser ({active}/{self.size} attivi)")
+        return browser
+
+    async def _checkout(self, pages: int = 1) -> _PooledBrowser:
+        async with self._lock:
+            if self._closed:
+                raise RuntimeError("BrowserPool già chiuso")
+
+            active = [b for b in self._browsers if not b.retiring]
+            idle = [b for b in active if b.in_flight == 0]
+
+            # Avvia un nuovo browser solo se non ce ne sono di liberi e c'è ancora posto
+            # (i browser in dismissione stanno solo completando le pagine in corso)
+            if not idle and len(active) < self.size:
+                browser = await self._launch()
+            else:
+                browser = min(active, key=lambda b: b.in_flight)
+
+            browser.in_flight += 1
+            browser.pages_served += pages
+            if browser.pages_served >= self.max_pages_per_browser:
+                # Non accetta altre pagine; sarà chiuso quando l'ultima in corso termina
+                browser.retiring = True
+            return browser
+
+    async def _checkin(self, browser: _PooledBrowser) -> None:
+        to_close = None
+        async with self._lock:
+            browser.in_flight -= 1
+            if browser.retiring and browser.in_flight == 0 and browser in self._browsers:
+                self._browsers.remove(browser)
+                to_close = browser
+        if to_close is not None:
+            await to_close.crawler.close()
+            print(f"♻️ [BrowserPool] browser riciclato dopo {to_close.pages_served} pagine")
+
+    @asynccontextmanager
+    async def acquire(self, pages: int = 1) -> AsyncIterator[AsyncWebCrawler]:
+        """
+        Restituisce un crawler avviato per la durata del blocco 'async with'.
+
+        :param pages: pagine che il chiamante aprirà con il crawler (es. gli URL di un arun_many),
+                      contate per il riciclo dopo max_pages_per_browser.
+        """
+        async with self._semaphore:
+            browser = await self._checkout(pages)
+            try:
+                yield browser.crawler
+            finally:
+                await self._checkin(browser)
+
+    async def close(self) -> None:
+        """
+        Chiude tutti i browser del pool (da chiamare al termine del batch).
+        """
+        async with self._lock:
+            self._closed = True
+            browsers, self._browsers = self._browsers, []
+        for browser in browsers:
+            try:
+                await browser.crawler.close()
+            except Exception as e:
+                print(f"⚠️ [BrowserPool] errore durante la chiusura del browser: {e}")
+
+    async def __aenter__(self) -> "BrowserPool":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
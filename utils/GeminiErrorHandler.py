@@ -1,42 +1,141 @@
 import traceback
+import asyncio
+import random
 import time
-import requests
+from typing import Optional
+
+# Errori transitori lato server per cui ha senso riprovare, oltre al rate limit (429)
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+
+
+class RetryPolicy:
+    '''
+    Politica di retry per le chiamate LLM, condivisa dai nodi sincroni e asincroni.
+    - 429 con retry_delay indicato dal server: si attende quel tempo più un piccolo jitter,
+      così le richieste parallele rifiutate insieme non ripartono nello stesso istante;
+    - 429 senza retry_delay ed errori transitori 5xx: backoff esponenziale con full jitter
+      (attesa casuale tra 0 e min(max_delay, base_delay * 2^tentativo));
+    - altri errori: nessun retry.
+    '''
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0, server_delay_jitter: float = 0.1):
+        """
+        :param max_retries: retry massimi dopo il primo tentativo.
+        :param base_delay: attesa base in secondi del backoff esponenziale.
+        :param max_delay: attesa massima in secondi per un singolo retry.
+        :param server_delay_jitter: jitter relativo aggiunto al retry_delay del server (0.1 = fino a +10%).
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.server_delay_jitter = server_delay_jitter
+
+    @staticmethod
+    def status_code(e: BaseException) -> Optional[int]:
+        """
+        Codice HTTP dell'errore, cercato anche nelle eccezioni concatenate
+        (langchain_google_genai rilancia gli errori dell'SDK Google con 'raise ... from').
+        """
+        while e is not None:
+            code = getattr(e, "code", None)
+            if isinstance(code, int):
+                return code
+            e = e.__cause__ or e.__context__
+        return None
+
+    @staticmethod
+    def server_retry_delay(e: BaseException) -> Optional[float]:
+        """
+        Estrae il retry delay da un'eccezione ResourceExhausted di Gemini (RetryInfo nei details).
+        """
+        while e is not None:
+            try:
+                for detail in getattr(e, "details", None) or []:
+                    retry_delay = getattr(detail, "retry_delay", None)
+                    if retry_delay is not None:
+                        return float(retry_delay.seconds) + retry_delay.nanos / 1e9
+            except Exception as ex:
+                print(f"[RetryPolicy] Errore nella lettura del retry_delay: {ex}")
+            e = e.__cause__ or e.__context__
+        return None
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Backoff esponenziale con full jitter per il tentativo attempt (0 = primo retry).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def retry_delay(self, e: BaseException, attempt: int) -> Optional[float]:
+        """
+        Secondi da attendere prima del tentativo attempt + 1, o None se l'errore non va ritentato.
+        """
+        code = self.status_code(e)
+        if code != 429 and code not in TRANSIENT_STATUS_CODES:
+            return None
+        delay = self.server_retry_delay(e) if code == 429 else None
+        if delay:
+            return delay * (1 + random.uniform(0, self.server_delay_jitter))
+        return self.backoff(attempt)
+
+
+# Politica unica di default: tutti gli handler che non ne ricevono una la condividono
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
 
 class GeminiErrorHandler:
 
-    def __init__(self):
-        pass
+    def __init__(self, llm=None, policy: Optional[RetryPolicy] = None):
+        """
+        :param llm: modello di default per le chiamate (può essere passato anche a ogni chiamata).
+        :param policy: politica di retry (None = DEFAULT_RETRY_POLICY, condivisa).
+        """
+        self.llm = llm
+        self.policy = policy or DEFAULT_RETRY_POLICY
 
     def extract_retry_delay_from_error(self, e) -> float | None:
         """
         Estrae il retry delay da un'eccezione ResourceExhausted di Gemini.
         """
-        try:
-            if hasattr(e, 'code') and e.code == 429 and hasattr(e, 'details'):
-                retry_info = e.details[2].retry_delay
-                return float(retry_info.seconds)
-        except Exception as ex:
-            print(f"[extract_retry_delay_from_error] Errore: {ex}")
-        return None
+        return self.policy.server_retry_delay(e)
 
-    def gemini_invoke_with_retry(self, llm, prompt, max_retries=5, retry_count=0):
-        """
-        Retry per Gemini con gestione del codice 429 e retry_delay.
-        """
-        try:
-            return llm.invoke(prompt)
-        
-        except Exception as e:
-            if hasattr(e, "code") and e.code == 429:
-                delay = self.extract_retry_delay_from_error(e)
-                if delay:
-                    print(f"[gemini_invoke_with_retry] Rate limit: attendo {delay:.2f}s (retry #{retry_count + 1})")
-                    time.sleep(delay)
-                    if retry_count < max_retries:
-                        return self.gemini_invoke_with_retry(llm, prompt, max_retries, retry_count + 1)
-                    raise RuntimeError("Max retries exceeded (Gemini).")
-                else:
-                    raise RuntimeError("Retry delay non disponibile in errore 429 (Gemini).")
-            else:
-                traceback.print_exc()
-                raise RuntimeError(f"Errore Gemini: {e}")
+    def _on_error(self, e: Exception, attempt: int, max_retries: int) -> float:
+        """
+        Attesa prima del prossimo tentativo; solleva RuntimeError se l'errore non va ritentato
+        o se i retry sono esauriti.
+        """
+        delay = self.policy.retry_delay(e, attempt)
+        if delay is None:
+            traceback.print_exc()
+            raise RuntimeError(f"Errore Gemini: {e}") from e
+        if attempt >= max_retries:
+            raise RuntimeError("Max retries exceeded (Gemini).") from e
+        print(f"[gemini_invoke_with_retry] Errore {self.policy.status_code(e)}: attendo {delay:.2f}s (retry #{attempt + 1})")
+        return delay
+
+    def gemini_invoke_with_retry(self, llm=None, prompt=None, max_retries: Optional[int] = None):
+        """
+        Retry per Gemini con gestione del codice 429 e retry_delay (bloccante, per i nodi sincroni).
+        """
+        llm = llm if llm is not None else self.llm
+        max_retries = self.policy.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                return llm.invoke(prompt)
+            except Exception as e:
+                time.sleep(self._on_error(e, attempt, max_retries))
+                attempt += 1
+
+    async def agemini_invoke_with_retry(self, llm=None, prompt=None, max_retries: Optional[int] = None):
+        """
+        Variante asincrona: ainvoke e asyncio.sleep, l'attesa non blocca l'event loop
+        né gli altri paper in elaborazione.
+        """
+        llm = llm if llm is not None else self.llm
+        max_retries = self.policy.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            try:
+                return await llm.ainvoke(prompt)
+            except Exception as e:
+                await asyncio.sleep(self._on_error(e, attempt, max_retries))
+                attempt += 1
@@ -0,0 +1,321 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional
+
+from utils.GeminiErrorHandler import RetryPolicy
+
+# Stima grossolana dei token del prompt (Gemini non espone un tokenizer locale): ~4 caratteri per token
+CHARS_PER_TOKEN = 4
+
+
+class TokenBucket:
+    '''
+    Token bucket a prenotazione: ogni richiesta scala subito i token (il saldo può andare
+    in negativo) e riceve i secondi da attendere prima che il saldo torni >= 0.
+    Come in PolitenessScheduler, chiamanti sincroni e asincroni attendono senza busy waiting.
+    '''
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        """
+        :param capacity: token disponibili per finestra (es. richieste o token al minuto).
+        :param per_seconds: durata della finestra in secondi.
+        """
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Scala amount token (al massimo la capacità) e restituisce i secondi di attesa.
+        Da chiamare sotto il lock del chiamante.
+        """
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float, now: float) -> None:
+        """
+        Corregge il saldo senza attese (es. token effettivi noti solo a risposta ricevuta).
+        """
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class LLMGovernor:
+    '''
+    Governatore del traffico LLM di tutto il processo:
+    - token bucket per richieste al minuto (RPM) e token al minuto (TPM, stimati dal prompt
+      e corretti con l'usage_metadata della risposta);
+    - limite di concorrenza adattivo AIMD: +1/limite a ogni successo (circa +1 per "giro" di
+      richieste), limite dimezzato a ogni 429 (una volta per raffica: le richieste partite
+      prima dell'ultima riduzione non lo riducono di nuovo);
+    - contatori live (stats()).
+    Gli slot liberi sono passati direttamente al primo in coda, thread o coroutine che sia.
+    '''
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, max_concurrency: int = 16, initial_concurrency: int = 4, min_concurrency: int = 1, decrease_factor: float = 0.5):
+        """
+        :param rpm: richieste al minuto (None = nessun limite).
+        :param tpm: token al minuto, input + output (None = nessun limite).
+        :param max_concurrency: richieste contemporanee massime.
+        :param initial_concurrency: limite di concorrenza iniziale.
+        :param min_concurrency: limite di concorrenza minimo dopo le riduzioni.
+        :param decrease_factor: fattore moltiplicativo del limite a ogni 429.
+        """
+        self._lock = threading.Lock()
+        self._waiters: Deque[Any] = deque()
+        self.in_flight = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttled = 0
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+        self.wait_seconds = 0.0
+        self._last_decrease = 0.0
+        self.configure(rpm, tpm, max_concurrency, initial_concurrency, min_concurrency, decrease_factor)
+
+    def configure(self, rpm: Optional[float] = None, tpm: Optional[float] = None, max_concurrency: int = 16, initial_concurrency: int = 4, min_concurrency: int = 1, decrease_factor: float = 0.5) -> None:
+        """
+        (Ri)configura i limiti, es. dai valori del file di config del modello.
+        """
+        with self._lock:
+            self._rpm = TokenBucket(rpm) if rpm else None
+            self._tpm = TokenBucket(tpm) if tpm else None
+            self.max_concurrency = max_concurrency
+            self.min_concurrency = min_concurrency
+            self.decrease_factor = decrease_factor
+            self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+            self._wake()
+
+    def configure_from(self, config: Dict[str, Any]) -> None:
+        """
+        Configura i limiti dal file di config del modello (rpm_limit, tpm_limit, max_concurrency).
+        """
+        self.configure(
+            rpm=config.get("rpm_limit"),
+            tpm=config.get("tpm_limit"),
+            max_concurrency=config.get("max_concurrency", 16),
+            initial_concurrency=config.get("initial_concurrency", 4)
+        )
+
+    @staticmethod
+    def estimate_tokens(prompt: Any) -> int:
+        if isinstance(prompt, (list, tuple)):
+            text = "".join(str(getattr(message, "content", message)) for message in prompt)
+        else:
+            text = str(prompt)
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    # --- slot di concorrenza ---
+
+    def _wake(self) -> None:
+        """
+        Passa gli slot liberi ai primi in coda. Da chiamare sotto lock.
+        """
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            self.in_flight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(self._grant, future)
+
+    def _grant(self, future: asyncio.Future) -> None:
+        # Eseguito nel loop del chiamante: se intanto è stato cancellato, lo slot torna libero
+        if future.cancelled():
+            self._release_slot()
+        else:
+            future.set_result(None)
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _reserve_rate(self, tokens: int) -> float:
+        """
+        Prenota una richiesta e i suoi token stimati; restituisce i secondi di attesa.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests += 1
+            self.estimated_tokens += tokens
+            delay = 0.0
+            if self._rpm is not None:
+                delay = max(delay, self._rpm.reserve(1, now))
+            if self._tpm is not None:
+                delay = max(delay, self._tpm.reserve(tokens, now))
+            self.wait_seconds += delay
+            return delay
+
+    def acquire(self, prompt: Any = "") -> float:
+        """
+        Attesa bloccante di uno slot e della quota RPM/TPM (thread e codice sincrono).
+        :return: istante di inizio della richiesta, da passare a release().
+        """
+        event = None
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+            else:
+                event = threading.Event()
+                self._waiters.append(event)
+        if event is not None:
+            event.wait()
+        delay = self._reserve_rate(self.estimate_tokens(prompt))
+        if delay > 0:
+            time.sleep(delay)
+        return time.monotonic()
+
+    async def aacquire(self, prompt: Any = "") -> float:
+        """
+        Variante asincrona di acquire(): attende senza bloccare l'event loop.
+        """
+        future = None
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+            else:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+        if future is not None:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if (loop, future) in self._waiters:
+                        self._waiters.remove((loop, future))
+                        granted = False
+                    else:
+                        # Slot già assegnato: se _grant non è ancora stato eseguito lo rilascia lui
+                        granted = future.done() and not future.cancelled()
+                if granted:
+                    self._release_slot()
+                raise
+        delay = self._reserve_rate(self.estimate_tokens(prompt))
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self._release_slot()
+                raise
+        return time.monotonic()
+
+    def release(self, started: float, error: Optional[BaseException] = None, response: Any = None, prompt: Any = "") -> None:
+        """
+        Libera lo slot e aggiorna limite AIMD, contatori e saldo TPM.
+
+        :param started: valore restituito da acquire()/aacquire().
+        :param error: eccezione della chiamata, se fallita (429 riduce la concorrenza).
+        :param response: risposta del modello, per i token effettivi (usage_metadata).
+        :param prompt: prompt della chiamata, per correggere la stima dei token.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if error is None:
+                self.successes += 1
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+                usage = getattr(response, "usage_metadata", None) or {}
+                total = usage.get("total_tokens") if isinstance(usage, dict) else None
+                if total:
+                    self.actual_tokens += total
+                    if self._tpm is not None:
+                        self._tpm.adjust(total - self.estimate_tokens(prompt), now)
+            elif RetryPolicy.status_code(error) == 429:
+                self.throttled += 1
+                # Una sola riduzione per raffica di 429
+                if started > self._last_decrease:
+                    self.limit = max(float(self.min_concurrency), self.limit * self.decrease_factor)
+                    self._last_decrease = now
+            else:
+                self.failures += 1
+            self._wake()
+
+    @contextmanager
+    def slot(self, prompt: Any = ""):
+        """
+        with governor.slot(prompt): ... — per chiamate LLM sincrone non LangChain (es. crawl4ai).
+        """
+        started = self.acquire(prompt)
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, error=e, prompt=prompt)
+            raise
+        self.release(started, prompt=prompt)
+
+    @asynccontextmanager
+    async def aslot(self, prompt: Any = ""):
+        started = await self.aacquire(prompt)
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, error=e, prompt=prompt)
+            raise
+        self.release(started, prompt=prompt)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Contatori live: concorrenza, richieste, esiti, token e attese per la quota.
+        """
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "concurrency_limit": round(self.limit, 2),
+                "requests": self.requests,
+                "successes": self.successes,
+                "throttled": self.throttled,
+                "failures": self.failures,
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+                "rate_wait_seconds": round(self.wait_seconds, 2),
+            }
+
+
+class GovernedChatModel:
+    '''
+    Wrapper drop-in di un chat model LangChain: ogni invoke/ainvoke passa dal governatore
+    (slot di concorrenza, quota RPM/TPM, esito per l'AIMD). Gli altri attributi sono delegati.
+    Va messo sotto CachedChatModel, così le risposte in cache non consumano quota.
+    '''
+    def __init__(self, llm, governor: Optional[LLMGovernor] = None):
+        self.llm = llm
+        self.governor = governor or LLM_GOVERNOR
+
+    def invoke(self, prompt, config=None, **kwargs):
+        started = self.governor.acquire(prompt)
+        try:
+            response = self.llm.invoke(prompt, config=config, **kwargs)
+        except BaseException as e:
+            self.governor.release(started, error=e, prompt=prompt)
+            raise
+        self.governor.release(started, response=response, prompt=prompt)
+        return response
+
+    async def ainvoke(self, prompt, config=None, **kwargs):
+        started = await self.governor.aacquire(prompt)
+        try:
+            response = await self.llm.ainvoke(prompt, config=config, **kwargs)
+        except BaseException as e:
+            self.governor.release(started, error=e, prompt=prompt)
+            raise
+        self.governor.release(started, response=response, prompt=prompt)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+# Governatore unico del processo per il traffico verso Gemini (limiti da config del modello)
+LLM_GOVERNOR = LLMGovernor()
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import yaml
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+# finish_reason di una risposta completa (Gemini 'STOP', OpenAI 'stop', Anthropic 'end_turn'/'stop_sequence'):
+# le risposte troncate (MAX_TOKENS) o bloccate (SAFETY, RECITATION, ...) non vengono messe in cache
+COMPLETE_FINISH_REASONS = frozenset({"STOP", "END_TURN", "STOP_SEQUENCE"})
+
+
+class LLMResponseCache:
+    '''
+    Cache persistente su SQLite delle risposte LLM.
+    La chiave è lo sha256 di modello, parametri di generazione e prompt: lo stesso prompt con
+    temperatura o modello diversi è una voce diversa. Le risposte sono salvate come messaggi
+    LangChain serializzati (contenuto, response_metadata, usage_metadata).
+    TTL per voce ed eviction LRU oltre max_bytes, come PageCache; contatori di hit/miss in memoria.
+    '''
+    def __init__(self, path: str = "data/llm_cache.sqlite", ttl_seconds: Optional[float] = 30 * 24 * 3600, max_bytes: Optional[int] = 256 * 1024 ** 2, read_only: bool = False):
+        """
+        :param path: file SQLite della cache.
+        :param ttl_seconds: validità di una risposta in secondi (None = nessuna scadenza).
+        :param max_bytes: dimensione massima delle risposte salvate oltre la quale si eliminano le meno usate.
+        :param read_only: se True la cache viene solo letta (nessuna scrittura, scadenza o eviction).
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, created REAL, accessed REAL, size INTEGER)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    @classmethod
+    def from_yaml(cls, path: str = "config/llm_cache.yml") -> Optional["LLMResponseCache"]:
+        """
+        Crea la cache dal file di configurazione; restituisce None se disabilitata o assente.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            return None
+        if not config.pop("enabled", True):
+            return None
+        return cls(**config)
+
+    @staticmethod
+    def key_for(model_params: Dict[str, Any], prompt: Any) -> str:
+        """
+        Hash di parametri del modello e prompt (stringa o lista di messaggi).
+        """
+        if isinstance(prompt, (list, tuple)):
+            prompt = [
+                (message.type, message.content) if isinstance(message, BaseMessage) else message
+                for message in prompt
+            ]
+        payload = json.dumps({"model": model_params, "prompt": prompt}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[BaseMessage]:
+        """
+        Risposta in cache per la chiave, o None se assente/scaduta (aggiorna i contatori).
+        """
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and not self.read_only and self.ttl_seconds is not None and time.time() - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+        return messages_from_dict(json.loads(row[0]))[0]
+
+    def put(self, key: str, model: str, response: BaseMessage) -> None:
+        """
+        Salva la risposta per la chiave, poi applica l'eviction per dimensione.
+        """
+        if self.read_only:
+            return
+        serialized = json.dumps(messages_to_dict([response]), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, accessed, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, serialized, now, now, len(serialized))
+            )
+            self.writes += 1
+            self._evict()
+            self._db.commit()
+
+    def invalidate(self, key: str) -> bool:
+        """
+        Elimina la risposta della chiave (es. quando il chiamante non riesce a interpretarla),
+        così la prossima chiamata interroga di nuovo il modello. True se la voce esisteva.
+        """
+        if self.read_only:
+            return False
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount
+            self._db.commit()
+        return deleted > 0
+
+    def _evict(self) -> None:
+        """
+        Elimina le risposte meno recentemente usate finché la cache non rientra in max_bytes.
+        """
+        if self.max_bytes is None:
+            return
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Contatori della cache dall'avvio del processo, più numero di voci e byte su disco.
+        """
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CachedChatModel:
+    '''
+    Wrapper drop-in di un chat model LangChain: invoke/ainvoke consultano la LLMResponseCache
+    prima di chiamare il modello e salvano le risposte nuove. Gli errori e le risposte incomplete
+    (finish_reason diverso da STOP) non vengono messi in cache; i nodi che non riescono a
+    interpretare una risposta la eliminano con invalidate (vedi invalidate_cached_response).
+    Tutti gli altri attributi e metodi sono delegati al modello originale.
+    '''
+    def __init__(self, llm, cache: LLMResponseCache):
+        """
+        :param llm: chat model LangChain (es. ChatGoogleGenerativeAI).
+        :param cache: cache delle risposte, condivisibile tra più modelli.
+        """
+        self.llm = llm
+        self.cache = cache
+        self.model_params = self._model_params(llm)
+        self.model_name = str(self.model_params.get("model") or self.model_params.get("model_name") or self.model_params["_type"])
+        self.not_cached = 0
+
+    @classmethod
+    def from_yaml(cls, llm, path: str = "config/llm_cache.yml"):
+        """
+        Avvolge il modello con la cache configurata; se la cache è disabilitata restituisce il modello invariato.
+        """
+        cache = LLMResponseCache.from_yaml(path)
+        return cls(llm, cache) if cache is not None else llm
+
+    @staticmethod
+    def _model_params(llm) -> Dict[str, Any]:
+        """
+        Nome del modello e parametri di generazione (temperature, top_p, top_k, max_output_tokens, ...).
+        """
+        try:
+            params = dict(llm._identifying_params)
+        except Exception:
+            params = {}
+        for name in ("model", "model_name", "temperature", "top_p", "top_k", "max_output_tokens", "max_tokens"):
+            if name not in params and getattr(llm, name, None) is not None:
+                params[name] = getattr(llm, name)
+        # Tipo del modello sottostante, non dei wrapper (GovernedChatModel, ...): la chiave
+        # non deve cambiare se cambia la pila di wrapper
+        params["_type"] = type(CachedChatModel._base_model(llm)).__name__
+        return params
+
+    @staticmethod
+    def _base_model(llm):
+        """
+        Il chat model in fondo alla pila di wrapper, che tengono il modello avvolto in 'llm'.
+        vars() guarda solo gli attributi propri, senza la delega di __getattr__.
+        """
+        try:
+            while vars(llm).get("llm") is not None:
+                llm = vars(llm)["llm"]
+        except TypeError:
+            pass
+        return llm
+
+    @staticmethod
+    def is_complete(response) -> bool:
+        """
+        True se la risposta è terminata normalmente; senza finish_reason (modelli che non lo
+        riportano) la risposta è considerata completa.
+        """
+        metadata = getattr(response, "response_metadata", None) or {}
+        reason = metadata.get("finish_reason")
+        if reason is None:
+            return True
+        # Può essere un enum (es. FinishReason.STOP): si confronta il nome
+        return str(getattr(reason, "name", reason)).split(".")[-1].upper() in COMPLETE_FINISH_REASONS
+
+    def _key(self, prompt, kwargs: Dict[str, Any]) -> str:
+        # Parametri passati alla singola chiamata (es. stop) fanno parte della chiave
+        params = dict(self.model_params, **kwargs) if kwargs else self.model_params
+        return self.cache.key_for(params, prompt)
+
+    def _store(self, key: str, response) -> None:
+        if self.is_complete(response):
+            self.cache.put(key, self.model_name, response)
+        else:
+            self.not_cached += 1
+
+    def invoke(self, prompt, config=None, **kwargs):
+        key = self._key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = self.llm.invoke(prompt, config=config, **kwargs)
+        self._store(key, response)
+        return response
+
+    async def ainvoke(self, prompt, config=None, **kwargs):
+        key = self._key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = await self.llm.ainvoke(prompt, config=config, **kwargs)
+        self._store(key, response)
+        return response
+
+    def invalidate(self, prompt, **kwargs) -> bool:
+        """
+        Elimina dalla cache la risposta al prompt (stessi kwargs della chiamata).
+        """
+        return self.cache.invalidate(self._key(prompt, kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.cache.stats(), not_cached=self.not_cached)
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+
+def invalidate_cached_response(llm, prompt, **kwargs) -> bool:
+    """
+    Da chiamare quando una risposta non è interpretabile (JSON non valido, formato inatteso):
+    se il modello ha una cache la risposta viene eliminata, così un nuovo run riprova
+    invece di rileggere la stessa risposta. Con un modello senza cache non fa nulla.
+    """
+    if isinstance(llm, CachedChatModel):
+        return llm.invalidate(prompt, **kwargs)
+    return False
@@ -0,0 +1,224 @@
+import os
+import re
+import gzip
+import time
+import yaml
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from typing import BinaryIO, Optional
+from urllib.parse import urlparse, urlunparse
+
+from utils.arxiv_ids import canonicalize_arxiv_id
+
+# Tipo di pagina arXiv nell'URL (abs/pdf/html): pagine diverse dello stesso paper non condividono la voce
+_ARXIV_PAGE_RE = re.compile(r"arxiv\.org/(abs|pdf|html)/", re.IGNORECASE)
+
+
+class PageCache:
+    '''
+    Cache locale su disco delle pagine scaricate: HTML grezzo e markdown prodotto, compressi gzip.
+    La chiave è lo sha256 dell'URL canonico; per i paper arXiv è tipo di pagina + ID con la versione
+    (abs, pdf e html hanno contenuti diversi e voci distinte; una nuova versione è una voce nuova).
+    Un indice SQLite tiene dimensioni e ultimo accesso per TTL ed eviction LRU per dimensione.
+    In modalità read_only (replay offline) la cache non scrive né scade mai.
+    Le voci bloccate con pin_markdown (markdown che il grafo rilegge in streaming) sono escluse da
+    scadenza ed eviction fino a unpin; il blocco vale solo per il processo corrente.
+    '''
+    def __init__(self, cache_dir: str = "data/page_cache", ttl_seconds: Optional[float] = 7 * 24 * 3600, max_bytes: Optional[int] = 1024 ** 3, read_only: bool = False):
+        """
+        :param cache_dir: directory della cache.
+        :param ttl_seconds: validità di una voce in secondi (None = nessuna scadenza).
+        :param max_bytes: dimensione massima su disco oltre la quale si eliminano le voci meno usate.
+        :param read_only: se True la cache viene solo letta (nessuna scrittura, scadenza o eviction).
+        """
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Voci bloccate dai paper in elaborazione: chiave -> numero di pin
+        self._pins: Counter = Counter()
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, url TEXT, created REAL, accessed REAL, size INTEGER)"
+        )
+        self._db.commit()
+
+    @classmethod
+    def from_yaml(cls, path: str = "config/crawl_config/cache.yml") -> Optional["PageCache"]:
+        """
+        Crea la cache dal file di configurazione; restituisce None se disabilitata o assente.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            return None
+        if not config.pop("enabled", True):
+            return None
+        return cls(**config)
+
+    @staticmethod
+    def canonical_url(url: str) -> str:
+        """
+        'https://arxiv.org/html/2508.15260v2' -> 'arxiv:html:2508.15260v2'
+        'https://arxiv.org/abs/2508.15260'    -> 'arxiv:abs:2508.15260'  (ultima versione)
+        Un URL senza versione indica "l'ultima versione": la voce resta valida fino al TTL,
+        quindi una revisione pubblicata nel frattempo non viene vista prima della scadenza.
+        Per gli altri URL: schema e host in minuscolo, senza frammento né '/' finale.
+        """
+        arxiv_id = canonicalize_arxiv_id(url, keep_version=True)
+        if arxiv_id:
+            page = _ARXIV_PAGE_RE.search(url)
+            page_type = "pdf" if url.strip().lower().endswith(".pdf") else (page.group(1).lower() if page else "abs")
+            return f"arxiv:{page_type}:{arxiv_id}"
+        parsed = urlparse(url.strip())
+        return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path.rstrip('/'), parsed.params, parsed.query, ''))
+
+    def key_for(self, url: str) -> str:
+        return hashlib.sha256(self.canonical_url(url).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{kind}.gz")
+
+    def _lookup(self, url: str, kind: str, pin: bool = False) -> Optional[str]:
+        """
+        Percorso del file in cache se la voce esiste e non è scaduta (aggiorna l'ultimo accesso).
+        Con pin=True la voce trovata viene anche bloccata, nella stessa sezione critica del controllo.
+        """
+        key = self.key_for(url)
+        with self._lock:
+            row = self._db.execute("SELECT created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            expired = self.ttl_seconds is not None and time.time() - row[0] > self.ttl_seconds
+            if not self.read_only and expired and key not in self._pins:
+                self._delete(key)
+                self._db.commit()
+                return None
+            if not self.read_only:
+                self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._db.commit()
+
+            path = self._path(key, kind)
+            if not os.path.isfile(path):
+                return None
+            if pin:
+                self._pins[key] += 1
+            return path
+
+    def _read(self, url: str, kind: str) -> Optional[str]:
+        path = self._lookup(url, kind)
+        if path is None:
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return f.read()
+
+    def has_markdown(self, url: str) -> bool:
+        """
+        True se il markdown dell'URL è in cache e valido, senza leggerlo.
+        """
+        return self._lookup(url, "md") is not None
+
+    def pin_markdown(self, url: str) -> bool:
+        """
+        Come has_markdown, ma se il markdown è in cache lo blocca contro scadenza TTL ed eviction
+        finché non viene chiamato unpin: il chunker e il preprocessing lo rileggono più tardi.
+        """
+        return self._lookup(url, "md", pin=True) is not None
+
+    def unpin(self, url: str) -> None:
+        """
+        Rilascia un blocco di pin_markdown (nessun effetto se la voce non è bloccata).
+        """
+        key = self.key_for(url)
+        with self._lock:
+            if self._pins[key] > 1:
+                self._pins[key] -= 1
+            else:
+                self._pins.pop(key, None)
+
+    def open_markdown(self, url: str) -> Optional[BinaryIO]:
+        """
+        Apre il markdown in cache come flusso di byte decompresso al volo (da chiudere dal chiamante),
+        così può essere letto a blocchi senza caricare l'intero documento; None se assente/scaduto.
+        """
+        path = self._lookup(url, "md")
+        return gzip.open(path, "rb") if path is not None else None
+
+    def get_markdown(self, url: str) -> Optional[str]:
+        """
+        Markdown in cache per l'URL, o None se assente/scaduto.
+        """
+        return self._read(url, "md")
+
+    def get_html(self, url: str) -> Optional[str]:
+        """
+        HTML grezzo in cache per l'URL, o None se assente/scaduto.
+        """
+        return self._read(url, "html")
+
+    def put(self, url: str, markdown: str, html: Optional[str] = None) -> None:
+        """
+        Salva markdown (e HTML grezzo se disponibile) per l'URL, poi applica l'eviction per dimensione.
+        """
+        if self.read_only or not markdown:
+            return
+        key = self.key_for(url)
+        os.makedirs(os.path.join(self.cache_dir, key[:2]), exist_ok=True)
+
+        size = 0
+        for kind, content in (("md", markdown), ("html", html)):
+            if content is None:
+                continue
+            path = self._path(key, kind)
+            tmp_path = f"{path}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            size += os.path.getsize(path)
+
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, url, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                (key, url, now, now, size)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _delete(self, key: str) -> None:
+        for kind in ("md", "html"):
+            try:
+                os.remove(self._path(key, kind))
+            except FileNotFoundError:
+                pass
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self) -> None:
+        """
+        Elimina le voci meno recentemente usate finché la cache non rientra in max_bytes
+        (le voci bloccate restano anche se la cache supera temporaneamente il limite).
+        """
+        if self.max_bytes is None:
+            return
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall():
+            if key in self._pins:
+                continue
+            self._delete(key)
+            total -= size
+            print(f"♻️ [PageCache] eliminata voce LRU {key[:12]} ({size} byte)")
+            if total <= self.max_bytes:
+                break
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
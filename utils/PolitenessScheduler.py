@@ -0,0 +1,49 @@
+import time
+import asyncio
+import threading
+
+
+class PolitenessScheduler:
+    '''
+    Garantisce un intervallo minimo tra richieste consecutive verso lo stesso servizio
+    (es. i 3 secondi raccomandati dall'API arXiv).
+    Ogni chiamante prenota uno slot sotto lock, quindi thread e coroutine concorrenti
+    vengono serializzati senza busy waiting.
+    '''
+    def __init__(self, min_interval: float = 3.0):
+        """
+        :param min_interval: secondi minimi tra l'inizio di due richieste consecutive.
+        """
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def _reserve_slot(self) -> float:
+        """
+        Prenota il prossimo slot libero e restituisce i secondi da attendere.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval
+            return slot - now
+
+    def wait(self) -> None:
+        """
+        Attesa bloccante fino allo slot prenotato (per codice sincrono).
+        """
+        delay = self._reserve_slot()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def await_slot(self) -> None:
+        """
+        Attesa non bloccante fino allo slot prenotato (per codice asincrono).
+        """
+        delay = self._reserve_slot()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Scheduler unico condiviso da tutti i client arXiv del processo
+ARXIV_SCHEDULER = PolitenessScheduler(min_interval=3.0)
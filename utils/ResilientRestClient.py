@@ -0,0 +1,344 @@
+import time
+import inspect
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Optional
+
+import requests
+
+from utils.GeminiErrorHandler import RetryPolicy
+
+
+class CircuitOpenError(RuntimeError):
+    """L'endpoint ha il circuito aperto: la chiamata fallisce subito senza raggiungere il backend."""
+
+
+class DeadlineExceededError(RuntimeError):
+    """Il budget di tempo della chiamata (tentativi e attese comprese) è esaurito."""
+
+
+class _AttemptFailed(Exception):
+    """Il backend ha risposto con success: false (errore transitorio, si può riprovare)."""
+
+
+class CircuitBreaker:
+    '''
+    Circuit breaker per endpoint:
+    - closed: le chiamate passano; dopo failure_threshold fallimenti consecutivi si apre;
+    - open: le chiamate falliscono subito per recovery_timeout secondi;
+    - half_open: passa una sola chiamata di prova; se riesce il circuito si chiude,
+      altrimenti si riapre per un altro recovery_timeout.
+    '''
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        True se la chiamata può partire (in half_open solo la prima, come prova).
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """
+        Libera la chiamata di prova senza esito (es. chiamata interrotta da KeyboardInterrupt
+        o da una cancellazione): lo stato non cambia e la prossima chiamata può fare da prova.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class LatencyTracker:
+    '''
+    Latenze recenti delle chiamate riuscite di un endpoint, per la soglia di hedging.
+    '''
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RestLLMEndpoint:
+    '''
+    Endpoint LLM REST minimale: POST {"prompt": ...} -> {"response": ..., "success": true/false}.
+    '''
+    def __init__(self, url: str, timeout: float = 60.0, session: Optional[requests.Session] = None):
+        self.url = url
+        self.endpoint = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def invoke(self, prompt: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        response = self.session.post(self.url, json={"prompt": prompt}, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class ResilientRestClient:
+    '''
+    Client resiliente per backend LLM REST che restituiscono { 'response': ..., 'success': true/false }.
+    - retry con backoff esponenziale e jitter (RetryPolicy condivisa con i nodi Gemini);
+    - circuit breaker per endpoint: un backend degradato non viene bombardato di retry
+      e i chiamanti falliscono subito (CircuitOpenError) invece di restare bloccati;
+    - deadline per chiamata: tentativi e attese non superano il budget (DeadlineExceededError);
+    - hedging opzionale: se la risposta tarda oltre il p95 delle latenze recenti dell'endpoint
+      parte una richiesta duplicata e vince la prima risposta valida (taglia la coda di latenza
+      al costo di qualche richiesta in più; la richiesta perdente termina in background).
+    Deadline e hedging usano il pool di thread solo per i backend il cui invoke accetta un timeout
+    (come RestLLMEndpoint): ogni chiamata riceve il budget residuo e il thread si libera entro la
+    deadline. Gli altri backend sono chiamati nel thread del chiamante, senza hedging, e la deadline
+    è verificata tra un tentativo e l'altro.
+    '''
+    def __init__(self, policy: Optional[RetryPolicy] = None, deadline: Optional[float] = 60.0, failure_threshold: int = 5, recovery_timeout: float = 30.0, hedge: bool = False, hedge_quantile: float = 0.95, hedge_min_samples: int = 20, max_workers: int = 16):
+        """
+        :param policy: parametri di retry e backoff (None = politica di default condivisa).
+        :param deadline: budget in secondi di ogni chiamata, retry compresi (None = nessun limite).
+        :param failure_threshold: fallimenti consecutivi che aprono il circuito di un endpoint.
+        :param recovery_timeout: secondi di circuito aperto prima della chiamata di prova.
+        :param hedge: abilita le richieste duplicate oltre la soglia di latenza.
+        :param hedge_quantile: quantile delle latenze recenti oltre cui duplicare la richiesta.
+        :param hedge_min_samples: campioni di latenza necessari prima di abilitare l'hedging.
+        :param max_workers: thread per le richieste (con deadline o hedging le chiamate con timeout girano nel pool).
+        """
+        self.policy = policy or RetryPolicy(base_delay=0.5, max_delay=10.0)
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rest-llm")
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+
+        self.calls = 0
+        self.attempts = 0
+        self.hedged = 0
+        self.short_circuited = 0
+        self.deadline_exceeded = 0
+
+    @staticmethod
+    def endpoint_key(llm) -> str:
+        return str(getattr(llm, "endpoint", None) or getattr(llm, "base_url", None) or f"{type(llm).__name__}@{id(llm):x}")
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(self.failure_threshold, self.recovery_timeout)
+                self._latencies[key] = LatencyTracker()
+            return self._breakers[key]
+
+    @staticmethod
+    def _is_retryable(e: BaseException) -> bool:
+        """
+        success: false, errori di rete/timeout, HTTP 429 e 5xx; non i 4xx né le risposte malformate.
+        """
+        if isinstance(e, _AttemptFailed):
+            return True
+        if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+            return e.response.status_code == 429 or e.response.status_code >= 500
+        return isinstance(e, requests.exceptions.RequestException)
+
+    @staticmethod
+    def _accepts_timeout(llm) -> bool:
+        """
+        True se llm.invoke ha un parametro 'timeout' esplicito: la chiamata termina entro il budget
+        passato e può girare nel pool senza restare appesa oltre la deadline.
+        """
+        try:
+            return "timeout" in inspect.signature(llm.invoke).parameters
+        except (TypeError, ValueError):
+            return False
+
+    def _call_once(self, llm, prompt, key: str, timeout: Optional[float]) -> Any:
+        started = time.monotonic()
+        result = llm.invoke(prompt, timeout=timeout) if timeout is not None else llm.invoke(prompt)
+        if isinstance(result, dict) and result.get("success") is True:
+            self._latencies[key].add(time.monotonic() - started)
+            return result["response"]
+        if isinstance(result, dict) and result.get("success") is False:
+            raise _AttemptFailed("Il backend ha risposto success: false")
+        raise RuntimeError(f"Formato risposta non riconosciuto: {result}")
+
+    def _attempt(self, llm, prompt, key: str, deadline_at: Optional[float]) -> Any:
+        """
+        Un tentativo, eventualmente con una richiesta duplicata oltre la soglia di hedging.
+        """
+        remaining = None if deadline_at is None else deadline_at - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError(f"Deadline superata per l'endpoint '{key}'")
+        if not self._accepts_timeout(llm):
+            # Una chiamata senza timeout non può essere interrotta: nel pool continuerebbe a occupare
+            # un thread oltre la deadline, quindi gira nel thread del chiamante e senza hedging
+            return self._call_once(llm, prompt, key, None)
+        if remaining is None and not self.hedge:
+            return self._call_once(llm, prompt, key, None)
+
+        futures = {self._executor.submit(self._call_once, llm, prompt, key, remaining)}
+        hedge_after = self._latencies[key].quantile(self.hedge_quantile, self.hedge_min_samples) if self.hedge else None
+        if hedge_after is not None and (remaining is None or hedge_after < remaining):
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                with self._lock:
+                    self.hedged += 1
+                # La richiesta duplicata riceve solo il budget ancora disponibile
+                hedge_remaining = None if deadline_at is None else max(0.001, deadline_at - time.monotonic())
+                futures.add(self._executor.submit(self._call_once, llm, prompt, key, hedge_remaining))
+
+        errors = []
+        while futures:
+            timeout = None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+            done, futures = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceededError(f"Deadline superata per l'endpoint '{key}'")
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(e)
+        raise errors[0]
+
+    def invoke(self, llm, prompt, deadline: Optional[float] = None, max_retries: Optional[int] = None) -> Any:
+        """
+        Chiama l'endpoint con retry, circuit breaker, deadline ed eventuale hedging.
+
+        :param deadline: budget in secondi di questa chiamata (None = quello del client).
+        :return: il campo 'response' della prima risposta con success: true.
+        :raises CircuitOpenError, DeadlineExceededError, RuntimeError.
+        """
+        key = self.endpoint_key(llm)
+        breaker = self.breaker(key)
+        budget = self.deadline if deadline is None else deadline
+        deadline_at = None if budget is None else time.monotonic() + budget
+        max_retries = self.policy.max_retries if max_retries is None else max_retries
+        with self._lock:
+            self.calls += 1
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                with self._lock:
+                    self.short_circuited += 1
+                raise CircuitOpenError(f"Circuito aperto per l'endpoint '{key}'")
+            with self._lock:
+                self.attempts += 1
+            # Ogni tentativo deve chiudere con un esito per il breaker: una chiamata di prova
+            # (half_open) mai risolta lascerebbe il circuito bloccato per sempre
+            settled = False
+            try:
+                result = self._attempt(llm, prompt, key, deadline_at)
+                breaker.record_success()
+                settled = True
+                return result
+            except DeadlineExceededError:
+                breaker.record_failure()
+                settled = True
+                with self._lock:
+                    self.deadline_exceeded += 1
+                raise
+            except Exception as e:
+                if not self._is_retryable(e):
+                    if isinstance(e, requests.exceptions.HTTPError):
+                        # 4xx: l'endpoint è raggiungibile e risponde, è un errore della richiesta
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+                    settled = True
+                    traceback.print_exc()
+                    raise RuntimeError(f"Errore REST: {e}") from e
+                breaker.record_failure()
+                settled = True
+                if attempt >= max_retries:
+                    raise RuntimeError("Max retries exceeded (REST).") from e
+                delay = self.policy.backoff(attempt)
+                if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                    with self._lock:
+                        self.deadline_exceeded += 1
+                    raise DeadlineExceededError(f"Deadline superata per l'endpoint '{key}'") from e
+                print(f"[rest_invoke_with_retry] Tentativo fallito: {e} (retry #{attempt + 1} tra {delay:.2f}s)")
+                time.sleep(delay)
+                attempt += 1
+            finally:
+                if not settled:
+                    breaker.release()
+
+    def rest_invoke_with_retry(self, llm, prompt, max_retries: Optional[int] = None, retry_count: int = 0) -> Any:
+        """
+        Interfaccia dei vecchi RestErrorHandler/RestLLMInvokeErrorHandler.
+        """
+        remaining = None if max_retries is None else max(0, max_retries - retry_count)
+        return self.invoke(llm, prompt, max_retries=remaining)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = list(self._breakers)
+            counters = {
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "hedged": self.hedged,
+                "short_circuited": self.short_circuited,
+                "deadline_exceeded": self.deadline_exceeded,
+            }
+        counters["endpoints"] = {
+            key: {"state": self._breakers[key].state, "p95": self._latencies[key].quantile(0.95)}
+            for key in keys
+        }
+        return counters
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
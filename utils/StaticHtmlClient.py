@@ -0,0 +1,105 @@
+import asyncio
+from typing import Callable, Dict, Optional, Tuple
+
+import aiohttp
+from bs4 import BeautifulSoup
+from crawl4ai.markdown_generation_strategy import DefaultMarkdownGenerator
+
+
+# Tag che non contengono testo del paper (navigazione, script, pulsanti di feedback arXiv)
+_NOISE_TAGS = ["script", "style", "noscript", "nav", "header", "footer", "button", "form"]
+
+
+class StaticHtmlClient:
+    '''
+    Client HTTP asincrono per pagine HTML statiche (es. arxiv.org/html/<id>, output LaTeXML),
+    che non richiedono un browser headless.
+    Mantiene una sessione aiohttp con connessioni keep-alive riutilizzate tra le richieste
+    e converte l'HTML in markdown in-process con lo stesso generatore usato da crawl4ai,
+    così i titoli di sezione ('## ', '### ') sono quelli attesi da SectionChunker.
+    '''
+    def __init__(self, headers_factory: Optional[Callable[[], Dict[str, str]]] = None, max_connections: int = 10, timeout: float = 30.0, min_markdown_chars: int = 2000):
+        """
+        :param headers_factory: funzione che restituisce gli header di ogni richiesta (es. user-agent a rotazione).
+        :param max_connections: connessioni simultanee massime del pool.
+        :param timeout: timeout totale di una richiesta, in secondi.
+        :param min_markdown_chars: sotto questa lunghezza il contenuto è considerato vuoto.
+        """
+        self.headers_factory = headers_factory
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.min_markdown_chars = min_markdown_chars
+        self.markdown_generator = DefaultMarkdownGenerator()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Creata in modo lazy, dentro l'event loop che la userà
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def _headers(self) -> Dict[str, str]:
+        headers = dict(self.headers_factory()) if self.headers_factory else {}
+        # aiohttp decodifica nativamente solo gzip/deflate
+        headers["accept-encoding"] = "gzip, deflate"
+        return headers
+
+    async def fetch_html(self, url: str) -> Optional[str]:
+        """
+        Scarica l'HTML della pagina; restituisce None in caso di errore HTTP o di rete.
+        """
+        try:
+            async with self._get_session().get(url, headers=self._headers()) as response:
+                if response.status != 200:
+                    print(f"⚠️ [StaticHtmlClient] HTTP {response.status} per '{url}'")
+                    return None
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"⚠️ [StaticHtmlClient] errore nel download di '{url}': {e}")
+            return None
+
+    def html_to_markdown(self, html: str, base_url: str = "") -> str:
+        """
+        Estrae il corpo del documento (l'<article> LaTeXML se presente) e lo converte in markdown.
+        """
+        soup = BeautifulSoup(html, "html.parser")
+        for tag in soup(_NOISE_TAGS):
+            tag.decompose()
+        body = soup.find("article") or soup.body or soup
+        result = self.markdown_generator.generate_markdown(str(body), base_url=base_url)
+        return result.raw_markdown
+
+    def looks_empty(self, markdown: Optional[str]) -> bool:
+        """
+        True se il markdown è troppo corto o privo di sezioni: in quel caso serve il browser.
+        """
+        if not markdown or len(markdown) < self.min_markdown_chars:
+            return True
+        return "\n## " not in markdown and "\n### " not in markdown
+
+    async def fetch_page(self, url: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Scarica la pagina e restituisce (html, markdown); il markdown è None se il fetch
+        statico fallisce o il contenuto sembra vuoto (il chiamante userà il browser).
+        """
+        html = await self.fetch_html(url)
+        if html is None:
+            return None, None
+        # Parsing e conversione sono CPU-bound: fuori dall'event loop
+        markdown = await asyncio.to_thread(self.html_to_markdown, html, url)
+        if self.looks_empty(markdown):
+            print(f"⚠️ [StaticHtmlClient] contenuto statico vuoto per '{url}'")
+            return html, None
+        return html, markdown
+
+    async def fetch_markdown(self, url: str) -> Optional[str]:
+        """
+        Come fetch_page, restituendo solo il markdown.
+        """
+        _, markdown = await self.fetch_page(url)
+        return markdown
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,65 @@
+import os
+import json
+import threading
+from typing import Dict, Optional
+
+
+class WatermarkStore:
+    '''
+    Persiste su file JSON, per ogni query di primo livello, il watermark dell'ultimo
+    aggiornamento ingerito: il timestamp più recente di pubblicazione ('published')
+    e di aggiornamento ('updated') visti tra gli articoli salvati.
+    '''
+    def __init__(self, path: str = "data/watermarks.json"):
+        """
+        :param path: percorso del file JSON dei watermark.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._watermarks = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"⚠️ Errore nella lettura dei watermark '{self.path}': {e}")
+            return {}
+
+    def _dump(self) -> None:
+        """
+        Scrittura atomica: file temporaneo + rename, così un'interruzione non corrompe lo store.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._watermarks, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, query: str) -> Optional[Dict[str, str]]:
+        """
+        Restituisce il watermark della query ({'published': ..., 'updated': ...}) o None.
+        """
+        with self._lock:
+            watermark = self._watermarks.get(query)
+            return dict(watermark) if watermark else None
+
+    def update(self, query: str, watermark: Dict[str, str]) -> None:
+        """
+        Avanza il watermark della query; i timestamp non tornano mai indietro.
+        """
+        if not watermark:
+            return
+        with self._lock:
+            current = self._watermarks.get(query, {})
+            for field in ("published", "updated"):
+                value = watermark.get(field)
+                # I timestamp arXiv sono ISO 8601 in UTC, quindi confrontabili come stringhe
+                if value and value > current.get(field, ""):
+                    current[field] = value
+            self._watermarks[query] = current
+            self._dump()
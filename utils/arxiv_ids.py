@@ -0,0 +1,119 @@
+import re
+from typing import Iterable, List, Optional
+
+# Identificativi arXiv:
+# - nuovo formato (dal 2007): YYMM.NNNN (fino al 2014) o YYMM.NNNNN, con versione opzionale vN
+# - vecchio formato: archive[.SUBJ]/YYMMNNN, es. hep-th/9711200 o math.GT/0309136
+NEW_STYLE_ID = r"(?P<new>\d{4}\.\d{4,5})"
+OLD_STYLE_ID = r"(?P<archive>[a-z]+(?:-[a-z]+)?)(?:\.[A-Z]{2})?/(?P<number>\d{7})"
+VERSION = r"(?:v(?P<version>\d+))?"
+
+# Un ID "nudo", eventualmente preceduto dal prefisso 'arXiv:' o da un URL abs/pdf/html
+_CANONICAL_RE = re.compile(
+    r"^\s*(?:arxiv:\s*|(?:https?://)?(?:www\.|export\.)?arxiv\.org/(?:abs|pdf|html)/)?"
+    rf"(?:{NEW_STYLE_ID}|{OLD_STYLE_ID}){VERSION}(?:\.pdf)?/?\s*$",
+    re.IGNORECASE,
+)
+
+
+# Archivi del vecchio formato: la ricerca nel testo accetta solo questi, per non confondere
+# con percorsi qualsiasi del tipo 'parola/1234567'
+OLD_STYLE_ARCHIVES = (
+    "acc-phys", "adap-org", "alg-geom", "ao-sci", "astro-ph", "atom-ph", "bayes-an", "chao-dyn",
+    "chem-ph", "cmp-lg", "comp-gas", "cond-mat", "cs", "dg-ga", "funct-an", "gr-qc", "hep-ex",
+    "hep-lat", "hep-ph", "hep-th", "math", "math-ph", "mtrl-th", "nlin", "nucl-ex", "nucl-th",
+    "patt-sol", "physics", "plasm-ph", "q-alg", "q-bio", "quant-ph", "solv-int", "supr-con",
+)
+_ARCHIVES = "|".join(sorted((re.escape(a) for a in OLD_STYLE_ARCHIVES), key=len, reverse=True))
+
+# Ricerca degli ID dentro un testo libero (es. una voce di bibliografia), in due regex separate
+# per nuovo e vecchio formato: senza IGNORECASE né alternative tentate a ogni posizione,
+# il motore salta rapidamente alle sole sequenze di cifre candidate.
+# Un ID nuovo formato è accettato solo con mese valido (YYMM, MM = 01..12) e non attaccato
+# ad altre cifre o lettere, per escludere numeri di pagina, DOI e simili.
+_FIND_NEW_RE = re.compile(r"(?<![\w-])(?P<new>\d{2}(?:0[1-9]|1[0-2])\.\d{4,5})" + VERSION + r"(?![\d])")
+_FIND_OLD_RE = re.compile(
+    rf"(?<![\w-])(?P<archive>{_ARCHIVES})(?:\.[A-Za-z]{{2}})?/(?P<number>\d{{7}})" + VERSION + r"(?![\d])"
+)
+# Il vecchio formato si cerca solo se nel testo c'è almeno un '/NNNNNNN'
+_OLD_HINT_RE = re.compile(r"/\d{7}")
+# Un ID preceduto da '.' o '/' è valido solo dopo uno di questi prefissi:
+# 'arXiv.' (DOI 10.48550/arXiv.XXXX), URL abs/pdf/html, 'abs/' di CoRR
+_PREFIX_RE = re.compile(r"(?:arxiv\s*[:.]\s*|arxiv\.org/(?:abs|pdf|html)/|\babs/)$", re.IGNORECASE)
+_CORR_RE = re.compile(r"\bcorr\b")
+
+
+def canonicalize_arxiv_id(raw: str, keep_version: bool = False) -> Optional[str]:
+    """
+    Riporta un identificativo arXiv in forma canonica.
+
+    Esempi:
+        'https://arxiv.org/abs/2508.15260v2' -> '2508.15260'
+        'arXiv:hep-th/9711200'             -> 'hep-th/9711200'
+        'http://arxiv.org/pdf/math.GT/0309136v1.pdf' -> 'math/0309136'
+
+    :param raw: ID, ID con prefisso 'arXiv:' o URL abs/pdf/html.
+    :param keep_version: se True mantiene il suffisso di versione (vN) se presente.
+    :return: l'ID canonico, o None se la stringa non è un identificativo arXiv.
+    """
+    if not raw:
+        return None
+    match = _CANONICAL_RE.match(raw)
+    if not match:
+        return None
+    return _format_match(match, keep_version)
+
+
+def _format_match(match: re.Match, keep_version: bool) -> str:
+    if match.groupdict().get("new"):
+        base = match.group("new")
+    else:
+        # La sottoclasse (es. '.GT') non fa parte dell'identificativo
+        base = f"{match.group('archive').lower()}/{match.group('number')}"
+    if keep_version and match.group("version"):
+        return f"{base}v{match.group('version')}"
+    return base
+
+
+def unique_arxiv_ids(raw_ids: Iterable[str], keep_version: bool = False) -> List[str]:
+    """
+    Canonicalizza una sequenza di ID/URL arXiv scartando quelli non validi e i duplicati,
+    mantenendo l'ordine di prima occorrenza.
+    """
+    canonical = (canonicalize_arxiv_id(raw, keep_version) for raw in raw_ids)
+    return list(dict.fromkeys(c for c in canonical if c))
+
+
+def _has_valid_prefix(text: str, start: int) -> bool:
+    if start == 0 or text[start - 1] not in "./":
+        return True
+    return _PREFIX_RE.search(text, max(0, start - 24), start) is not None
+
+
+def find_arxiv_ids(text: str, keep_version: bool = False) -> List[str]:
+    """
+    Trova tutti gli identificativi arXiv in un testo libero e li restituisce in forma canonica,
+    senza duplicati e nell'ordine di prima occorrenza.
+
+    Esempi:
+        'Achiam et al. GPT-4 technical report. arXiv preprint arXiv:2303.08774, 2023.' -> ['2303.08774']
+        'CoRR, abs/2106.09685'                       -> ['2106.09685']
+        'https://doi.org/10.48550/arXiv.2310.06825'  -> ['2310.06825']
+        'Witten, hep-th/9503124'                     -> ['hep-th/9503124']
+    """
+    if not text:
+        return []
+    matches = [m for m in _FIND_NEW_RE.finditer(text) if _has_valid_prefix(text, m.start())]
+    if _OLD_HINT_RE.search(text):
+        matches += [m for m in _FIND_OLD_RE.finditer(text) if _has_valid_prefix(text, m.start())]
+        matches.sort(key=lambda m: m.start())
+    return list(dict.fromkeys(_format_match(match, keep_version) for match in matches))
+
+
+def mentions_arxiv(text: str) -> bool:
+    """
+    True se il testo cita arXiv (o CoRR, che pubblica gli stessi preprint): una voce di
+    bibliografia che lo cita senza un ID riconoscibile va risolta in altro modo (es. LLM).
+    """
+    lowered = text.lower()
+    return "arxiv" in lowered or ("corr" in lowered and _CORR_RE.search(lowered) is not None)
@@ -0,0 +1,76 @@
+import os
+import re
+import atexit
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+# Oltre questa quantità di caratteri in un batch la normalizzazione passa a un pool di processi
+PROCESS_POOL_THRESHOLD_CHARS = 2_000_000
+
+# Confine di paragrafo: una riga vuota (eventualmente con spazi)
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def normalize_text(text: str, keep_paragraphs: bool = False) -> str:
+    """
+    Normalizza un testo per l'indicizzazione: accenti rimossi (NFD + solo ASCII, es. 'à' -> 'a'),
+    tutto in minuscolo, spazi, tabulazioni e newline compressi in un singolo spazio.
+
+    :param text: il testo originale.
+    :param keep_paragraphs: se True mantiene i confini di paragrafo come '\\n\\n'
+                            (usati da TokenBudgetPacker per dividere le sezioni lunghe).
+    :return: il testo normalizzato.
+    """
+    if not text:
+        return ""
+    # Fast path: il testo già ASCII non cambia con NFD + encode('ascii', 'ignore')
+    if not text.isascii():
+        text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('ascii')
+    text = text.lower()
+    if keep_paragraphs:
+        paragraphs = (" ".join(p.split()) for p in _PARAGRAPH_RE.split(text))
+        return "\n\n".join(p for p in paragraphs if p)
+    # split() senza argomenti separa sugli stessi caratteri di \s e scarta quelli ai bordi
+    return " ".join(text.split())
+
+
+def _normalize_many(texts: Sequence[str], keep_paragraphs: bool) -> List[str]:
+    return [normalize_text(text, keep_paragraphs) for text in texts]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+        atexit.register(_pool.shutdown)
+    return _pool
+
+
+def normalize_texts(texts: Sequence[str], keep_paragraphs: bool = False, threshold_chars: int = PROCESS_POOL_THRESHOLD_CHARS) -> List[str]:
+    """
+    Normalizza una lista di testi mantenendo l'ordine.
+    I batch piccoli sono elaborati nel processo corrente; oltre threshold_chars caratteri
+    i testi sono divisi in blocchi ed elaborati in parallelo da un pool di processi
+    (creato al primo uso e riutilizzato).
+
+    :param texts: i testi originali.
+    :param keep_paragraphs: vedi normalize_text.
+    :param threshold_chars: caratteri totali oltre i quali usare il pool di processi.
+    :return: i testi normalizzati, nello stesso ordine.
+    """
+    texts = [text or "" for text in texts]
+    n_cpus = os.cpu_count() or 1
+    # Con una sola CPU il pool aggiunge solo il costo del pickling
+    if n_cpus < 2 or len(texts) < 2 or sum(map(len, texts)) <= threshold_chars:
+        return _normalize_many(texts, keep_paragraphs)
+
+    # Un blocco per worker (x4 per bilanciare testi di lunghezza diversa): pochi round-trip di pickling
+    n_blocks = min(len(texts), n_cpus * 4)
+    size = -(-len(texts) // n_blocks)
+    blocks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    pool = _get_pool()
+    futures = [pool.submit(_normalize_many, block, keep_paragraphs) for block in blocks]
+    return [text for future in futures for text in future.result()]